@@ -0,0 +1,95 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+
+
+class UserCache:
+  '''
+  Bounded LRU of users by id, every entry expiring at its own time.
+  Per process: a save or delete through the ORM invalidates the entry in the process that
+  made it, other processes keep serving the old user for at most max_age seconds.
+  '''
+  def __init__(self, max_size, max_age):
+    self.max_size = max_size
+    self.max_age = max_age
+    self._lock = threading.Lock()
+    self._users = OrderedDict()
+
+  def get(self, user_id):
+    with self._lock:
+      entry = self._users.get(user_id)
+      if entry is None:
+        return None
+      user, expires_at = entry
+      if expires_at <= time.time():
+        del self._users[user_id]
+        return None
+      self._users.move_to_end(user_id)
+      return user
+
+  def set(self, user_id, user, expires_at):
+    with self._lock:
+      self._users[user_id] = (user, min(expires_at, time.time() + self.max_age))
+      self._users.move_to_end(user_id)
+      while len(self._users) > self.max_size:
+        self._users.popitem(last=False)
+
+  def invalidate(self, user_id):
+    with self._lock:
+      self._users.pop(user_id, None)
+
+  def clear(self):
+    with self._lock:
+      self._users.clear()
+
+
+jwt_user_cache = UserCache(settings.JWT_USER_CACHE_SIZE, settings.JWT_USER_CACHE_SECONDS)
+
+
+def user_cache_key(user_id):
+  '''
+  simplejwt keeps int ids as they are in the token and turns any other id into a str, so the
+  claim and the model's id are compared as strings
+  '''
+  return str(user_id)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+  '''
+  JWTAuthentication that caches the user of a token until the token expires, at most
+  JWT_USER_CACHE_SECONDS, so polling with the same user doesn't look it up on every request.
+  Users are cached only once they passed the active check, and saving or deleting a user
+  drops it from the cache.
+  '''
+  def get_user(self, validated_token):
+    user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+    user = jwt_user_cache.get(user_cache_key(user_id)) if user_id is not None else None
+
+    if user is None:
+      user = super().get_user(validated_token)
+      jwt_user_cache.set(user_cache_key(user_id), user, validated_token['exp'])
+    elif getattr(api_settings, 'CHECK_REVOKE_TOKEN', False):
+      from rest_framework_simplejwt.utils import get_md5_hash_password
+      if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+        raise AuthenticationFailed('The user\'s password has been changed.', code='password_changed')
+
+    # requests must not share one instance
+    return copy.copy(user)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_cached_user(sender, instance, **kwargs):
+  # right away so this process stops using the old user, and again on commit in case
+  # a request cached it from the old row in the meantime
+  key = user_cache_key(getattr(instance, api_settings.USER_ID_FIELD))
+  jwt_user_cache.invalidate(key)
+  transaction.on_commit(lambda: jwt_user_cache.invalidate(key))
@@ -40,6 +40,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'django.contrib.gis',
+    'django.contrib.postgres',
     'rest_framework',
     'drones',
     'drf_spectacular',
@@ -68,10 +69,26 @@ CORS_ALLOWED_ORIGINS = [
 
 CORS_ALLOW_CREDENTIALS = True
 
+# How API requests resolve the user of an access token: 'database' looks the user up on every
+# request, 'cached' keeps users in a per-process LRU (backend_task/authentication.py), so other
+# processes see a deactivated user for up to JWT_USER_CACHE_SECONDS, 'stateless' builds a
+# TokenUser from the token's claims without any lookup, so deactivating a user has no effect
+# until their tokens expire
+JWT_AUTH_MODE = config('JWT_AUTH_MODE', default='database')
+JWT_AUTHENTICATION_CLASSES = {
+    'cached': 'backend_task.authentication.CachedJWTAuthentication',
+    'database': 'rest_framework_simplejwt.authentication.JWTAuthentication',
+    'stateless': 'rest_framework_simplejwt.authentication.JWTStatelessUserAuthentication',
+}
+# Cached users are dropped after this many seconds even if their token is still valid,
+# bounding how long other processes serve a user changed elsewhere
+JWT_USER_CACHE_SECONDS = config('JWT_USER_CACHE_SECONDS', cast=int, default=300)
+JWT_USER_CACHE_SIZE = config('JWT_USER_CACHE_SIZE', cast=int, default=10000)
+
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        JWT_AUTHENTICATION_CLASSES[JWT_AUTH_MODE],
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated', 
@@ -128,6 +145,8 @@ WSGI_APPLICATION = 'backend_task.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
+# psycopg 3 is the only driver installed, used by Django, the async ingest engine's pool,
+# the drone feed's LISTEN connection and the COPY writer alike
 
 DATABASES = {
     'default': {
@@ -185,5 +204,55 @@ STATIC_URL = '/static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
-
-
+# Seconds between checks of the no fly zone version stamp by the in-memory zone index
+NO_FLY_ZONE_REFRESH_SECONDS = config('NO_FLY_ZONE_REFRESH_SECONDS', cast=float, default=5)
+
+# Seconds a simplified flight path stays cached for one level of detail, for windows that
+# ended in the past
+FLIGHT_PATH_CACHE_SECONDS = config('FLIGHT_PATH_CACHE_SECONDS', cast=int, default=300)
+# Windows still open are cached per time bucket of this many seconds, so a live path can
+# trail the drone by up to this long. 0 doesn't cache them
+FLIGHT_PATH_LIVE_CACHE_SECONDS = config('FLIGHT_PATH_LIVE_CACHE_SECONDS', cast=int, default=5)
+
+# DroneData is partitioned by day, see the dronedata_partitions management command
+DRONE_DATA_PARTITION_DAYS_AHEAD = config('DRONE_DATA_PARTITION_DAYS_AHEAD', cast=int, default=7)
+DRONE_DATA_RETENTION_DAYS = config('DRONE_DATA_RETENTION_DAYS', cast=int, default=30)
+# Write batched DroneData rows with COPY instead of a bulk INSERT
+DRONE_DATA_COPY = config('DRONE_DATA_COPY', cast=bool, default=False)
+# Store DroneData.raw_data as a delta against a per-drone profile, see drones/compaction.py
+DRONE_DATA_COMPACT_RAW = config('DRONE_DATA_COMPACT_RAW', cast=bool, default=False)
+
+# Per-minute telemetry rollups, see the rollup_telemetry management command
+ROLLUP_GRACE_SECONDS = config('ROLLUP_GRACE_SECONDS', cast=int, default=5)
+ROLLUP_MAX_GAP_SECONDS = config('ROLLUP_MAX_GAP_SECONDS', cast=int, default=10)
+
+# Publish drone state changes from the ingest path to the live feed endpoint
+DRONE_FEED_ENABLED = config('DRONE_FEED_ENABLED', cast=bool, default=True)
+
+# How DroneStatsView counts drones: 'aggregate' runs one conditional COUNT query,
+# 'counters' reads the trigger-maintained fleet counters
+DRONE_STATS_MODE = config('DRONE_STATS_MODE', default='aggregate')
+
+# Default page size of the drone lists when a client asks for keyset pagination
+DRONE_LIST_PAGE_SIZE = config('DRONE_LIST_PAGE_SIZE', cast=int, default=100)
+# Render unpaginated drone lists from value rows instead of DroneSerializer, same JSON
+DRONE_FAST_LIST_RENDERING = config('DRONE_FAST_LIST_RENDERING', cast=bool, default=True)
+
+# Vector tile caching: the drone layer briefly, the no fly zone layer per zone version
+DRONE_TILE_CACHE_SECONDS = config('DRONE_TILE_CACHE_SECONDS', cast=int, default=2)
+NO_FLY_ZONE_TILE_CACHE_SECONDS = config('NO_FLY_ZONE_TILE_CACHE_SECONDS', cast=int, default=86400)
+
+# The clusters endpoint returns individual drones while a viewport holds at most this many
+DRONE_CLUSTER_THRESHOLD = config('DRONE_CLUSTER_THRESHOLD', cast=int, default=500)
+
+# Online drones are those the ingest process's presence tracker flagged with is_online,
+# instead of a last_seen range scan. Needs a listener that runs the tracker
+DRONE_PRESENCE_TRACKING = config('DRONE_PRESENCE_TRACKING', cast=bool, default=False)
+
+# Last known drone state store shared by the ingest process and the web workers:
+# '' disables it, 'redis://host:6379/0' uses a Redis compatible server, 'locmem://' is process-local
+DRONE_STATE_STORE_URL = config('DRONE_STATE_STORE_URL', default='')
+# drones not seen for this many seconds are evicted, 0 keeps every drone
+DRONE_STATE_TTL = config('DRONE_STATE_TTL', cast=int, default=600)
+# list endpoints fall back to the database when the store was not written to for this long
+DRONE_STATE_MAX_STALENESS = config('DRONE_STATE_MAX_STALENESS', cast=float, default=5)
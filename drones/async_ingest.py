@@ -0,0 +1,263 @@
+import asyncio
+import json
+import ssl
+import time
+import aiomqtt
+from decouple import config
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.utils import timezone
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import AsyncConnectionPool
+from .feed import FEED_CHANNEL, feed_payloads
+from .models import Drone, DroneData
+from .services import DroneService, validate_osd_message
+from .state_store import drone_state_store
+from .presence import presence_tracker
+
+TOPIC = "thing/product/+/osd"
+
+# batches are written concurrently, so an upsert never replaces a newer state with an older one,
+# and rows are upserted in serial number order so concurrent batches lock them in the same order
+UPSERT_DRONES_SQL = f'''
+INSERT INTO {Drone._meta.db_table} AS drone (
+  serial_number, created_at, last_seen, last_location, last_height, last_speed, is_dangerous, dangerous_reason
+)
+SELECT
+  serial_number, %(now)s, last_seen, ST_SetSRID(ST_MakePoint(longitude, latitude), 4326)::geography,
+  height, speed, is_dangerous, dangerous_reason
+FROM unnest(
+  %(serials)s::varchar[], %(seen)s::timestamptz[], %(longitudes)s::float8[], %(latitudes)s::float8[],
+  %(heights)s::float8[], %(speeds)s::float8[], %(flags)s::boolean[], %(reasons)s::varchar[]
+) AS message(serial_number, last_seen, longitude, latitude, height, speed, is_dangerous, dangerous_reason)
+ORDER BY serial_number
+ON CONFLICT (serial_number) DO UPDATE SET
+  last_seen = EXCLUDED.last_seen,
+  last_location = EXCLUDED.last_location,
+  last_height = EXCLUDED.last_height,
+  last_speed = EXCLUDED.last_speed,
+  is_dangerous = EXCLUDED.is_dangerous,
+  dangerous_reason = EXCLUDED.dangerous_reason
+WHERE drone.last_seen <= EXCLUDED.last_seen
+RETURNING serial_number, created_at
+'''
+
+INSERT_DRONE_DATA_SQL = f'''
+INSERT INTO {DroneData._meta.db_table} (
+  drone_id, "timestamp", location, latitude, longitude, height, horizontal_speed, raw_data, is_dangerous
+)
+SELECT
+  drone_id, "timestamp", ST_SetSRID(ST_MakePoint(longitude, latitude), 4326)::geography,
+  latitude, longitude, height, speed, raw_data::jsonb, is_dangerous
+FROM unnest(
+  %(serials)s::varchar[], %(timestamps)s::timestamptz[], %(longitudes)s::float8[], %(latitudes)s::float8[],
+  %(heights)s::float8[], %(speeds)s::float8[], %(raw)s::text[], %(flags)s::boolean[]
+) AS message(drone_id, "timestamp", longitude, latitude, height, speed, raw_data, is_dangerous)
+'''
+
+
+def database_conninfo():
+  database = settings.DATABASES['default']
+  return make_conninfo(
+    dbname=database['NAME'],
+    user=database['USER'],
+    password=database['PASSWORD'],
+    host=database['HOST'],
+    port=database['PORT']
+  )
+
+
+class AsyncIngestEngine:
+  '''
+  Consumes OSD messages with an asyncio MQTT client and writes them with psycopg's async
+  connection pool, so many batches can wait on the database at the same time.
+  Messages are grouped in batches of up to batch_size messages or flush_interval seconds,
+  and at most max_in_flight batches are written concurrently. When every slot is taken,
+  consumption pauses until a write finishes, which pushes back on the broker.
+  Danger classification and the state store write-through run in Django's sync thread.
+  '''
+  def __init__(self, max_in_flight=16, batch_size=200, flush_interval=0.05, max_queue_size=100000):
+    self.max_in_flight = max_in_flight
+    self.batch_size = batch_size
+    self.flush_interval = flush_interval
+    self.queue = asyncio.Queue(maxsize=max_queue_size)
+    self.slots = asyncio.Semaphore(max_in_flight)
+    self.in_flight = 0
+    self.writes = set()
+
+  async def run(self):
+    async with AsyncConnectionPool(database_conninfo(), min_size=1, max_size=self.max_in_flight, open=False) as pool:
+      batcher = asyncio.create_task(self._batch(pool))
+      try:
+        await self._consume()
+      finally:
+        await self.queue.put(None)
+        await batcher
+        if self.writes:
+          await asyncio.gather(*self.writes, return_exceptions=True)
+
+  async def _consume(self):
+    while True:
+      try:
+        async with aiomqtt.Client(
+          hostname=config('MQTT_BROKER_HOST'),
+          port=int(config('MQTT_BROKER_PORT')),
+          username=config('MQTT_BROKER_USERNAME'),
+          password=config('MQTT_BROKER_PASSWORD'),
+          tls_context=ssl.create_default_context()
+        ) as client:
+          print("Connected to", config('MQTT_BROKER_HOST'))
+          await client.subscribe(TOPIC)
+          async for message in client.messages:
+            await self._receive(str(message.topic), message.payload)
+      except aiomqtt.MqttError as e:
+        print(f"Lost the MQTT connection: {e}. Reconnecting")
+        await asyncio.sleep(3)
+
+  async def _receive(self, topic, payload):
+    try:
+      data = json.loads(payload)
+    except json.JSONDecodeError as e:
+      print(f"Failed to decode JSON from MQTT message on topic {topic}: {e}. Payload: {payload.decode()}")
+      return
+
+    serial_number = topic.split("/")[2]
+    try:
+      validate_osd_message(data)
+    except ValueError as e:
+      print(f"Dropping message from {serial_number}: {e}")
+      return
+
+    await self.queue.put((serial_number, data, timezone.now()))
+    if settings.DRONE_PRESENCE_TRACKING:
+      presence_tracker.seen(serial_number)
+
+  async def _batch(self, pool):
+    batch = []
+    deadline = None
+
+    while True:
+      timeout = max(0, deadline - time.monotonic()) if batch else None
+      try:
+        item = await asyncio.wait_for(self.queue.get(), timeout=timeout)
+      except asyncio.TimeoutError:
+        await self._dispatch(pool, batch)
+        batch = []
+        continue
+
+      if item is None:
+        await self._dispatch(pool, batch)
+        return
+
+      if not batch:
+        deadline = time.monotonic() + self.flush_interval
+      batch.append(item)
+
+      if len(batch) >= self.batch_size:
+        await self._dispatch(pool, batch)
+        batch = []
+
+  async def _dispatch(self, pool, batch):
+    if not batch:
+      return
+
+    await self.slots.acquire()
+    write = asyncio.create_task(self._write(pool, batch))
+    self.writes.add(write)
+    write.add_done_callback(self.writes.discard)
+
+  async def _write(self, pool, batch):
+    self.in_flight += 1
+    started = time.perf_counter()
+    try:
+      try:
+        drones = await self._write_batch(pool, batch)
+      except Exception as e:
+        print(f"Failed to write batch of {len(batch)} messages: {e!r}. Retrying them one by one")
+        drones = await self._write_one_by_one(pool, batch)
+    finally:
+      self.in_flight -= 1
+      self.slots.release()
+    elapsed = time.perf_counter() - started
+
+    if drones:
+      await sync_to_async(drone_state_store.write_through)(drones)
+
+    print(
+      f"Wrote {len(batch)} messages from {len(drones)} drones in {elapsed * 1000:.1f} ms "
+      f"({self.in_flight} writes in flight, {self.queue.qsize()} queued)"
+    )
+
+  async def _write_one_by_one(self, pool, batch):
+    '''writes the messages of a failed batch separately, so only the failing ones are lost'''
+    drones = []
+    for message in batch:
+      try:
+        drones.extend(await self._write_batch(pool, [message]))
+      except Exception as e:
+        print(f"Dropping message from {message[0]}: {e!r}. Payload: {message[1]}")
+    return drones
+
+  async def _write_batch(self, pool, batch):
+    '''writes one batch in a single transaction and returns the Drone instances whose state changed'''
+    flags, reasons = await sync_to_async(DroneService.classify_danger_batch)(
+      [data['height'] for _, data, _ in batch],
+      [data['horizontal_speed'] for _, data, _ in batch],
+      [data['longitude'] for _, data, _ in batch],
+      [data['latitude'] for _, data, _ in batch]
+    )
+    flags = [bool(flag) for flag in flags]
+
+    # ON CONFLICT can't update the same row twice, so only the latest message of a drone is upserted
+    latest = {}
+    for index, (serial_number, _, _) in enumerate(batch):
+      latest[serial_number] = index
+    indexes = sorted(latest.values(), key=lambda i: batch[i][0])
+
+    drones = {
+      'now': timezone.now(),
+      'serials': [batch[i][0] for i in indexes],
+      'seen': [batch[i][2] for i in indexes],
+      'longitudes': [batch[i][1]['longitude'] for i in indexes],
+      'latitudes': [batch[i][1]['latitude'] for i in indexes],
+      'heights': [batch[i][1]['height'] for i in indexes],
+      'speeds': [batch[i][1]['horizontal_speed'] for i in indexes],
+      'flags': [flags[i] for i in indexes],
+      'reasons': [reasons[i] for i in indexes]
+    }
+    drone_data = {
+      'serials': [serial_number for serial_number, _, _ in batch],
+      'timestamps': [received_at for _, _, received_at in batch],
+      'longitudes': [data['longitude'] for _, data, _ in batch],
+      'latitudes': [data['latitude'] for _, data, _ in batch],
+      'heights': [data['height'] for _, data, _ in batch],
+      'speeds': [data['horizontal_speed'] for _, data, _ in batch],
+      'raw': [json.dumps(data) for _, data, _ in batch],
+      'flags': flags
+    }
+
+    async with pool.connection() as db, db.transaction():
+      cursor = await db.execute(UPSERT_DRONES_SQL, drones)
+      created = dict(await cursor.fetchall())
+      await db.execute(INSERT_DRONE_DATA_SQL, drone_data)
+
+      updated = [
+        Drone(
+          serial_number=batch[i][0],
+          created_at=created[batch[i][0]],
+          last_seen=batch[i][2],
+          last_location=Point(batch[i][1]['longitude'], batch[i][1]['latitude']),
+          last_height=batch[i][1]['height'],
+          last_speed=batch[i][1]['horizontal_speed'],
+          is_dangerous=flags[i],
+          dangerous_reason=reasons[i]
+        )
+        for i in indexes if batch[i][0] in created
+      ]
+
+      if settings.DRONE_FEED_ENABLED:
+        for payload in feed_payloads(updated):
+          await db.execute('SELECT pg_notify(%s, %s)', [FEED_CHANNEL, payload])
+
+    return updated
@@ -0,0 +1,155 @@
+import threading
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Max
+from .models import DroneProfile
+
+# payload keys that are also stored as DroneData columns
+EXTRACTED_KEYS = ['longitude', 'latitude', 'height', 'horizontal_speed']
+
+# delta key listing the profile keys missing from the payload
+ABSENT = '$absent'
+
+
+def _same(value, base):
+  # compares like JSON does, so 1, 1.0 and True are different values
+  if type(value) is not type(base):
+    return False
+  if isinstance(value, list):
+    return len(value) == len(base) and all(_same(a, b) for a, b in zip(value, base))
+  if isinstance(value, dict):
+    return value.keys() == base.keys() and all(_same(value[key], base[key]) for key in value)
+  return value == base
+
+
+def _has_marker(value):
+  if isinstance(value, dict):
+    return ABSENT in value or any(_has_marker(item) for item in value.values())
+  if isinstance(value, list):
+    return any(_has_marker(item) for item in value)
+  return False
+
+
+def strip_extracted(data):
+  '''
+  Drops the keys stored as columns. Only float values are dropped, the column holds them
+  exactly while an integer would come back as a float.
+  '''
+  return {key: value for key, value in data.items() if not (key in EXTRACTED_KEYS and type(value) is float)}
+
+
+def diff(data, base):
+  '''returns the delta that turns the base dict into data, nested dicts are diffed recursively'''
+  delta = {}
+  for key, value in data.items():
+    if key not in base:
+      delta[key] = value
+    elif isinstance(value, dict) and isinstance(base[key], dict):
+      nested = diff(value, base[key])
+      if nested:
+        delta[key] = nested
+    elif not _same(value, base[key]):
+      delta[key] = value
+
+  absent = [key for key in base if key not in data]
+  if absent:
+    delta[ABSENT] = absent
+  return delta
+
+
+def patch(base, delta):
+  '''applies a delta made by diff to the base dict'''
+  absent = delta.get(ABSENT, ())
+  result = {key: value for key, value in base.items() if key not in absent}
+  for key, value in delta.items():
+    if key == ABSENT:
+      continue
+    if isinstance(value, dict) and isinstance(result.get(key), dict):
+      result[key] = patch(result[key], value)
+    else:
+      result[key] = value
+  return result
+
+
+def decode_raw_data(raw_data, profile_fields, row):
+  '''rebuilds the original payload from a compacted raw_data, its profile fields and the row's columns'''
+  data = patch(profile_fields, raw_data)
+  for key in EXTRACTED_KEYS:
+    if key not in data:
+      data[key] = getattr(row, key)
+  return data
+
+
+class RawDataCompactor:
+  '''
+  Encodes OSD payloads as a delta against a per-drone profile.
+  The profile is the first payload of a drone without the extracted keys. When a delta
+  changes more than half of the profile's top level keys, a new profile version is
+  created from the current payload, so fields that rarely change stay deduplicated.
+  Latest profiles are cached per process once the transaction that created them commits.
+  '''
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._profiles = {}
+
+  def encode(self, messages):
+    '''
+    Returns a (raw_data, profile_id) pair per (serial_number, data) message.
+    The drones must already exist, profiles are created in the current transaction.
+    '''
+    profiles = {}
+    encoded = []
+    for serial_number, data in messages:
+      if _has_marker(data):
+        encoded.append((data, None))
+        continue
+
+      stripped = strip_extracted(data)
+      profile = profiles.get(serial_number) or self._get_profile(serial_number)
+      delta = diff(stripped, profile.fields) if profile else None
+
+      if profile is None or len(delta) > len(stripped) / 2:
+        profile = self._create_profile(serial_number, stripped, profile)
+        delta = {}
+
+      profiles[serial_number] = profile
+      encoded.append((delta, profile.pk))
+
+    transaction.on_commit(lambda: self._cache(profiles))
+    return encoded
+
+  def forget(self, serial_numbers):
+    with self._lock:
+      for serial_number in serial_numbers:
+        self._profiles.pop(serial_number, None)
+
+  def _cache(self, profiles):
+    with self._lock:
+      self._profiles.update(profiles)
+
+  def _get_profile(self, serial_number):
+    with self._lock:
+      profile = self._profiles.get(serial_number)
+    if profile is None:
+      profile = DroneProfile.objects.filter(drone_id=serial_number).order_by('-version').first()
+    return profile
+
+  def _create_profile(self, serial_number, fields, previous):
+    version = previous.version + 1 if previous else 1
+    while True:
+      try:
+        with transaction.atomic():
+          return DroneProfile.objects.create(drone_id=serial_number, version=version, fields=fields)
+      except IntegrityError:
+        # another process created this version first
+        version = (DroneProfile.objects.filter(drone_id=serial_number).aggregate(version=Max('version'))['version'] or 0) + 1
+
+
+raw_data_compactor = RawDataCompactor()
+
+
+def encode_raw_data(messages):
+  '''returns a (raw_data, profile_id) pair per (serial_number, data) message, compacted when DRONE_DATA_COMPACT_RAW is set'''
+  if not settings.DRONE_DATA_COMPACT_RAW:
+    return [(data, None) for _, data in messages]
+  return raw_data_compactor.encode(messages)
@@ -0,0 +1,39 @@
+from .services import DroneService
+
+
+def fleet_etag(request, *args, **kwargs):
+  '''
+  ETag of the views that read the drone table, the fleet version taken by every write to it.
+  Costs one sequence read, so an unchanged poll never runs the list query or the serializer.
+  A list served by the state store can trail the version until the commit's write-through,
+  the next write to the fleet moves the ETag on again.
+  No ETag is sent while a write is committing, so its old rows can't be cached under its version.
+  '''
+  version = DroneService.get_fleet_version()
+  if version is None:
+    return None
+  return f'fleet-{version}'
+
+
+def online_fleet_etag(request, *args, **kwargs):
+  '''
+  ETag of the views whose response depends on which drones are online. Drones only join the
+  online set by a write, which moves the fleet version, but they leave it as time passes.
+  The next to leave is the least recently seen online drone, so its last_seen, read from
+  the last_seen index, is part of the ETag and changes exactly when the set can shrink.
+  '''
+  etag = fleet_etag(request)
+  if etag is None:
+    return None
+  oldest = DroneService.get_online_drones().order_by('last_seen').values_list('last_seen', flat=True).first()
+  oldest = f'{oldest.timestamp():.6f}' if oldest else 'none'
+  return f'{etag}-{oldest}'
+
+
+def drone_etag(request, serial_number, *args, **kwargs):
+  '''ETag of a single drone, its creation time tells apart a drone deleted and created again'''
+  version = DroneService.get_drone_version(serial_number)
+  if version is None:
+    return None
+  created_at, version = version
+  return f'drone-{created_at.timestamp():.6f}-{version}'
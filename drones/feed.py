@@ -0,0 +1,157 @@
+import asyncio
+import json
+import threading
+import time
+import psycopg
+from django.conf import settings
+from django.db import connection
+
+FEED_CHANNEL = 'drone_feed'
+# NOTIFY payloads must stay below 8000 bytes
+MAX_PAYLOAD_SIZE = 7000
+KEEP_ALIVE_SECONDS = 15
+
+
+def drone_delta(drone):
+  return {
+    'serial_number': drone.serial_number,
+    'last_seen': drone.last_seen.isoformat(),
+    'longitude': drone.last_location.x,
+    'latitude': drone.last_location.y,
+    'height': drone.last_height,
+    'speed': drone.last_speed,
+    'is_dangerous': drone.is_dangerous,
+    'dangerous_reason': drone.dangerous_reason
+  }
+
+
+def feed_payloads(drones):
+  '''returns the deltas of the given drones as JSON arrays that each fit in one NOTIFY payload'''
+  payloads = []
+  chunk = []
+  size = 0
+  for drone in drones:
+    delta = json.dumps(drone_delta(drone))
+    if chunk and size + len(delta) + 1 > MAX_PAYLOAD_SIZE:
+      payloads.append('[' + ','.join(chunk) + ']')
+      chunk = []
+      size = 0
+    chunk.append(delta)
+    size += len(delta) + 1
+
+  if chunk:
+    payloads.append('[' + ','.join(chunk) + ']')
+  return payloads
+
+
+def publish_drone_updates(drones):
+  '''
+  Sends the new state of the given drones to feed subscribers in every web process.
+  Deltas go through PostgreSQL NOTIFY, so they are delivered only once the surrounding
+  transaction commits.
+  '''
+  if not settings.DRONE_FEED_ENABLED:
+    return
+
+  with connection.cursor() as cursor:
+    for payload in feed_payloads(drones):
+      cursor.execute('SELECT pg_notify(%s, %s)', [FEED_CHANNEL, payload])
+
+
+class Subscription:
+  def __init__(self, loop, bbox=None, serials=None, max_pending=100):
+    self.loop = loop
+    self.bbox = bbox
+    self.serials = serials
+    self.queue = asyncio.Queue(maxsize=max_pending)
+
+  def matches(self, delta):
+    if self.serials and delta['serial_number'] not in self.serials:
+      return False
+    if self.bbox:
+      min_lon, min_lat, max_lon, max_lat = self.bbox
+      return min_lon <= delta['longitude'] <= max_lon and min_lat <= delta['latitude'] <= max_lat
+    return True
+
+  def put(self, deltas):
+    # a slow client loses its oldest pending deltas instead of holding memory
+    if self.queue.full():
+      self.queue.get_nowait()
+    self.queue.put_nowait(deltas)
+
+
+class DroneFeedHub:
+  '''
+  In-process pub/sub for drone deltas.
+  A background thread LISTENs on the feed channel with its own database connection
+  and fans every notification out to the subscriptions of this process.
+  '''
+  def __init__(self):
+    self._subscriptions = set()
+    self._lock = threading.Lock()
+    self._thread = None
+
+  def subscribe(self, bbox=None, serials=None):
+    subscription = Subscription(asyncio.get_running_loop(), bbox=bbox, serials=serials)
+    with self._lock:
+      self._subscriptions.add(subscription)
+      if self._thread is None:
+        self._thread = threading.Thread(target=self._listen, name='drone-feed-listener', daemon=True)
+        self._thread.start()
+    return subscription
+
+  def unsubscribe(self, subscription):
+    with self._lock:
+      self._subscriptions.discard(subscription)
+
+  def publish(self, deltas):
+    with self._lock:
+      subscriptions = list(self._subscriptions)
+
+    for subscription in subscriptions:
+      matched = [delta for delta in deltas if subscription.matches(delta)]
+      if matched:
+        subscription.loop.call_soon_threadsafe(subscription.put, matched)
+
+  async def stream(self, bbox=None, serials=None):
+    '''yields server-sent events with the deltas matching the filters'''
+    subscription = self.subscribe(bbox=bbox, serials=serials)
+    try:
+      yield 'retry: 3000\n\n'
+      while True:
+        try:
+          deltas = await asyncio.wait_for(subscription.queue.get(), timeout=KEEP_ALIVE_SECONDS)
+        except asyncio.TimeoutError:
+          yield ': keep-alive\n\n'
+          continue
+        yield f'event: drones\ndata: {json.dumps(deltas)}\n\n'
+    finally:
+      self.unsubscribe(subscription)
+
+  def _listen(self):
+    database = settings.DATABASES['default']
+    while True:
+      listen_connection = None
+      try:
+        listen_connection = psycopg.connect(
+          dbname=database['NAME'],
+          user=database['USER'],
+          password=database['PASSWORD'],
+          host=database['HOST'],
+          port=database['PORT'],
+          autocommit=True
+        )
+        listen_connection.execute(f'LISTEN {FEED_CHANNEL}')
+
+        while True:
+          # returns every KEEP_ALIVE_SECONDS without a notification, so a dead connection is noticed
+          for notify in listen_connection.notifies(timeout=KEEP_ALIVE_SECONDS):
+            self.publish(json.loads(notify.payload))
+      except Exception as e:
+        print(f"Drone feed listener lost its database connection: {e}. Reconnecting")
+        if listen_connection:
+          listen_connection.close()
+        time.sleep(3)
+
+
+drone_feed_hub = DroneFeedHub()
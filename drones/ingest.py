@@ -0,0 +1,101 @@
+import queue
+import threading
+import time
+from django.db import close_old_connections
+from django.utils import timezone
+from .services import DroneService, validate_osd_message
+
+_STOP = object()
+
+
+class BatchWriter:
+  '''
+  Collects OSD messages from the MQTT network thread and writes them to the database
+  in batches from a background thread.
+  A batch is flushed once it holds batch_size messages or flush_interval seconds after
+  its first message arrived, whichever comes first.
+  '''
+  def __init__(self, batch_size=500, flush_interval=0.2, max_queue_size=100000):
+    self.batch_size = batch_size
+    self.flush_interval = flush_interval
+    # a bounded queue blocks on_message when the writer falls behind,
+    # which pushes back on the broker instead of growing memory without limit
+    self.queue = queue.Queue(maxsize=max_queue_size)
+    self.thread = threading.Thread(target=self._run, name='drone-batch-writer', daemon=True)
+
+  def start(self):
+    self.thread.start()
+
+  def submit(self, serial_number, data):
+    '''queues a message, a malformed one is logged and dropped so it can't fail a batch'''
+    try:
+      validate_osd_message(data)
+    except ValueError as e:
+      print(f"Dropping message from {serial_number}: {e}")
+      return
+    self.queue.put((serial_number, data, timezone.now()))
+
+  def stop(self):
+    '''flushes whatever is still queued and waits for the writer thread to finish'''
+    self.queue.put(_STOP)
+    self.thread.join()
+
+  def _run(self):
+    batch = []
+    deadline = None
+
+    while True:
+      timeout = max(0, deadline - time.monotonic()) if batch else None
+      try:
+        item = self.queue.get(timeout=timeout)
+      except queue.Empty:
+        self._flush(batch)
+        batch = []
+        continue
+
+      if item is _STOP:
+        self._flush(batch)
+        return
+
+      if not batch:
+        deadline = time.monotonic() + self.flush_interval
+      batch.append(item)
+
+      if len(batch) >= self.batch_size:
+        self._flush(batch)
+        batch = []
+
+  def _flush(self, batch):
+    if not batch:
+      return
+
+    # drop connections that were closed by the server or broken by a failed flush
+    close_old_connections()
+
+    started = time.perf_counter()
+    try:
+      drones_count = DroneService.process_drone_messages(batch)
+    except Exception as e:
+      print(f"Failed to write batch of {len(batch)} messages: {e!r}. Retrying them one by one")
+      self._write_one_by_one(batch)
+      return
+    elapsed = time.perf_counter() - started
+
+    oldest_age = (timezone.now() - batch[0][2]).total_seconds()
+    print(
+      f"Flushed {len(batch)} messages from {drones_count} drones in {elapsed * 1000:.1f} ms "
+      f"({len(batch) / elapsed:.0f} msg/s, oldest message {oldest_age * 1000:.0f} ms old, "
+      f"{self.queue.qsize()} queued)"
+    )
+
+  def _write_one_by_one(self, batch):
+    '''writes the messages of a failed batch separately, so only the failing ones are lost'''
+    written = 0
+    for message in batch:
+      close_old_connections()
+      try:
+        DroneService.process_drone_messages([message])
+        written += 1
+      except Exception as e:
+        print(f"Dropping message from {message[0]}: {e!r}. Payload: {message[1]}")
+    print(f"Wrote {written} of {len(batch)} messages of the failed batch")
@@ -0,0 +1,273 @@
+import json
+import math
+import random
+import resource
+import statistics
+import time
+from datetime import datetime
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.authentication import JWTAuthentication, JWTStatelessUserAuthentication
+from rest_framework_simplejwt.tokens import AccessToken
+from backend_task.authentication import CachedJWTAuthentication, jwt_user_cache, user_cache_key
+from simulate_drone_data import SimulatedDrone
+from ...models import Drone
+from ...services import DroneService
+from ...serializers import DroneSerializer, render_drone_rows
+from ...state_store import rendered_list_response
+
+SERIAL_PREFIX = 'BENCH-'
+
+
+def streamed_content(response):
+  '''reads a streaming response, the flight path streams from an async iterator'''
+  if not response.is_async:
+    return b''.join(response.streaming_content)
+
+  async def read():
+    return b''.join([chunk async for chunk in response.streaming_content])
+  return async_to_sync(read)()
+
+
+class QueryCounter:
+  '''
+  Counts the queries run inside connection.execute_wrapper(counter). Unlike
+  CaptureQueriesContext it keeps no query log, so long runs aren't capped at the log's size.
+  '''
+  def __init__(self):
+    self.count = 0
+
+  def __call__(self, execute, sql, params, many, context):
+    self.count += 1
+    return execute(sql, params, many, context)
+
+
+def measure(operation, repeats):
+  '''
+  Runs operation repeats times with the queries counted, then repeats times timed without
+  any wrapper around the cursor, returns the latencies of the timed run and the query count
+  '''
+  counter = QueryCounter()
+  with connection.execute_wrapper(counter):
+    for _ in range(repeats):
+      operation()
+
+  latencies = []
+  for _ in range(repeats):
+    started = time.perf_counter()
+    operation()
+    latencies.append(time.perf_counter() - started)
+  return latencies, counter.count
+
+
+def tile_at(longitude, latitude, zoom):
+  '''x, y of the web mercator tile holding the point at zoom'''
+  n = 2 ** zoom
+  x = int((longitude + 180) / 360 * n)
+  y = int((1 - math.asinh(math.tan(math.radians(latitude))) / math.pi) / 2 * n)
+  return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def summarize(latencies, queries, count):
+  '''latencies in seconds, returns a dict of millisecond percentiles and per-item query counts'''
+  latencies = sorted(latencies)
+  percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+  return {
+    'count': count,
+    'p50_ms': percentiles[49] * 1000,
+    'p99_ms': percentiles[98] * 1000,
+    'queries_per_item': queries / count if count else 0
+  }
+
+
+class Command(BaseCommand):
+  help = (
+    'Benchmarks the ingest path, the read endpoints, drone list serialization or JWT authentication '
+    'with seeded simulated drones. '
+    'Writes BENCH- drones to the configured database and deletes them afterwards.'
+  )
+
+  def add_arguments(self, parser):
+    parser.add_argument('mode', choices=['ingest', 'read', 'serialize', 'auth'])
+    parser.add_argument('--drones', type=int, default=100, help='Number of simulated drones.')
+    parser.add_argument('--messages', type=int, default=5000, help='Messages to ingest (ingest mode).')
+    parser.add_argument('--batch-size', type=int, default=1, help='1 ingests message by message, larger values use the batched path.')
+    parser.add_argument('--history', type=int, default=100, help='Messages stored per drone before reading (read mode).')
+    parser.add_argument('--requests', type=int, default=50, help='Requests per endpoint (read mode), renders per path (serialize mode) or requests per backend (auth mode).')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    parser.add_argument('--keep', action='store_true', help="Don't delete the benchmark drones afterwards.")
+
+  def handle(self, *args, **options):
+    random.seed(options['seed'])
+    self.drones = [SimulatedDrone(f'{SERIAL_PREFIX}{i:06d}') for i in range(options['drones'])]
+
+    if settings.DEBUG:
+      self.stderr.write('DEBUG is on, Django logs every query and the latencies include the logging.')
+
+    try:
+      if options['mode'] == 'ingest':
+        results = self.benchmark_ingest(options['messages'], options['batch_size'])
+      elif options['mode'] == 'read':
+        results = self.benchmark_read(options['history'], options['requests'])
+      elif options['mode'] == 'serialize':
+        results = self.benchmark_serialize(options['requests'])
+      else:
+        results = self.benchmark_auth(options['requests'])
+    finally:
+      if not options['keep']:
+        Drone.objects.filter(serial_number__startswith=SERIAL_PREFIX).delete()
+
+    report = {
+      'mode': options['mode'],
+      'started_at': datetime.now().isoformat(),
+      'options': {name: options[name] for name in ['drones', 'messages', 'batch_size', 'history', 'requests', 'seed']},
+      'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+      'results': results
+    }
+
+    self.stdout.write(json.dumps(report, indent=2))
+    if options['output']:
+      with open(options['output'], 'w') as output:
+        json.dump(report, output, indent=2)
+
+  def generate_messages(self, count):
+    messages = []
+    for i in range(count):
+      drone = self.drones[i % len(self.drones)]
+      drone.update(1)
+      messages.append((drone.serial, drone.generate_data()))
+    return messages
+
+  def ingest(self, messages, batch_size):
+    '''ingests the messages, returns the latency of every message and the elapsed seconds'''
+    latencies = []
+    started = time.perf_counter()
+    if batch_size == 1:
+      for serial_number, data in messages:
+        message_started = time.perf_counter()
+        DroneService.process_drone_message(serial_number=serial_number, data=data)
+        latencies.append(time.perf_counter() - message_started)
+    else:
+      for start in range(0, len(messages), batch_size):
+        now = timezone.now()
+        batch = [(serial_number, data, now) for serial_number, data in messages[start:start + batch_size]]
+        batch_started = time.perf_counter()
+        DroneService.process_drone_messages(batch)
+        # every message in a batch waits for the whole flush
+        latencies.extend([time.perf_counter() - batch_started] * len(batch))
+    return latencies, time.perf_counter() - started
+
+  def benchmark_ingest(self, count, batch_size):
+    # the counted run also creates the drones, the timed run then updates them like a live feed
+    counter = QueryCounter()
+    with connection.execute_wrapper(counter):
+      self.ingest(self.generate_messages(count), batch_size)
+
+    latencies, elapsed = self.ingest(self.generate_messages(count), batch_size)
+    results = summarize(latencies, counter.count, count)
+    results['messages_per_second'] = count / elapsed
+    return results
+
+  def benchmark_read(self, history, requests):
+    messages = self.generate_messages(history * len(self.drones))
+    for start in range(0, len(messages), 1000):
+      now = timezone.now()
+      DroneService.process_drone_messages([(serial_number, data, now) for serial_number, data in messages[start:start + 1000]])
+
+    user, created = get_user_model().objects.get_or_create(username='benchmark')
+    client = APIClient(SERVER_NAME='localhost')
+    client.force_authenticate(user=user)
+
+    sample = self.drones[0]
+    tile_zoom = 12
+    tile_x, tile_y = tile_at(sample.longitude, sample.latitude, tile_zoom)
+    bbox = f'{sample.longitude - 0.5},{sample.latitude - 0.5},{sample.longitude + 0.5},{sample.latitude + 0.5}'
+    endpoints = {
+      'drones-list': (reverse('drones-list'), {}),
+      'drones-search': (reverse('drones-list'), {'search': SERIAL_PREFIX + '0000', 'search_mode': 'prefix'}),
+      'online-drones-list': (reverse('online-drones-list'), {}),
+      'dangerous-drones-list': (reverse('dangerous-drones-list'), {}),
+      'drones-within-5km-from-point': (reverse('drones-within-5km-from-point'), {'longitude': sample.longitude, 'latitude': sample.latitude}),
+      'drones-nearby-radius': (reverse('drones-nearby'), {'longitude': sample.longitude, 'latitude': sample.latitude, 'radius': 5000}),
+      'drones-nearby-k': (reverse('drones-nearby'), {'longitude': sample.longitude, 'latitude': sample.latitude, 'k': 10}),
+      'drones-nearby-bbox': (reverse('drones-nearby'), {'bbox': bbox}),
+      'drone-clusters': (reverse('drone-clusters'), {'bbox': bbox, 'zoom': 10}),
+      'drone-tile': (reverse('drone-tile', kwargs={'z': tile_zoom, 'x': tile_x, 'y': tile_y}), {}),
+      'drone-stats': (reverse('drone-stats'), {}),
+      'drone-detail': (reverse('drone-detail', kwargs={'serial_number': sample.serial}), {}),
+      'drone-flight-path': (reverse('drone-flight-path', kwargs={'serial_number': sample.serial}), {}),
+      'drone-rollups': (reverse('drone-rollups', kwargs={'serial_number': sample.serial}), {}),
+    }
+
+    results = {}
+    for name, (url, params) in endpoints.items():
+      last = {}
+
+      def get():
+        response = client.get(url, params)
+        last['status'] = response.status_code
+        last['size'] = len(streamed_content(response) if response.streaming else response.content)
+
+      latencies, queries = measure(get, requests)
+      results[name] = summarize(latencies, queries, requests)
+      results[name]['status'] = last['status']
+      results[name]['response_bytes'] = last['size']
+
+    if created:
+      user.delete()
+    return results
+
+  def benchmark_serialize(self, renders):
+    '''renders the benchmark drones as a JSON list through DroneSerializer and through render_drone_rows'''
+    messages = self.generate_messages(len(self.drones))
+    DroneService.process_drone_messages([(serial_number, data, timezone.now()) for serial_number, data in messages])
+    queryset = Drone.objects.filter(serial_number__startswith=SERIAL_PREFIX).order_by('serial_number')
+
+    paths = {
+      'serializer': lambda: JSONRenderer().render(DroneSerializer(queryset.all(), many=True).data),
+      'fast': lambda: rendered_list_response(render_drone_rows(queryset.all())).content
+    }
+
+    results = {}
+    bodies = {}
+    for name, render in paths.items():
+      def render_body():
+        bodies[name] = render()
+
+      latencies, queries = measure(render_body, renders)
+      results[name] = summarize(latencies, queries, renders)
+      results[name]['us_per_row'] = statistics.median(latencies) / len(self.drones) * 1000000
+      results[name]['response_bytes'] = len(bodies[name])
+
+    results['identical'] = bodies['serializer'] == bodies['fast']
+    return results
+
+  def benchmark_auth(self, requests):
+    '''times authenticating a request with a bearer token through each JWT backend'''
+    user, created = get_user_model().objects.get_or_create(username='benchmark')
+    token = AccessToken.for_user(user)
+    request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {token}')
+    jwt_user_cache.invalidate(user_cache_key(user.pk))
+
+    backends = {
+      'database': JWTAuthentication(),
+      'cached': CachedJWTAuthentication(),
+      'stateless': JWTStatelessUserAuthentication()
+    }
+
+    results = {}
+    for name, backend in backends.items():
+      latencies, queries = measure(lambda: backend.authenticate(request), requests)
+      results[name] = summarize(latencies, queries, requests)
+
+    if created:
+      user.delete()
+    return results
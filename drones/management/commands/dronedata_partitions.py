@@ -0,0 +1,123 @@
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from ...models import DroneData
+from ...partitions import get_partitions, overlaps
+
+
+class Command(BaseCommand):
+  help = (
+    'Creates upcoming daily DroneData partitions and drops or detaches the ones past the retention period. '
+    'Rows already in the default partition for a new day are moved into it, and expired rows in the '
+    'default and legacy partitions are deleted.'
+  )
+
+  def add_arguments(self, parser):
+    parser.add_argument('--days-ahead', type=int, default=settings.DRONE_DATA_PARTITION_DAYS_AHEAD, help='Number of future days to create partitions for.')
+    parser.add_argument('--retention-days', type=int, default=settings.DRONE_DATA_RETENTION_DAYS, help='Days of telemetry to keep, 0 keeps everything.')
+    parser.add_argument('--detach', action='store_true', help='Detach expired partitions instead of dropping them.')
+    parser.add_argument('--dry-run', action='store_true', help='Only print what would be done.')
+
+  def handle(self, *args, **options):
+    table = DroneData._meta.db_table
+    partitions, default = get_partitions(table)
+    today = timezone.now().date()
+
+    for offset in range(options['days_ahead'] + 1):
+      day = today + timedelta(days=offset)
+      start = datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+      end = start + timedelta(days=1)
+
+      # days already covered, e.g. by the legacy partition, are skipped
+      if any(overlaps(start, end, lower, upper) for _, lower, upper in partitions):
+        continue
+
+      name = f'{table}_p{day:%Y%m%d}'
+      self.stdout.write(f'Creating partition {name}')
+      if not options['dry_run']:
+        self.create_partition(table, name, default, start, end)
+      elif default:
+        count = self.count_rows(default, start, end)
+        if count:
+          self.stdout.write(f'Would move {count} rows from {default} into {name}')
+
+    if not options['retention_days']:
+      return
+
+    cutoff = timezone.now() - timedelta(days=options['retention_days'])
+    for name, lower, upper in partitions:
+      if upper is None or upper > cutoff:
+        # the legacy partition starts at MINVALUE, it can hold expired rows long before it expires
+        if lower is None:
+          self.delete_expired_rows(name, cutoff, options)
+        continue
+
+      if options['detach']:
+        self.stdout.write(f'Detaching partition {name}')
+        sql = f'ALTER TABLE "{table}" DETACH PARTITION "{name}"'
+      else:
+        self.stdout.write(f'Dropping partition {name}')
+        sql = f'DROP TABLE "{name}"'
+
+      if not options['dry_run']:
+        with transaction.atomic(), connection.cursor() as cursor:
+          cursor.execute(sql)
+
+    if default:
+      self.delete_expired_rows(default, cutoff, options)
+
+  def create_partition(self, table, name, default, start, end):
+    '''
+    Creates the partition for [start, end). Postgres refuses to create it while the default
+    partition holds rows in that range, so they are moved out first, in the same transaction
+    and with the default partition locked so no new row for the range lands in it meanwhile.
+    '''
+    with transaction.atomic(), connection.cursor() as cursor:
+      moved = 0
+      if default:
+        cursor.execute(f'LOCK TABLE "{default}" IN ACCESS EXCLUSIVE MODE')
+        cursor.execute(
+          f'''
+          CREATE TEMPORARY TABLE drones_dronedata_moved AS
+          WITH moved AS (DELETE FROM "{default}" WHERE "timestamp" >= %s AND "timestamp" < %s RETURNING *)
+          SELECT * FROM moved
+          ''',
+          [start, end]
+        )
+        moved = cursor.rowcount
+
+      cursor.execute(
+        f'CREATE TABLE "{name}" PARTITION OF "{table}" FOR VALUES FROM (%s) TO (%s)',
+        [start, end]
+      )
+
+      if default:
+        cursor.execute(f'INSERT INTO "{table}" SELECT * FROM drones_dronedata_moved')
+        cursor.execute('DROP TABLE drones_dronedata_moved')
+      if moved:
+        self.stdout.write(f'Moved {moved} rows from {default} into {name}')
+
+  def delete_expired_rows(self, name, cutoff, options):
+    '''deletes the rows before the cutoff from a partition that can't be dropped as a whole'''
+    if options['dry_run'] or options['detach']:
+      count = self.count_rows(name, None, cutoff)
+      if count:
+        # detaching is for keeping expired telemetry, so those rows are left in place
+        action = 'Would delete' if options['dry_run'] and not options['detach'] else 'Keeping'
+        self.stdout.write(f'{action} {count} expired rows in {name}')
+      return
+
+    with transaction.atomic(), connection.cursor() as cursor:
+      cursor.execute(f'DELETE FROM "{name}" WHERE "timestamp" < %s', [cutoff])
+      if cursor.rowcount:
+        self.stdout.write(f'Deleted {cursor.rowcount} expired rows in {name}')
+
+  def count_rows(self, name, start, end):
+    with connection.cursor() as cursor:
+      cursor.execute(
+        f'SELECT count(*) FROM "{name}" WHERE (%s::timestamptz IS NULL OR "timestamp" >= %s) AND "timestamp" < %s',
+        [start, start, end]
+      )
+      return cursor.fetchone()[0]
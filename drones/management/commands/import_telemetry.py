@@ -0,0 +1,117 @@
+import json
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.contrib.gis.geos import Point
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+from django.utils import timezone
+from ...copy_writer import copy_drone_data
+from ...models import Drone, DroneData
+from ...partitions import get_partitions
+from ...services import DroneService, validate_osd_message
+
+
+class Command(BaseCommand):
+  help = (
+    'Loads historical telemetry from NDJSON files into DroneData with COPY. '
+    'Each line is {"serial_number": ..., "timestamp": ISO 8601, "data": OSD payload}. '
+    'Drones missing from the database are created from their latest imported message, '
+    'the last known state of existing drones is left untouched. '
+    'Rows of days without a daily partition land in the default partition and are reported.'
+  )
+
+  def add_arguments(self, parser):
+    parser.add_argument('files', nargs='+', help='NDJSON files to import.')
+    parser.add_argument('--chunk-size', type=int, default=50000, help='Rows written per COPY transaction.')
+
+  def handle(self, *args, **options):
+    total = 0
+    unpartitioned = 0
+    started = time.perf_counter()
+    self.partitions, default = get_partitions(DroneData._meta.db_table)
+    self.partitioned_days = {}
+
+    for path in options['files']:
+      with open(path) as file:
+        chunk = []
+        for line_number, line in enumerate(file, start=1):
+          if not line.strip():
+            continue
+          row = self.parse_line(path, line_number, line)
+          if not self.is_partitioned(row[1]):
+            unpartitioned += 1
+          chunk.append(row)
+          if len(chunk) == options['chunk_size']:
+            total += self.write_chunk(chunk)
+            chunk = []
+        total += self.write_chunk(chunk)
+
+    elapsed = time.perf_counter() - started
+    self.stdout.write(f'Imported {total} rows in {elapsed:.1f} s ({total / elapsed if elapsed else 0:.0f} rows/s)')
+    if unpartitioned:
+      self.stderr.write(
+        f'{unpartitioned} rows are of days without a daily partition and went to {default}. '
+        'Rows of upcoming days move into their partition when dronedata_partitions creates it, '
+        'rows of earlier days stay in the default partition until they expire.'
+      )
+
+  def parse_line(self, path, line_number, line):
+    try:
+      message = json.loads(line)
+      timestamp = parse_datetime(message['timestamp'])
+      data = message['data']
+      serial_number = message['serial_number']
+      validate_osd_message(data)
+    except (ValueError, KeyError, TypeError) as e:
+      raise CommandError(f'{path}:{line_number}: invalid telemetry line: {e}')
+
+    if timestamp is None:
+      raise CommandError(f'{path}:{line_number}: invalid timestamp {message["timestamp"]!r}')
+    if timezone.is_naive(timestamp):
+      timestamp = timezone.make_aware(timestamp)
+
+    return serial_number, timestamp, data
+
+  def is_partitioned(self, timestamp):
+    '''whether a daily or the legacy partition holds the day of timestamp, memoized per day'''
+    day = timestamp.astimezone(dt_timezone.utc).date()
+    if day not in self.partitioned_days:
+      start = datetime(day.year, day.month, day.day, tzinfo=dt_timezone.utc)
+      end = start + timedelta(days=1)
+      self.partitioned_days[day] = any(
+        (lower is None or lower <= start) and (upper is None or upper >= end)
+        for _, lower, upper in self.partitions
+      )
+    return self.partitioned_days[day]
+
+  def write_chunk(self, chunk):
+    if not chunk:
+      return 0
+
+    flags, reasons = DroneService.classify_danger_batch(
+      [data['height'] for _, _, data in chunk],
+      [data['horizontal_speed'] for _, _, data in chunk],
+      [data['longitude'] for _, _, data in chunk],
+      [data['latitude'] for _, _, data in chunk]
+    )
+
+    latest = {}
+    for (serial_number, timestamp, data), is_dangerous, dangerous_reason in zip(chunk, flags, reasons):
+      if serial_number not in latest or latest[serial_number].last_seen <= timestamp:
+        latest[serial_number] = Drone(
+          serial_number=serial_number,
+          last_seen=timestamp,
+          last_location=Point(data['longitude'], data['latitude']),
+          last_height=data['height'],
+          last_speed=data['horizontal_speed'],
+          is_dangerous=bool(is_dangerous),
+          dangerous_reason=dangerous_reason
+        )
+
+    with transaction.atomic():
+      Drone.objects.bulk_create(latest.values(), ignore_conflicts=True)
+      return copy_drone_data(
+        (serial_number, timestamp, data, bool(is_dangerous))
+        for (serial_number, timestamp, data), is_dangerous in zip(chunk, flags)
+      )
@@ -1,44 +1,306 @@
-
 import ssl
-from django.core.management.base import BaseCommand
+import signal
+import queue
+import zlib
+import multiprocessing
+import threading
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connections
 import paho.mqtt.client as mqtt
 import json
-from ...services import DroneService
+from ...services import DroneService, validate_osd_message
+from ...ingest import BatchWriter
+from ...state_store import drone_state_store
+from ...presence import presence_tracker
+from ...processes import run_django_process
 from decouple import config
 
+TOPIC = "thing/product/+/osd"
+SHARE_GROUP = "drone-ingest"
+# seconds the dispatcher waits on a full worker queue before giving up
+DISPATCH_TIMEOUT = 30
+
+
+def connect_client(on_message, topic, protocol=mqtt.MQTTv311):
+  def on_connect(client, userdata, flags, reason_code, properties):
+    if reason_code.is_failure:
+      print(f"Failed to connect: {reason_code}. loop_forever() will retry connection")
+    else:
+      print("Connected with result code", reason_code)
+      client.subscribe(topic)
+
+  broker = config('MQTT_BROKER_HOST')
+  port = int(config('MQTT_BROKER_PORT'))
+  username = config('MQTT_BROKER_USERNAME')
+  password = config('MQTT_BROKER_PASSWORD')
+
+  mqttc = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, protocol=protocol)
+  mqttc.tls_set(tls_version=ssl.PROTOCOL_TLS)
+  mqttc.username_pw_set(username, password)
+  mqttc.on_connect = on_connect
+  mqttc.on_message = on_message
+
+  mqttc.connect(broker, port, 60)
+  print(broker, port)
+  return mqttc
+
+
+def decode_message(topic, payload):
+  '''returns (serial_number, data) of an OSD message, None when it isn't valid telemetry'''
+  serial_number = topic.split("/")[2]
+  try:
+    data = json.loads(payload)
+  except json.JSONDecodeError as e:
+    print(f"Failed to decode JSON from MQTT message on topic {topic}: {e}. Payload: {payload.decode()}")
+    return None
+
+  try:
+    validate_osd_message(data)
+  except ValueError as e:
+    print(f"Dropping message from {serial_number}: {e}")
+    return None
+  return serial_number, data
+
+
+class Ingester:
+  '''decodes OSD payloads and writes them directly or through a BatchWriter'''
+  def __init__(self, options):
+    self.writer = None
+    if options['batch']:
+      self.writer = BatchWriter(batch_size=options['batch_size'], flush_interval=options['flush_interval'] / 1000)
+      self.writer.start()
+
+  def handle(self, topic, payload):
+    '''writes a raw MQTT message, returns whether it was valid telemetry'''
+    message = decode_message(topic, payload)
+    if message is None:
+      return False
+    self.write(*message)
+    return True
+
+  def write(self, serial_number, data):
+    if self.writer:
+      self.writer.submit(serial_number, data)
+      return
+
+    try:
+      DroneService.process_drone_message(serial_number=serial_number, data=data)
+    except Exception as e:
+      # one bad message or failed write must not stop the consumer
+      print(f"Failed to write message from {serial_number}: {e!r}. Payload: {data}")
+      close_old_connections()
+      return
+    print(data)
+
+  def stop(self):
+    if self.writer:
+      self.writer.stop()
+
+
+def run_dispatched_worker(worker_id, messages, options):
+  '''
+  Consumes the messages the dispatcher routed to this worker until it receives None.
+  SIGTERM stops the worker once the messages already queued for it are written.
+  '''
+  stopping = False
+  def on_sigterm(signum, frame):
+    nonlocal stopping
+    stopping = True
+  signal.signal(signal.SIGTERM, on_sigterm)
+  signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+  ingester = Ingester(options)
+  print(f"Ingest worker {worker_id} started")
+  try:
+    while True:
+      try:
+        item = messages.get(timeout=1)
+      except queue.Empty:
+        if stopping:
+          break
+        continue
+
+      if item is None:
+        break
+      ingester.write(*item)
+  finally:
+    ingester.stop()
+    connections.close_all()
+    print(f"Ingest worker {worker_id} stopped")
+
+
+def run_shared_worker(worker_id, options):
+  '''
+  Consumes its own share of the OSD topic through an MQTT v5 shared subscription.
+  The broker balances messages between the workers of the group without regard to
+  the drone, so messages for one drone may be written out of order.
+  '''
+  mqttc = None
+  def on_sigterm(signum, frame):
+    if mqttc:
+      mqttc.disconnect()
+  signal.signal(signal.SIGTERM, on_sigterm)
+  signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+  ingester = Ingester(options)
+  try:
+    mqttc = connect_client(
+      lambda client, userdata, message: ingester.handle(message.topic, message.payload),
+      f"$share/{SHARE_GROUP}/{TOPIC}",
+      protocol=mqtt.MQTTv5
+    )
+    print(f"Ingest worker {worker_id} started")
+    mqttc.loop_forever()
+  finally:
+    ingester.stop()
+    connections.close_all()
+    print(f"Ingest worker {worker_id} stopped")
+
+
 class Command(BaseCommand):
+  def add_arguments(self, parser):
+    parser.add_argument('--batch', action='store_true', help='Queue messages and write them to the database in batches.')
+    parser.add_argument('--batch-size', type=int, default=500, help='Maximum number of messages per batch.')
+    parser.add_argument('--flush-interval', type=int, default=200, help='Maximum time in milliseconds a message waits before its batch is flushed.')
+    parser.add_argument('--workers', type=int, default=1, help='Number of ingest worker processes.')
+    parser.add_argument(
+      '--shared',
+      action='store_true',
+      help='With --workers, let every worker consume through an MQTT v5 shared subscription instead of a local dispatcher. '
+           'Higher throughput, but messages for the same drone are no longer guaranteed to be written in order.'
+    )
+    parser.add_argument('--queue-size', type=int, default=10000, help='Maximum number of messages queued per worker by the dispatcher.')
+
   def handle(self, *args, **options):
-    def on_connect(client, userdata, flags, reason_code, properties):
-      if reason_code.is_failure:
-        print(f"Failed to connect: {reason_code}. loop_forever() will retry connection")
-      else:
-        print("Connected with result code", reason_code)
-        client.subscribe("thing/product/+/osd")
-    
+    self.tracking = settings.DRONE_PRESENCE_TRACKING
+    if self.tracking and options['workers'] > 1 and options['shared']:
+      raise CommandError('Presence tracking needs every message to pass through one process, it can\'t run with --shared')
+
+    # load the fleet before consuming so the primed snapshot can't overwrite newer states
+    drone_state_store.prime()
+
+    if options['workers'] > 1:
+      self.run_pool(options)
+      return
 
+    ingester = Ingester(options)
     def on_message(client, userdata, message):
+      # malformed messages must not mark their drone online
+      if ingester.handle(message.topic, message.payload) and self.tracking:
+        presence_tracker.seen(message.topic.split("/")[2])
+
+    if self.tracking:
+      presence_tracker.start()
+    mqttc = connect_client(on_message, TOPIC)
+    try:
+      mqttc.loop_forever()
+    finally:
+      ingester.stop()
+      if self.tracking:
+        presence_tracker.stop()
+
+  def run_pool(self, options):
+    '''
+    Starts the worker processes. Unless --shared is given, this process stays the only
+    MQTT consumer and routes every message to a worker chosen by hashing the serial number,
+    so each drone is always written by the same worker in arrival order.
+    Workers that die are restarted. A worker whose queue stays full for DISPATCH_TIMEOUT
+    seconds stops the listener with an error, rather than blocking MQTT consumption forever.
+    '''
+    # spawned rather than forked: this process runs paho's network loop, the supervisor and
+    # the presence tracker threads, and a fork could copy a lock one of them holds
+    self.context = multiprocessing.get_context('spawn')
+    self.options = options
+
+    self.queues = []
+    self.processes = []
+    for worker_id in range(options['workers']):
+      if not options['shared']:
+        self.queues.append(self.context.Queue(maxsize=options['queue_size']))
+      self.processes.append(self.start_worker(worker_id))
+
+    stopping = threading.Event()
+    supervisor = threading.Thread(target=self.supervise, args=(stopping,), name='ingest-worker-supervisor', daemon=True)
+    supervisor.start()
+
+    if options['shared']:
       try:
-        data = json.loads(message.payload)
-      except json.JSONDecodeError as e:
-        print(f"Failed to decode JSON from MQTT message on topic {message.topic}: {e}. Payload: {message.payload.decode()}")
+        self.wait_for_shutdown(stopping)
+      finally:
+        stopping.set()
+      return
+
+    def on_message(client, userdata, message):
+      # decoded here so malformed messages never mark their drone online
+      decoded = decode_message(message.topic, message.payload)
+      if decoded is None:
         return
-      
-      serial_number = message.topic.split("/")[2]
-      DroneService.process_drone_message(serial_number=serial_number, data=data)
-      print(data)
-      
-    broker = config('MQTT_BROKER_HOST')
-    port = int(config('MQTT_BROKER_PORT'))
-    username = config('MQTT_BROKER_USERNAME')
-    password = config('MQTT_BROKER_PASSWORD')
-
-    mqttc = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
-    mqttc.tls_set(tls_version=ssl.PROTOCOL_TLS)
-    mqttc.username_pw_set(username, password)
-    mqttc.on_connect = on_connect
-    mqttc.on_message = on_message
-    
-
-    mqttc.connect(broker, port, 60)
-    print(broker, port)
-    mqttc.loop_forever()
\ No newline at end of file
+      serial_number = decoded[0]
+      # crc32 rather than hash(), which is randomized per process
+      worker = zlib.crc32(serial_number.encode()) % len(self.queues)
+      try:
+        self.queues[worker].put(decoded, timeout=DISPATCH_TIMEOUT)
+      except queue.Full:
+        raise CommandError(f'Ingest worker {worker} accepted no message for {DISPATCH_TIMEOUT} seconds, stopping')
+      if self.tracking:
+        presence_tracker.seen(serial_number)
+
+    if self.tracking:
+      presence_tracker.start()
+    mqttc = connect_client(on_message, TOPIC)
+    signal.signal(signal.SIGTERM, lambda signum, frame: mqttc.disconnect())
+    try:
+      mqttc.loop_forever()
+    finally:
+      stopping.set()
+      supervisor.join()
+      for messages in self.queues:
+        try:
+          messages.put(None, timeout=DISPATCH_TIMEOUT)
+        except queue.Full:
+          pass
+      for process in self.processes:
+        process.join(DISPATCH_TIMEOUT)
+        if process.is_alive():
+          process.terminate()
+      if self.tracking:
+        presence_tracker.stop()
+
+  def start_worker(self, worker_id):
+    if self.options['shared']:
+      args = (f'{__name__}.run_shared_worker', worker_id, self.options)
+    else:
+      args = (f'{__name__}.run_dispatched_worker', worker_id, self.queues[worker_id], self.options)
+    process = self.context.Process(target=run_django_process, args=args)
+    process.start()
+    return process
+
+  def supervise(self, stopping):
+    '''restarts workers that died until the listener stops'''
+    while not stopping.wait(1):
+      for worker_id, process in enumerate(self.processes):
+        if process.is_alive() or stopping.is_set():
+          continue
+
+        print(f"Ingest worker {worker_id} exited with code {process.exitcode}, restarting it")
+        if not self.options['shared']:
+          # the dead worker may have held the queue's lock, its queued messages are lost
+          self.queues[worker_id] = self.context.Queue(maxsize=self.options['queue_size'])
+        self.processes[worker_id] = self.start_worker(worker_id)
+
+  def wait_for_shutdown(self, stopping):
+    '''waits for SIGTERM or Ctrl-C, then stops the shared subscription workers'''
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+
+    try:
+      while not stopping.wait(1):
+        pass
+    except KeyboardInterrupt:
+      pass
+
+    stopping.set()
+    for process in self.processes:
+      process.terminate()
+    for process in self.processes:
+      process.join()
@@ -0,0 +1,51 @@
+import asyncio
+import signal
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from ...async_ingest import AsyncIngestEngine
+from ...state_store import drone_state_store
+from ...presence import presence_tracker
+
+
+class Command(BaseCommand):
+  help = (
+    'Consumes drone telemetry with an asyncio MQTT client and writes it through an async connection pool, '
+    'keeping up to --max-in-flight batches waiting on the database at once.'
+  )
+
+  def add_arguments(self, parser):
+    parser.add_argument('--max-in-flight', type=int, default=16, help='Maximum number of batches written concurrently.')
+    parser.add_argument('--batch-size', type=int, default=200, help='Maximum number of messages per batch.')
+    parser.add_argument('--flush-interval', type=int, default=50, help='Maximum time in milliseconds a message waits before its batch is written.')
+
+  def handle(self, *args, **options):
+    # profiles are created through the ORM, which can't see the drones the engine's own
+    # transaction is inserting, so compacted payloads can only be written by mqtt_listener
+    if settings.DRONE_DATA_COMPACT_RAW:
+      raise CommandError('mqtt_listener_async stores full payloads, use mqtt_listener while DRONE_DATA_COMPACT_RAW is set')
+
+    # load the fleet before consuming so the primed snapshot can't overwrite newer states
+    drone_state_store.prime()
+
+    engine = AsyncIngestEngine(
+      max_in_flight=options['max_in_flight'],
+      batch_size=options['batch_size'],
+      flush_interval=options['flush_interval'] / 1000
+    )
+    if settings.DRONE_PRESENCE_TRACKING:
+      presence_tracker.start()
+    try:
+      asyncio.run(self.run(engine))
+    finally:
+      if settings.DRONE_PRESENCE_TRACKING:
+        presence_tracker.stop()
+
+  async def run(self, engine):
+    task = asyncio.current_task()
+    loop = asyncio.get_running_loop()
+    # stop consuming and let the batches already taken finish writing
+    loop.add_signal_handler(signal.SIGTERM, task.cancel)
+    try:
+      await engine.run()
+    except asyncio.CancelledError:
+      pass
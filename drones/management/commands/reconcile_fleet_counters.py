@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from ...services import DroneService
+
+
+class Command(BaseCommand):
+  help = 'Checks the trigger-maintained fleet counters against the drone table.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--fix', action='store_true', help='Correct counters that are off.')
+
+  def handle(self, *args, **options):
+    mismatches = DroneService.reconcile_fleet_counters(fix=options['fix'])
+
+    if not mismatches:
+      self.stdout.write('Fleet counters match the drone table')
+      return
+
+    for name, (counter, actual) in mismatches.items():
+      action = 'fixed' if options['fix'] else 'not fixed'
+      self.stdout.write(f'{name}: counter {counter}, actual {actual} ({action})')
@@ -0,0 +1,23 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from ...rollups import rollup_telemetry
+
+
+class Command(BaseCommand):
+  help = 'Folds new DroneData rows into per-minute DroneRollup rows, starting from the last high-water mark.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--interval', type=int, default=0, help='Keep running and catch up every INTERVAL seconds.')
+
+  def handle(self, *args, **options):
+    while True:
+      started = time.perf_counter()
+      written = rollup_telemetry()
+      elapsed = time.perf_counter() - started
+      self.stdout.write(f'Wrote {written} rollup rows in {elapsed * 1000:.0f} ms')
+
+      if not options['interval']:
+        return
+      time.sleep(options['interval'])
+      close_old_connections()
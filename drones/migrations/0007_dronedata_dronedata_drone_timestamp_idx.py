@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drones', '0006_noflyzone_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='dronedata',
+            index=models.Index(fields=['drone', 'timestamp'], name='dronedata_drone_timestamp_idx'),
+        ),
+    ]
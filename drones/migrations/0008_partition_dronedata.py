@@ -0,0 +1,94 @@
+from django.db import migrations
+
+# Converts drones_dronedata into a table partitioned by day on "timestamp".
+# The existing table is attached as-is as the drones_dronedata_legacy partition holding
+# everything up to the end of the migration day, so no rows are copied. Daily partitions
+# for the following week and a default partition are created; after that the
+# dronedata_partitions management command keeps partitions ahead and drops expired ones.
+# Partitioned tables need the partition key in the primary key, so the primary key
+# becomes (id, "timestamp"); ids still come from a single sequence.
+
+FORWARD_SQL = '''
+ALTER TABLE drones_dronedata RENAME TO drones_dronedata_legacy;
+ALTER INDEX dronedata_drone_timestamp_idx RENAME TO dronedata_legacy_drone_timestamp_idx;
+
+CREATE TABLE drones_dronedata (
+  LIKE drones_dronedata_legacy INCLUDING STORAGE
+) PARTITION BY RANGE ("timestamp");
+
+CREATE SEQUENCE drones_dronedata_part_id_seq OWNED BY drones_dronedata.id;
+SELECT setval('drones_dronedata_part_id_seq', COALESCE((SELECT MAX(id) FROM drones_dronedata_legacy), 0) + 1, false);
+ALTER TABLE drones_dronedata ALTER COLUMN id SET DEFAULT nextval('drones_dronedata_part_id_seq');
+
+ALTER TABLE drones_dronedata
+  ADD CONSTRAINT drones_dronedata_part_pkey PRIMARY KEY (id, "timestamp");
+ALTER TABLE drones_dronedata
+  ADD CONSTRAINT drones_dronedata_part_drone_id_fk FOREIGN KEY (drone_id)
+  REFERENCES drones_drone (serial_number) DEFERRABLE INITIALLY DEFERRED;
+
+CREATE INDEX drones_dronedata_part_timestamp ON drones_dronedata ("timestamp");
+CREATE INDEX drones_dronedata_part_drone_id ON drones_dronedata (drone_id);
+CREATE INDEX dronedata_drone_timestamp_idx ON drones_dronedata (drone_id, "timestamp");
+CREATE INDEX drones_dronedata_part_location ON drones_dronedata USING GIST (location);
+
+DO $$
+DECLARE
+  legacy_pkey text;
+  first_day date := (now() AT TIME ZONE 'UTC')::date + 1;
+BEGIN
+  -- the legacy table can't keep its own primary key or identity column as a partition
+  SELECT conname INTO legacy_pkey FROM pg_constraint
+  WHERE conrelid = 'drones_dronedata_legacy'::regclass AND contype = 'p';
+  IF legacy_pkey IS NOT NULL THEN
+    EXECUTE format('ALTER TABLE drones_dronedata_legacy DROP CONSTRAINT %I', legacy_pkey);
+  END IF;
+  ALTER TABLE drones_dronedata_legacy ALTER COLUMN id DROP IDENTITY IF EXISTS;
+  ALTER TABLE drones_dronedata_legacy ALTER COLUMN id DROP DEFAULT;
+
+  EXECUTE format(
+    'ALTER TABLE drones_dronedata ATTACH PARTITION drones_dronedata_legacy FOR VALUES FROM (MINVALUE) TO (%L)',
+    first_day::timestamp AT TIME ZONE 'UTC'
+  );
+
+  FOR i IN 0..6 LOOP
+    EXECUTE format(
+      'CREATE TABLE %I PARTITION OF drones_dronedata FOR VALUES FROM (%L) TO (%L)',
+      'drones_dronedata_p' || to_char(first_day + i, 'YYYYMMDD'),
+      (first_day + i)::timestamp AT TIME ZONE 'UTC',
+      (first_day + i + 1)::timestamp AT TIME ZONE 'UTC'
+    );
+  END LOOP;
+END $$;
+
+CREATE TABLE drones_dronedata_default PARTITION OF drones_dronedata DEFAULT;
+'''
+
+REVERSE_SQL = '''
+CREATE TABLE drones_dronedata_plain (LIKE drones_dronedata INCLUDING STORAGE);
+INSERT INTO drones_dronedata_plain SELECT * FROM drones_dronedata;
+DROP TABLE drones_dronedata;
+ALTER TABLE drones_dronedata_plain RENAME TO drones_dronedata;
+
+ALTER TABLE drones_dronedata ADD PRIMARY KEY (id);
+ALTER TABLE drones_dronedata ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY;
+SELECT setval(pg_get_serial_sequence('drones_dronedata', 'id'), COALESCE(MAX(id), 0) + 1, false) FROM drones_dronedata;
+ALTER TABLE drones_dronedata
+  ADD CONSTRAINT drones_dronedata_drone_id_fk FOREIGN KEY (drone_id)
+  REFERENCES drones_drone (serial_number) DEFERRABLE INITIALLY DEFERRED;
+
+CREATE INDEX drones_dronedata_timestamp ON drones_dronedata ("timestamp");
+CREATE INDEX drones_dronedata_drone_id ON drones_dronedata (drone_id);
+CREATE INDEX dronedata_drone_timestamp_idx ON drones_dronedata (drone_id, "timestamp");
+CREATE INDEX drones_dronedata_location ON drones_dronedata USING GIST (location);
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drones', '0007_dronedata_dronedata_drone_timestamp_idx'),
+    ]
+
+    operations = [
+        migrations.RunSQL(FORWARD_SQL, REVERSE_SQL),
+    ]
@@ -0,0 +1,49 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drones', '0008_partition_dronedata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dronedata',
+            name='is_dangerous',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='RollupHighWaterMark',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('timestamp', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DroneRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('minute', models.DateTimeField()),
+                ('point_count', models.IntegerField()),
+                ('min_height', models.FloatField()),
+                ('max_height', models.FloatField()),
+                ('height_sum', models.FloatField()),
+                ('min_speed', models.FloatField()),
+                ('max_speed', models.FloatField()),
+                ('speed_sum', models.FloatField()),
+                ('first_seen', models.DateTimeField()),
+                ('first_latitude', models.FloatField()),
+                ('first_longitude', models.FloatField()),
+                ('last_seen', models.DateTimeField()),
+                ('last_latitude', models.FloatField()),
+                ('last_longitude', models.FloatField()),
+                ('dangerous_seconds', models.FloatField(default=0)),
+                ('drone', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='drones.drone')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('drone', 'minute'), name='dronerollup_drone_minute_unique')],
+            },
+        ),
+    ]
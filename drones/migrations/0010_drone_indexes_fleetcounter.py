@@ -0,0 +1,77 @@
+from django.db import migrations, models
+
+# Keeps the total and dangerous counters in drones_fleetcounter in step with drones_drone.
+# Statement-level triggers with transition tables touch each counter once per statement,
+# so a bulk upsert of a whole batch costs one counter update.
+COUNTER_TRIGGERS_SQL = '''
+INSERT INTO drones_fleetcounter (name, value) VALUES
+  ('total', (SELECT COUNT(*) FROM drones_drone)),
+  ('dangerous', (SELECT COUNT(*) FROM drones_drone WHERE is_dangerous));
+
+CREATE FUNCTION drones_update_fleet_counters() RETURNS trigger AS $$
+DECLARE
+  total_delta bigint := 0;
+  dangerous_delta bigint := 0;
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    SELECT COUNT(*), COUNT(*) FILTER (WHERE is_dangerous) INTO total_delta, dangerous_delta FROM new_rows;
+  ELSIF TG_OP = 'DELETE' THEN
+    SELECT -COUNT(*), -COUNT(*) FILTER (WHERE is_dangerous) INTO total_delta, dangerous_delta FROM old_rows;
+  ELSE
+    SELECT
+      (SELECT COUNT(*) FILTER (WHERE is_dangerous) FROM new_rows) -
+      (SELECT COUNT(*) FILTER (WHERE is_dangerous) FROM old_rows)
+    INTO dangerous_delta;
+  END IF;
+
+  IF total_delta <> 0 OR dangerous_delta <> 0 THEN
+    INSERT INTO drones_fleetcounter (name, value) VALUES ('total', total_delta), ('dangerous', dangerous_delta)
+    ON CONFLICT (name) DO UPDATE SET value = drones_fleetcounter.value + EXCLUDED.value;
+  END IF;
+  RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER drones_drone_counters_insert AFTER INSERT ON drones_drone
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION drones_update_fleet_counters();
+CREATE TRIGGER drones_drone_counters_update AFTER UPDATE ON drones_drone
+  REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION drones_update_fleet_counters();
+CREATE TRIGGER drones_drone_counters_delete AFTER DELETE ON drones_drone
+  REFERENCING OLD TABLE AS old_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION drones_update_fleet_counters();
+'''
+
+DROP_COUNTER_TRIGGERS_SQL = '''
+DROP TRIGGER drones_drone_counters_insert ON drones_drone;
+DROP TRIGGER drones_drone_counters_update ON drones_drone;
+DROP TRIGGER drones_drone_counters_delete ON drones_drone;
+DROP FUNCTION drones_update_fleet_counters();
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drones', '0009_dronedata_is_dangerous_dronerollup_rolluphighwatermark'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='drone',
+            index=models.Index(fields=['last_seen'], name='drone_last_seen_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='drone',
+            index=models.Index(condition=models.Q(('is_dangerous', True)), fields=['serial_number'], name='drone_dangerous_idx'),
+        ),
+        migrations.CreateModel(
+            name='FleetCounter',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunSQL(COUNTER_TRIGGERS_SQL, DROP_COUNTER_TRIGGERS_SQL),
+    ]
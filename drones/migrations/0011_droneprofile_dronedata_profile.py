@@ -0,0 +1,30 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drones', '0010_drone_indexes_fleetcounter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DroneProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.IntegerField()),
+                ('fields', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('drone', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='profiles', to='drones.drone')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('drone', 'version'), name='droneprofile_drone_version_unique')],
+            },
+        ),
+        migrations.AddField(
+            model_name='dronedata',
+            name='profile',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='drones.droneprofile'),
+        ),
+    ]
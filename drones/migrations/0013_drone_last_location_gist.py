@@ -0,0 +1,18 @@
+from django.db import migrations
+
+# Django creates this index with the PointField, but databases restored from dumps or
+# created before spatial_index was honoured may lack it, and the KNN query needs it.
+LAST_LOCATION_INDEX_SQL = '''
+CREATE INDEX IF NOT EXISTS drones_drone_last_location_id ON drones_drone USING GIST (last_location);
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drones', '0012_drone_serial_search_indexes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(LAST_LOCATION_INDEX_SQL, reverse_sql=migrations.RunSQL.noop),
+    ]
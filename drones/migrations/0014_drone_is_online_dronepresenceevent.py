@@ -0,0 +1,33 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drones', '0013_drone_last_location_gist'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='drone',
+            name='is_online',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='drone',
+            index=models.Index(condition=models.Q(('is_online', True)), fields=['serial_number'], name='drone_online_idx'),
+        ),
+        migrations.CreateModel(
+            name='DronePresenceEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event', models.CharField(choices=[('online', 'Online'), ('offline', 'Offline')], max_length=10)),
+                ('timestamp', models.DateTimeField()),
+                ('drone', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='presence_events', to='drones.drone')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['drone', 'timestamp'], name='presence_drone_timestamp_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,60 @@
+from django.db import migrations, models
+
+# Versions behind the ETags of the read endpoints.
+# Every written drones_drone row takes a value from a sequence, and every updated row bumps its
+# own version column, so a view can tell whether its response changed with one cheap lookup
+# instead of running its query. nextval takes no row lock, so concurrent ingest batches don't
+# queue on a shared counter row. The trigger is deferred to commit, which keeps the window in
+# which a reader can see the new version with the old rows down to the commit itself.
+VERSION_TRIGGERS_SQL = '''
+CREATE SEQUENCE drones_fleet_version_seq;
+
+CREATE FUNCTION drones_bump_fleet_version() RETURNS trigger AS $$
+BEGIN
+  PERFORM nextval('drones_fleet_version_seq');
+  RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE CONSTRAINT TRIGGER drones_drone_fleet_version AFTER INSERT OR UPDATE OR DELETE ON drones_drone
+  DEFERRABLE INITIALLY DEFERRED
+  FOR EACH ROW EXECUTE FUNCTION drones_bump_fleet_version();
+
+CREATE FUNCTION drones_bump_drone_version() RETURNS trigger AS $$
+BEGIN
+  NEW.version := OLD.version + 1;
+  RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER drones_drone_version BEFORE UPDATE ON drones_drone
+  FOR EACH ROW EXECUTE FUNCTION drones_bump_drone_version();
+'''
+
+DROP_VERSION_TRIGGERS_SQL = '''
+DROP TRIGGER drones_drone_fleet_version ON drones_drone;
+DROP TRIGGER drones_drone_version ON drones_drone;
+DROP FUNCTION drones_bump_fleet_version();
+DROP FUNCTION drones_bump_drone_version();
+DROP SEQUENCE drones_fleet_version_seq;
+'''
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drones', '0014_drone_is_online_dronepresenceevent'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='drone',
+            name='is_online',
+            field=models.BooleanField(db_default=False, default=False),
+        ),
+        migrations.AddField(
+            model_name='drone',
+            name='version',
+            field=models.BigIntegerField(db_default=0, default=0),
+        ),
+        migrations.RunSQL(VERSION_TRIGGERS_SQL, DROP_VERSION_TRIGGERS_SQL),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations, models
+
+# The high-water mark moves from DroneData.timestamp to DroneData.id. An existing mark
+# continues after the last row that was stamped before it.
+CONVERT_MARK_SQL = '''
+UPDATE drones_rolluphighwatermark SET last_id = COALESCE(
+  (SELECT MAX(id) FROM drones_dronedata WHERE "timestamp" < drones_rolluphighwatermark."timestamp"), 0
+);
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drones', '0015_drone_version_fleet_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rolluphighwatermark',
+            name='last_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='rolluphighwatermark',
+            name='pending_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.RunSQL(CONVERT_MARK_SQL, migrations.RunSQL.noop),
+    ]
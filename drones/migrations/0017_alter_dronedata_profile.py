@@ -0,0 +1,17 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drones', '0016_rolluphighwatermark_last_id'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='dronedata',
+            name='profile',
+            field=models.ForeignKey(blank=True, db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='drones.droneprofile'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+from django.db import migrations
+
+# The deferred fleet version trigger takes its value while the writing transaction commits,
+# a moment before its rows become visible. It now also takes a shared advisory lock, which is
+# released only once the commit is visible, so a reader that can briefly take the lock
+# exclusively after reading the version knows every write behind that version is visible
+# (DroneService.get_fleet_version). Writers never wait on each other for it.
+# The key is FLEET_WRITE_LOCK in drones/services.py.
+FLEET_WRITE_LOCK_SQL = '''
+CREATE OR REPLACE FUNCTION drones_bump_fleet_version() RETURNS trigger AS $$
+BEGIN
+  PERFORM pg_advisory_xact_lock_shared(1685221230);
+  PERFORM nextval('drones_fleet_version_seq');
+  RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+'''
+
+REVERSE_FLEET_WRITE_LOCK_SQL = '''
+CREATE OR REPLACE FUNCTION drones_bump_fleet_version() RETURNS trigger AS $$
+BEGIN
+  PERFORM nextval('drones_fleet_version_seq');
+  RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drones', '0017_alter_dronedata_profile'),
+    ]
+
+    operations = [
+        migrations.RunSQL(FLEET_WRITE_LOCK_SQL, REVERSE_FLEET_WRITE_LOCK_SQL),
+    ]
@@ -1,4 +1,6 @@
 from django.contrib.gis.db import models
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.db.models.functions import Upper
 
 class Drone(models.Model):
   serial_number = models.CharField(max_length=100, unique=True, primary_key=True)
@@ -9,12 +11,29 @@ class Drone(models.Model):
   last_speed = models.FloatField()
   is_dangerous = models.BooleanField(default=False)
   dangerous_reason = models.CharField(max_length=200, null=True, blank=True)
+  # maintained by the presence tracker of the ingest process, see drones/presence.py.
+  # Database defaults as well, the async ingest engine inserts drones with raw SQL
+  is_online = models.BooleanField(default=False, db_default=False)
+  # bumped by a trigger on every update (migration 0015), the ETag of the drone detail view
+  version = models.BigIntegerField(default=0, db_default=0)
+
+  class Meta:
+    indexes = [
+      models.Index(fields=['last_seen'], name='drone_last_seen_idx'),
+      models.Index(fields=['serial_number'], condition=models.Q(is_online=True), name='drone_online_idx'),
+      models.Index(fields=['serial_number'], condition=models.Q(is_dangerous=True), name='drone_dangerous_idx'),
+      # case-insensitive serial search: prefix LIKE and trigram substring / similarity matching
+      models.Index(OpClass(Upper('serial_number'), name='varchar_pattern_ops'), name='drone_serial_prefix_idx'),
+      GinIndex(OpClass(Upper('serial_number'), name='gin_trgm_ops'), name='drone_serial_trgm_idx'),
+    ]
 
   def __str__(self):
     return self.serial_number
 
 
 
+# the table is partitioned by day on timestamp (migration 0008), partitions are
+# managed by the dronedata_partitions command
 class DroneData(models.Model):
   drone = models.ForeignKey(Drone, on_delete=models.CASCADE, related_name='osd_data')
   timestamp = models.DateTimeField(auto_now_add=True, db_index=True)
@@ -24,14 +43,126 @@ class DroneData(models.Model):
   height = models.FloatField()
   horizontal_speed = models.FloatField()
   raw_data = models.JSONField()
+  is_dangerous = models.BooleanField(default=False)
+  # set when raw_data is stored compacted against a profile, see drones/compaction.py.
+  # Profiles are only deleted together with their drone, whose rows go with it through the
+  # drone foreign key, so deleting a profile neither cascades nor is checked by the database.
+  # Either would scan every partition for the unindexed profile_id
+  profile = models.ForeignKey(
+    'DroneProfile', on_delete=models.DO_NOTHING, db_constraint=False,
+    null=True, blank=True, db_index=False, related_name='+'
+  )
+
+  class Meta:
+    indexes = [
+      models.Index(fields=['drone', 'timestamp'], name='dronedata_drone_timestamp_idx'),
+    ]
 
   def __str__(self):
     return f"{self.drone.serial_number}_{self.timestamp.isoformat()}"
+
+  def get_raw_data(self):
+    '''returns the original OSD payload, rebuilding it when raw_data is stored compacted'''
+    if self.profile_id is None:
+      return self.raw_data
+
+    from .compaction import decode_raw_data
+    return decode_raw_data(self.raw_data, self.profile.fields, self)
+
+
+class DroneProfile(models.Model):
+  '''OSD payload fields shared by consecutive messages of a drone, versioned as they change'''
+  drone = models.ForeignKey(Drone, on_delete=models.CASCADE, related_name='profiles')
+  version = models.IntegerField()
+  fields = models.JSONField()
+  created_at = models.DateTimeField(auto_now_add=True)
+
+  class Meta:
+    constraints = [
+      models.UniqueConstraint(fields=['drone', 'version'], name='droneprofile_drone_version_unique'),
+    ]
+
+  def __str__(self):
+    return f"{self.drone_id} v{self.version}"
   
 
+class DronePresenceEvent(models.Model):
+  ONLINE = 'online'
+  OFFLINE = 'offline'
+
+  drone = models.ForeignKey(Drone, on_delete=models.CASCADE, related_name='presence_events')
+  event = models.CharField(max_length=10, choices=[(ONLINE, 'Online'), (OFFLINE, 'Offline')])
+  timestamp = models.DateTimeField()
+
+  class Meta:
+    indexes = [
+      models.Index(fields=['drone', 'timestamp'], name='presence_drone_timestamp_idx'),
+    ]
+
+  def __str__(self):
+    return f"{self.drone_id} {self.event} {self.timestamp.isoformat()}"
+
+
 class NoFlyZone(models.Model):
   name = models.CharField(max_length=255, unique=True)
   geometry = models.PolygonField(srid=4326, geography=True)
+  updated_at = models.DateTimeField(auto_now=True)
 
   def __str__(self):
     return f"{self.name}"
+
+
+class DroneRollup(models.Model):
+  drone = models.ForeignKey(Drone, on_delete=models.CASCADE, related_name='rollups')
+  minute = models.DateTimeField()
+  point_count = models.IntegerField()
+  min_height = models.FloatField()
+  max_height = models.FloatField()
+  height_sum = models.FloatField()
+  min_speed = models.FloatField()
+  max_speed = models.FloatField()
+  speed_sum = models.FloatField()
+  first_seen = models.DateTimeField()
+  first_latitude = models.FloatField()
+  first_longitude = models.FloatField()
+  last_seen = models.DateTimeField()
+  last_latitude = models.FloatField()
+  last_longitude = models.FloatField()
+  dangerous_seconds = models.FloatField(default=0)
+
+  class Meta:
+    constraints = [
+      models.UniqueConstraint(fields=['drone', 'minute'], name='dronerollup_drone_minute_unique'),
+    ]
+
+  @property
+  def avg_height(self):
+    return self.height_sum / self.point_count
+
+  @property
+  def avg_speed(self):
+    return self.speed_sum / self.point_count
+
+  def __str__(self):
+    return f"{self.drone_id}_{self.minute.isoformat()}"
+
+
+class RollupHighWaterMark(models.Model):
+  name = models.CharField(max_length=100, primary_key=True)
+  # DroneData rows with ids up to last_id are rolled up, the ids up to pending_id had
+  # been handed out at timestamp and are rolled up once the grace period passed
+  last_id = models.BigIntegerField(default=0)
+  pending_id = models.BigIntegerField(null=True, blank=True)
+  timestamp = models.DateTimeField()
+
+  def __str__(self):
+    return f"{self.name}: {self.last_id}"
+
+
+# maintained by statement-level triggers on the drone table (migration 0010)
+class FleetCounter(models.Model):
+  name = models.CharField(max_length=50, primary_key=True)
+  value = models.BigIntegerField(default=0)
+
+  def __str__(self):
+    return f"{self.name}: {self.value}"
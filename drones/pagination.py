@@ -0,0 +1,35 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class DroneCursorPagination(CursorPagination):
+  '''
+  Keyset pagination for the drone lists, each page is one index range scan from the cursor
+  position instead of an OFFSET over every earlier row.
+  Opt-in: responses are only paginated when the request passes a cursor or page_size,
+  other clients keep getting the plain list.
+  '''
+  ordering = 'serial_number'
+  page_size = settings.DRONE_LIST_PAGE_SIZE
+  page_size_query_param = 'page_size'
+  max_page_size = 1000
+
+  @classmethod
+  def is_requested(cls, request):
+    return cls.cursor_query_param in request.query_params or cls.page_size_query_param in request.query_params
+
+  def paginate_queryset(self, queryset, request, view=None):
+    if not self.is_requested(request):
+      return None
+    return super().paginate_queryset(queryset, request, view)
+
+
+class OnlineDroneCursorPagination(DroneCursorPagination):
+  '''
+  Most recently seen drones first. The cursor only keys on last_seen, drones sharing a
+  last_seen, like those of one ingest batch, are told apart by an offset into that value
+  after the index seek. last_seen changes as drones report, so a drone that reports while a
+  client is paging can move ahead of the cursor and be skipped or repeated, clients that
+  need every drone exactly once should page the full list by serial number.
+  '''
+  ordering = ('-last_seen', 'serial_number')
@@ -0,0 +1,41 @@
+import re
+from django.db import connection
+from django.utils.dateparse import parse_datetime
+
+BOUND_PATTERN = re.compile(r"FROM \((.+)\) TO \((.+)\)")
+
+
+def parse_bound(value):
+  if value in ('MINVALUE', 'MAXVALUE'):
+    return None
+  return parse_datetime(value.strip("'"))
+
+
+def get_partitions(table):
+  '''
+  returns (name, lower, upper) for every range partition of table, None standing for an
+  unbounded side, and the name of the default partition or None
+  '''
+  with connection.cursor() as cursor:
+    cursor.execute('''
+      SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+      FROM pg_inherits i
+      JOIN pg_class c ON c.oid = i.inhrelid
+      WHERE i.inhparent = %s::regclass
+    ''', [table])
+    rows = cursor.fetchall()
+
+  partitions = []
+  default = None
+  for name, bound in rows:
+    if bound == 'DEFAULT':
+      default = name
+      continue
+    match = BOUND_PATTERN.search(bound)
+    if match:
+      partitions.append((name, parse_bound(match.group(1)), parse_bound(match.group(2))))
+  return partitions, default
+
+
+def overlaps(start, end, lower, upper):
+  return (lower is None or lower < end) and (upper is None or upper > start)
@@ -0,0 +1,164 @@
+import heapq
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+from django.db import close_old_connections, transaction
+from .models import Drone, DronePresenceEvent
+from .services import ONLINE_WINDOW
+
+
+class PresenceTracker:
+  '''
+  Tracks which drones are online in the process that receives their telemetry.
+  seen() only updates in-memory state: the last seen time of the drone, and for a drone
+  that just came online, one entry in a min-heap of offline deadlines. A background thread
+  pops expired deadlines every tick. A drone seen again since its entry was pushed gets a
+  new deadline, otherwise it goes offline. Transitions are written in batches to
+  Drone.is_online, which has a partial index, and to DronePresenceEvent.
+  Every drone must be routed to one tracker, so it can't run behind shared subscriptions.
+  '''
+  def __init__(self, window=ONLINE_WINDOW, tick=1):
+    self.window = window.total_seconds()
+    self.tick = tick
+    self._lock = threading.Lock()
+    self._last_seen = {}
+    self._deadlines = []
+    self._pending_online = {}
+    self._pending_offline = {}
+    self._thread = None
+    self._stopping = threading.Event()
+
+  def start(self):
+    self.prime()
+    self._thread = threading.Thread(target=self._run, name='drone-presence-tracker', daemon=True)
+    self._thread.start()
+
+  def stop(self):
+    self._stopping.set()
+    if self._thread:
+      self._thread.join()
+
+  def prime(self):
+    '''loads the drones seen within the window and takes offline those the database still marks online'''
+    now = time.time()
+    cutoff = datetime.fromtimestamp(now - self.window, tz=dt_timezone.utc)
+
+    recent = Drone.objects.filter(last_seen__gte=cutoff).values_list('serial_number', 'last_seen')
+    with self._lock:
+      for serial_number, last_seen in recent:
+        self._mark_seen(serial_number, last_seen.timestamp())
+      online, self._pending_online = self._pending_online, {}
+
+    stale = list(Drone.objects.filter(is_online=True, last_seen__lt=cutoff).values_list('serial_number', 'last_seen'))
+    self._write_transitions(online, {serial_number: last_seen.timestamp() + self.window for serial_number, last_seen in stale})
+
+  def seen(self, serial_number, timestamp=None):
+    with self._lock:
+      self._mark_seen(serial_number, timestamp or time.time())
+
+  def online_count(self):
+    with self._lock:
+      return len(self._last_seen)
+
+  def _mark_seen(self, serial_number, timestamp):
+    if serial_number not in self._last_seen:
+      # back before its offline transition was written, the stored flag never changes
+      self._pending_offline.pop(serial_number, None)
+      heapq.heappush(self._deadlines, (timestamp + self.window, serial_number))
+      self._pending_online[serial_number] = timestamp
+      self._last_seen[serial_number] = timestamp
+    elif timestamp > self._last_seen[serial_number]:
+      self._last_seen[serial_number] = timestamp
+
+  def expire(self, now=None):
+    '''pops the deadlines that passed, returns {serial_number: went_offline_at} of drones that went offline'''
+    now = now or time.time()
+    offline = {}
+
+    with self._lock:
+      while self._deadlines and self._deadlines[0][0] <= now:
+        _, serial_number = heapq.heappop(self._deadlines)
+        deadline = self._last_seen[serial_number] + self.window
+        if deadline > now:
+          heapq.heappush(self._deadlines, (deadline, serial_number))
+        else:
+          del self._last_seen[serial_number]
+          if self._pending_online.pop(serial_number, None) is None:
+            offline[serial_number] = deadline
+
+    return offline
+
+  def flush(self, now=None):
+    '''expires deadlines and writes the transitions since the last flush'''
+    offline = self.expire(now)
+    with self._lock:
+      online, self._pending_online = self._pending_online, {}
+      offline, self._pending_offline = {**self._pending_offline, **offline}, {}
+
+    try:
+      written = self._write_transitions(online, offline)
+    except Exception:
+      # keep the transitions for the next flush
+      with self._lock:
+        for serial_number, timestamp in online.items():
+          if serial_number in self._last_seen:
+            self._pending_online.setdefault(serial_number, timestamp)
+        for serial_number, timestamp in offline.items():
+          if serial_number not in self._last_seen:
+            self._pending_offline[serial_number] = timestamp
+      raise
+
+    # online transitions of drones whose row isn't written yet are retried on the next flush
+    retry = {serial_number: timestamp for serial_number, timestamp in online.items() if serial_number not in written}
+    if retry:
+      with self._lock:
+        for serial_number, timestamp in retry.items():
+          if serial_number in self._last_seen:
+            self._pending_online.setdefault(serial_number, timestamp)
+
+  def _write_transitions(self, online, offline):
+    '''
+    Writes the transitions that change the stored flag, so replaying them is harmless.
+    Returns the serial numbers from online that have a drone row.
+    '''
+    if not online and not offline:
+      return set()
+
+    with transaction.atomic():
+      current = dict(Drone.objects.filter(pk__in=[*online, *offline]).values_list('pk', 'is_online'))
+      went_online = [serial_number for serial_number in online if current.get(serial_number) is False]
+      went_offline = [serial_number for serial_number in offline if current.get(serial_number) is True]
+
+      if went_online:
+        Drone.objects.filter(pk__in=went_online).update(is_online=True)
+      if went_offline:
+        Drone.objects.filter(pk__in=went_offline).update(is_online=False)
+
+      DronePresenceEvent.objects.bulk_create([
+        *[
+          DronePresenceEvent(drone_id=serial_number, event=DronePresenceEvent.ONLINE, timestamp=_datetime(online[serial_number]))
+          for serial_number in went_online
+        ],
+        *[
+          DronePresenceEvent(drone_id=serial_number, event=DronePresenceEvent.OFFLINE, timestamp=_datetime(offline[serial_number]))
+          for serial_number in went_offline
+        ]
+      ])
+
+    return {serial_number for serial_number in online if serial_number in current}
+
+  def _run(self):
+    while not self._stopping.wait(self.tick):
+      try:
+        close_old_connections()
+        self.flush()
+      except Exception as e:
+        print(f"Failed to write presence transitions: {e}")
+    self.flush()
+
+
+def _datetime(timestamp):
+  return datetime.fromtimestamp(timestamp, tz=dt_timezone.utc)
+
+
+presence_tracker = PresenceTracker()
@@ -0,0 +1,16 @@
+import importlib
+import os
+
+
+def run_django_process(target, *args):
+  '''
+  Entry point of spawned worker processes. A spawned process starts a fresh interpreter,
+  so Django is set up before the module of target, given as 'module.function', is imported.
+  This module itself must not import anything that needs Django at import time.
+  '''
+  os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend_task.settings')
+  import django
+  django.setup()
+
+  module_name, name = target.rsplit('.', 1)
+  getattr(importlib.import_module(module_name), name)(*args)
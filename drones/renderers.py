@@ -0,0 +1,15 @@
+import json
+from rest_framework.renderers import BaseRenderer
+
+
+class EventStreamRenderer(BaseRenderer):
+  '''
+  Lets clients that only accept text/event-stream through content negotiation,
+  error responses are sent to them as a single error event.
+  '''
+  media_type = 'text/event-stream'
+  format = 'event-stream'
+  charset = 'utf-8'
+
+  def render(self, data, accepted_media_type=None, renderer_context=None):
+    return f'event: error\ndata: {json.dumps(data)}\n\n'.encode(self.charset)
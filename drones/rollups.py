@@ -0,0 +1,139 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from .models import DroneData, DroneRollup, RollupHighWaterMark
+
+HIGH_WATER_MARK_NAME = 'drone_rollup'
+
+# Every point is attributed to the minute it was received in. The time since the drone's
+# previous point counts as dangerous when that previous point was dangerous, as long as
+# the gap is short enough to mean the drone was still reporting. New points are selected
+# by id, so rows that commit late or carry old timestamps (backfills, COPY imports) are
+# still rolled up; their previous point is looked up over the (drone, timestamp) index.
+ROLLUP_SQL = f'''
+WITH new_points AS (
+  SELECT id, drone_id, "timestamp", latitude, longitude, height, horizontal_speed
+  FROM {DroneData._meta.db_table}
+  WHERE id > %(start_id)s AND id <= %(end_id)s
+),
+points AS (
+  SELECT new_points.*,
+    date_trunc('minute', new_points."timestamp") AS minute,
+    CASE WHEN previous.is_dangerous AND new_points."timestamp" - previous."timestamp" <= %(max_gap)s
+      THEN EXTRACT(EPOCH FROM new_points."timestamp" - previous."timestamp")
+      ELSE 0
+    END AS dangerous_seconds
+  FROM new_points
+  LEFT JOIN LATERAL (
+    SELECT "timestamp", is_dangerous
+    FROM {DroneData._meta.db_table} AS p
+    WHERE p.drone_id = new_points.drone_id
+      AND p."timestamp" >= new_points."timestamp" - %(max_gap)s
+      AND (p."timestamp", p.id) < (new_points."timestamp", new_points.id)
+    ORDER BY p."timestamp" DESC, p.id DESC
+    LIMIT 1
+  ) AS previous ON true
+)
+INSERT INTO {DroneRollup._meta.db_table} AS r (
+  drone_id, minute, point_count,
+  min_height, max_height, height_sum, min_speed, max_speed, speed_sum,
+  first_seen, first_latitude, first_longitude,
+  last_seen, last_latitude, last_longitude,
+  dangerous_seconds
+)
+SELECT drone_id, minute, COUNT(*),
+  MIN(height), MAX(height), SUM(height),
+  MIN(horizontal_speed), MAX(horizontal_speed), SUM(horizontal_speed),
+  MIN("timestamp"),
+  (ARRAY_AGG(latitude ORDER BY "timestamp"))[1],
+  (ARRAY_AGG(longitude ORDER BY "timestamp"))[1],
+  MAX("timestamp"),
+  (ARRAY_AGG(latitude ORDER BY "timestamp" DESC))[1],
+  (ARRAY_AGG(longitude ORDER BY "timestamp" DESC))[1],
+  SUM(dangerous_seconds)
+FROM points
+GROUP BY drone_id, minute
+ON CONFLICT (drone_id, minute) DO UPDATE SET
+  point_count = r.point_count + EXCLUDED.point_count,
+  min_height = LEAST(r.min_height, EXCLUDED.min_height),
+  max_height = GREATEST(r.max_height, EXCLUDED.max_height),
+  height_sum = r.height_sum + EXCLUDED.height_sum,
+  min_speed = LEAST(r.min_speed, EXCLUDED.min_speed),
+  max_speed = GREATEST(r.max_speed, EXCLUDED.max_speed),
+  speed_sum = r.speed_sum + EXCLUDED.speed_sum,
+  first_latitude = CASE WHEN EXCLUDED.first_seen < r.first_seen THEN EXCLUDED.first_latitude ELSE r.first_latitude END,
+  first_longitude = CASE WHEN EXCLUDED.first_seen < r.first_seen THEN EXCLUDED.first_longitude ELSE r.first_longitude END,
+  first_seen = LEAST(r.first_seen, EXCLUDED.first_seen),
+  last_latitude = CASE WHEN EXCLUDED.last_seen > r.last_seen THEN EXCLUDED.last_latitude ELSE r.last_latitude END,
+  last_longitude = CASE WHEN EXCLUDED.last_seen > r.last_seen THEN EXCLUDED.last_longitude ELSE r.last_longitude END,
+  last_seen = GREATEST(r.last_seen, EXCLUDED.last_seen),
+  dangerous_seconds = r.dangerous_seconds + EXCLUDED.dangerous_seconds
+'''
+
+
+def last_assigned_id():
+  '''the last id handed out to a DroneData row, committed or not, None before the first insert'''
+  with connection.cursor() as cursor:
+    cursor.execute(
+      'SELECT pg_sequence_last_value(pg_get_serial_sequence(%s, %s))',
+      [DroneData._meta.db_table, 'id']
+    )
+    return cursor.fetchone()[0]
+
+
+def rollup_telemetry(grace=None, chunk_size=100000):
+  '''
+  Folds DroneData rows inserted since the high-water mark into DroneRollup rows.
+  The mark is kept on the id, which is assigned at insert time, rather than on the timestamp,
+  which may be older than the mark for rows that commit late or are backfilled. Ids are
+  handed out before their transaction commits, so each run only processes up to the last
+  id seen by a run at least grace seconds (ROLLUP_GRACE_SECONDS by default) earlier.
+  Transactions open longer than that can still be skipped. Each chunk of ids is committed
+  together with the new high-water mark, which stays locked while the chunk is rolled up.
+  Returns the number of rollup rows written.
+  '''
+  grace = settings.ROLLUP_GRACE_SECONDS if grace is None else grace
+  max_gap = timedelta(seconds=settings.ROLLUP_MAX_GAP_SECONDS)
+  now = timezone.now()
+
+  RollupHighWaterMark.objects.get_or_create(
+    name=HIGH_WATER_MARK_NAME,
+    defaults={'timestamp': now, 'last_id': 0}
+  )
+  current_id = last_assigned_id() or 0
+
+  written = 0
+  while True:
+    with transaction.atomic(), connection.cursor() as cursor:
+      # the mark is locked and read again for every chunk, so a run started by hand next to
+      # the --interval loop waits for it instead of rolling the same ids up twice
+      high_water_mark = RollupHighWaterMark.objects.select_for_update().get(name=HIGH_WATER_MARK_NAME)
+
+      if not grace:
+        end_id = current_id
+      elif high_water_mark.pending_id is not None and now - high_water_mark.timestamp >= timedelta(seconds=grace):
+        end_id = high_water_mark.pending_id
+      else:
+        end_id = high_water_mark.last_id
+
+      start_id = high_water_mark.last_id
+      if start_id >= end_id:
+        # the ids handed out by now are processed once grace seconds have passed
+        if high_water_mark.pending_id is None or end_id >= high_water_mark.pending_id:
+          high_water_mark.pending_id = current_id
+          high_water_mark.timestamp = now
+          high_water_mark.save(update_fields=['pending_id', 'timestamp'])
+        break
+
+      chunk_end = min(start_id + chunk_size, end_id)
+      cursor.execute(ROLLUP_SQL, {
+        'start_id': start_id,
+        'end_id': chunk_end,
+        'max_gap': max_gap
+      })
+      written += cursor.rowcount
+      high_water_mark.last_id = chunk_end
+      high_water_mark.save(update_fields=['last_id'])
+
+  return written
@@ -1,13 +1,113 @@
+from json.encoder import encode_basestring
 from rest_framework import serializers
-from .models import Drone, DroneData
+from django.db.models import FloatField, Func
+from django.utils import timezone
+from .models import Drone, DroneData, DroneRollup
 
 class DroneSerializer(serializers.ModelSerializer):
   class Meta:
     model = Drone
-    fields = "__all__"
+    # is_online is internal presence state, online drones are listed by their own endpoint.
+    # version is sent as the ETag of the detail view
+    exclude = ['is_online', 'version']
+
+
+class DroneDistanceSerializer(DroneSerializer):
+  distance = serializers.SerializerMethodField()
+
+  def get_distance(self, drone):
+    '''distance in meters from the query point, None when the query had no point'''
+    distance = getattr(drone, 'distance', None)
+    return distance.m if distance is not None else None
+
+
+def format_datetime(value):
+  '''formats a datetime the way DRF's DateTimeField does with the default ISO 8601 format'''
+  value = timezone.localtime(value).isoformat()
+  if value.endswith('+00:00'):
+    value = value[:-6] + 'Z'
+  return value
+
+
+def drone_representation(drone):
+  '''builds the same dict as DroneSerializer(drone).data without going through DRF fields'''
+  return {
+    'serial_number': drone.serial_number,
+    'created_at': format_datetime(drone.created_at),
+    'last_seen': format_datetime(drone.last_seen),
+    'last_location': {'type': 'Point', 'coordinates': [drone.last_location.x, drone.last_location.y]},
+    # in-memory drones built from telemetry can hold ints, the database always returns floats
+    'last_height': float(drone.last_height),
+    'last_speed': float(drone.last_speed),
+    'is_dangerous': drone.is_dangerous,
+    'dangerous_reason': drone.dangerous_reason
+  }
+
+
+# DroneSerializer's output for one drone, filled by render_drone_rows
+DRONE_ROW_TEMPLATE = (
+  '{{"serial_number":{},"created_at":"{}","last_seen":"{}",'
+  '"last_location":{{"type":"Point","coordinates":[{},{}]}},'
+  '"last_height":{},"last_speed":{},"is_dangerous":{},"dangerous_reason":{}}}'
+)
+
+DRONE_ROW_FIELDS = [
+  'serial_number', 'created_at', 'last_seen', 'longitude', 'latitude',
+  'last_height', 'last_speed', 'is_dangerous', 'dangerous_reason'
+]
+
+# DRF's JSONRenderer escapes these two, they are valid JSON but not valid JavaScript
+JS_ESCAPES = str.maketrans({'\u2028': '\\u2028', '\u2029': '\\u2029'})
+
+
+def _string(value):
+  return 'null' if value is None else encode_basestring(value).translate(JS_ESCAPES)
+
+
+def render_drone_rows(queryset):
+  '''
+  Yields the JSON of every drone in the queryset, byte for byte what DroneSerializer and
+  DRF's JSONRenderer produce, without building model instances, GEOS points or DRF fields.
+  Coordinates are extracted in SQL and every row is a tuple formatted into one template.
+  '''
+  rows = queryset.annotate(
+    longitude=Func('last_location', function='ST_X', template='%(function)s(%(expressions)s::geometry)', output_field=FloatField()),
+    latitude=Func('last_location', function='ST_Y', template='%(function)s(%(expressions)s::geometry)', output_field=FloatField())
+  ).values_list(*DRONE_ROW_FIELDS)
+
+  row_json = DRONE_ROW_TEMPLATE.format
+  float_json = float.__repr__
+  for serial_number, created_at, last_seen, longitude, latitude, height, speed, is_dangerous, dangerous_reason in rows.iterator(chunk_size=2000):
+    yield row_json(
+      _string(serial_number),
+      format_datetime(created_at),
+      format_datetime(last_seen),
+      float_json(longitude),
+      float_json(latitude),
+      float_json(height),
+      float_json(speed),
+      'true' if is_dangerous else 'false',
+      _string(dangerous_reason)
+    )
 
 
 class DangerousDroneSerializer(serializers.ModelSerializer):
   class Meta:
     model = Drone
-    fields = ['serial_number', 'is_dangerous', 'dangerous_reason']
\ No newline at end of file
+    fields = ['serial_number', 'is_dangerous', 'dangerous_reason']
+
+
+class DroneRollupSerializer(serializers.ModelSerializer):
+  avg_height = serializers.FloatField(read_only=True)
+  avg_speed = serializers.FloatField(read_only=True)
+
+  class Meta:
+    model = DroneRollup
+    fields = [
+      'minute', 'point_count',
+      'min_height', 'max_height', 'avg_height',
+      'min_speed', 'max_speed', 'avg_speed',
+      'first_seen', 'first_latitude', 'first_longitude',
+      'last_seen', 'last_latitude', 'last_longitude',
+      'dangerous_seconds'
+    ]
\ No newline at end of file
@@ -1,16 +1,73 @@
 from rest_framework.exceptions import ValidationError
-from drones.models import Drone, DroneData
-from django.contrib.gis.geos import Point
+from drones.models import Drone, DroneData, FleetCounter
+from django.contrib.gis.geos import Point, Polygon
+from django.contrib.gis.db.models import PointField
+from django.contrib.gis.db.models.functions import Distance
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.db import connection, transaction
+from django.db.models import Count, Func, FloatField, Q, Value
+from django.db.models.functions import Upper
+from django.contrib.postgres.search import TrigramSimilarity
+from django.conf import settings
+from django.core.cache import cache
 from .strategies import DangerClassifier
+from .feed import publish_drone_updates
+from .state_store import drone_state_store
+from .copy_writer import copy_drone_data
+from .compaction import encode_raw_data
+from .serializers import drone_representation
 from datetime import timedelta
+import hashlib
+import math
+
+
+danger_classifier = DangerClassifier()
+
+EMPTY_FLIGHT_PATH = '{"type":"LineString","coordinates":[]}'
+
+# advisory lock key held shared by writers to the drone table while they commit, see get_fleet_version
+FLEET_WRITE_LOCK = 1685221230
+
+# drones that reported within this window are online
+ONLINE_WINDOW = timedelta(minutes=1)
+
+# with DRONE_PRESENCE_TRACKING, a drone flagged online that hasn't reported within this window
+# counts as offline anyway, so a stopped presence tracker can't freeze the online set
+PRESENCE_STALE_WINDOW = 2 * ONLINE_WINDOW
+
+MAX_NEAREST = 1000
+
+# longest edge segment, in degrees, of bbox polygons compared against geography columns,
+# the same as the tile bounds in drones/tiles.py
+BBOX_SEGMENT_DEGREES = 1
+
+# drones closer than this many 256px tile pixels at the requested zoom share a cluster
+CLUSTER_CELL_PIXELS = 64
+
+# OSD payload fields every message must carry, see validate_osd_message
+OSD_NUMERIC_FIELDS = ['longitude', 'latitude', 'height', 'horizontal_speed']
+
+SEARCH_MODES = ['prefix', 'substring', 'fuzzy']
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+
+
+class KNNDistance(Func):
+  '''the <-> operator, ordering by it lets PostGIS walk the GiST index nearest first'''
+  arg_joiner = ' <-> '
+  template = '%(expressions)s'
+  output_field = FloatField()
 
 
 class DroneService:
   @staticmethod
   def classify_danger(height, speed, location):
-    classifier = DangerClassifier()
-    return classifier.classify_danger(height, speed, location)
+    return danger_classifier.classify_danger(height, speed, location)
+
+  @staticmethod
+  def classify_danger_batch(heights, speeds, lons, lats):
+    return danger_classifier.classify_batch(heights, speeds, lons, lats)
   
 
   @staticmethod
@@ -34,6 +91,8 @@ class DroneService:
         }
     )
 
+    [(raw_data, profile_id)] = encode_raw_data([(serial_number, data)])
+
     DroneData.objects.create(
       drone=drone,
       location = location,
@@ -41,36 +100,426 @@ class DroneService:
       longitude = longitude,
       height = height,
       horizontal_speed = speed,
-      raw_data = data
+      raw_data = raw_data,
+      profile_id = profile_id,
+      is_dangerous = is_dangerous
     )
+
+    publish_drone_updates([drone])
+
+
+  @staticmethod
+  def process_drone_messages(messages):
+    '''
+    Writes a batch of (serial_number, data, received_at) messages using one bulk upsert
+    of Drone rows and one bulk insert, or COPY with DRONE_DATA_COPY, of DroneData rows.
+    Only the latest message of each drone is used to update its Drone row.
+    Returns the number of distinct drones in the batch.
+    '''
+    flags, reasons = DroneService.classify_danger_batch(
+      [data['height'] for _, data, _ in messages],
+      [data['horizontal_speed'] for _, data, _ in messages],
+      [data['longitude'] for _, data, _ in messages],
+      [data['latitude'] for _, data, _ in messages]
+    )
+
+    latest_drones = {}
+    drone_data = []
+    copy_rows = []
+
+    for (serial_number, data, received_at), is_dangerous, dangerous_reason in zip(messages, flags, reasons):
+      longitude = data['longitude']
+      latitude = data['latitude']
+      height = data['height']
+      speed = data['horizontal_speed']
+      location = Point(longitude, latitude)
+
+      latest_drones[serial_number] = Drone(
+        serial_number=serial_number,
+        last_seen=received_at,
+        last_location=location,
+        last_height=height,
+        last_speed=speed,
+        is_dangerous=bool(is_dangerous),
+        dangerous_reason=dangerous_reason
+      )
+
+      if settings.DRONE_DATA_COPY:
+        copy_rows.append((serial_number, received_at, data, bool(is_dangerous)))
+        continue
+
+      drone_data.append(DroneData(
+        drone_id=serial_number,
+        location=location,
+        latitude=latitude,
+        longitude=longitude,
+        height=height,
+        horizontal_speed=speed,
+        raw_data=data,
+        is_dangerous=bool(is_dangerous)
+      ))
+
+    with transaction.atomic():
+      # concurrent batches lock the drone rows in serial number order, so they can't deadlock
+      Drone.objects.bulk_create(
+        sorted(latest_drones.values(), key=lambda drone: drone.serial_number),
+        update_conflicts=True,
+        unique_fields=['serial_number'],
+        update_fields=['last_seen', 'last_location', 'last_height', 'last_speed', 'is_dangerous', 'dangerous_reason']
+      )
+      if copy_rows:
+        copy_drone_data(copy_rows)
+      else:
+        # profiles reference the drones, so payloads are encoded once the drones exist
+        encoded = encode_raw_data([(row.drone_id, row.raw_data) for row in drone_data])
+        for row, (raw_data, profile_id) in zip(drone_data, encoded):
+          row.raw_data = raw_data
+          row.profile_id = profile_id
+        DroneData.objects.bulk_create(drone_data)
+      publish_drone_updates(latest_drones.values())
+      # bulk_create skips post_save, so the state store is written here
+      transaction.on_commit(lambda: drone_state_store.write_through(latest_drones.values(), created_at_known=False))
+
+    return len(latest_drones)
   
 
+  @staticmethod
+  def online_filter():
+    '''
+    Q matching online drones: the is_online flag kept by the presence tracker when
+    DRONE_PRESENCE_TRACKING is set, bounded by the looser stale window, otherwise a
+    last_seen range over the online window.
+    '''
+    if settings.DRONE_PRESENCE_TRACKING:
+      return Q(is_online=True, last_seen__gte=timezone.now() - PRESENCE_STALE_WINDOW)
+    return Q(last_seen__gte=timezone.now() - ONLINE_WINDOW)
+
   @staticmethod
   def get_online_drones():
-    time_now = timezone.now()
-    one_min = timedelta(minutes=1)
-    one_min_ago = time_now - one_min
+    return Drone.objects.filter(DroneService.online_filter())
+
+  @staticmethod
+  def query_drones_spatial(point=None, radius=None, k=None, bbox=None, online=False, limit=None):
+    '''
+    Finds drones within radius meters of point, inside a (min_lon, min_lat, max_lon, max_lat)
+    bbox, or the k nearest to point. With a point the results are ordered by distance and
+    annotated with it, k nearest is answered by a KNN scan of the last_location GiST index.
+    '''
+    queryset = Drone.objects.all()
+    if online:
+      queryset = queryset.filter(DroneService.online_filter())
+
+    if radius is not None:
+      queryset = queryset.filter(last_location__dwithin=(point, radius))
+    elif bbox is not None:
+      queryset = queryset.filter(last_location__intersects=bbox_polygon(bbox))
+
+    if point is None:
+      queryset = queryset.order_by('serial_number')
+    elif k is not None:
+      queryset = queryset.annotate(distance=Distance('last_location', point)).order_by(
+        KNNDistance('last_location', Value(point, output_field=PointField(geography=True, srid=4326)))
+      )
+      limit = k
+    else:
+      queryset = queryset.annotate(distance=Distance('last_location', point)).order_by('distance')
+
+    if limit:
+      queryset = queryset[:limit]
+
+    return queryset
 
-    return Drone.objects.filter(last_seen__gte=one_min_ago)
-  
   @staticmethod
-  def get_flight_path(drone):
-    flight_data = DroneData.objects.filter(drone=drone).order_by('timestamp')
+  def get_drone_clusters(bbox, zoom, online=False):
+    '''
+    Returns the drones inside the bbox, or when there are more than DRONE_CLUSTER_THRESHOLD
+    of them, clusters computed in PostGIS by snapping positions to a grid sized for the zoom
+    level. Each cluster has its count, centroid, number of dangerous drones and the serial
+    number of a representative drone, dangerous and most recently seen first.
+    '''
+    queryset = Drone.objects.filter(last_location__intersects=bbox_polygon(bbox))
+    if online:
+      queryset = queryset.filter(DroneService.online_filter())
+
+    threshold = settings.DRONE_CLUSTER_THRESHOLD
+    if queryset[:threshold + 1].count() <= threshold:
+      return {
+        'zoom': zoom,
+        'clustered': False,
+        'drones': [drone_representation(drone) for drone in queryset.order_by('serial_number')]
+      }
+
+    # segmentized like bbox_polygon, so the edges follow the lat/lon rectangle
+    conditions = [f'ST_Intersects(last_location, ST_Segmentize(ST_MakeEnvelope(%s, %s, %s, %s, 4326), {BBOX_SEGMENT_DEGREES})::geography)']
+    params = list(bbox)
+    if online and settings.DRONE_PRESENCE_TRACKING:
+      conditions.append('is_online AND last_seen >= %s')
+      params.append(timezone.now() - PRESENCE_STALE_WINDOW)
+    elif online:
+      conditions.append('last_seen >= %s')
+      params.append(timezone.now() - ONLINE_WINDOW)
+
+    cell_size = 360 / (256 * 2 ** zoom) * CLUSTER_CELL_PIXELS
+    sql = f'''
+      SELECT
+        COUNT(*),
+        ST_X(ST_Centroid(ST_Collect(last_location::geometry))),
+        ST_Y(ST_Centroid(ST_Collect(last_location::geometry))),
+        COUNT(*) FILTER (WHERE is_dangerous),
+        (array_agg(serial_number ORDER BY is_dangerous DESC, last_seen DESC))[1]
+      FROM {Drone._meta.db_table}
+      WHERE {' AND '.join(conditions)}
+      GROUP BY ST_SnapToGrid(last_location::geometry, %s)
+      ORDER BY 1 DESC
+    '''
+
+    with connection.cursor() as cursor:
+      cursor.execute(sql, [*params, cell_size])
+      rows = cursor.fetchall()
 
-    coordinates_list = []
-    for point in flight_data:
-      coordinates_list.append([point.longitude, point.latitude])
-    
-    geo_json_obj = {
-      "type": "LineString",
-      "coordinates": coordinates_list
+    return {
+      'zoom': zoom,
+      'clustered': True,
+      'clusters': [
+        {
+          'count': count,
+          'longitude': longitude,
+          'latitude': latitude,
+          'dangerous': dangerous,
+          'serial_number': serial_number
+        }
+        for count, longitude, latitude, dangerous, serial_number in rows
+      ]
     }
 
-    return geo_json_obj
+  @staticmethod
+  def search_drones(query, mode='substring', limit=DEFAULT_SEARCH_LIMIT):
+    '''
+    Case-insensitive serial number search over the UPPER(serial_number) indexes:
+    prefix uses the varchar_pattern_ops btree, substring and fuzzy the pg_trgm GIN index.
+    Fuzzy matches are ranked by trigram similarity, the others by serial number.
+    '''
+    if mode == 'prefix':
+      queryset = Drone.objects.filter(serial_number__istartswith=query).order_by('serial_number')
+    elif mode == 'substring':
+      queryset = Drone.objects.filter(serial_number__icontains=query).order_by('serial_number')
+    else:
+      term = query.upper()
+      queryset = (
+        Drone.objects.alias(serial_upper=Upper('serial_number'))
+        .filter(serial_upper__trigram_similar=term)
+        .annotate(similarity=TrigramSimilarity(Upper('serial_number'), term))
+        .order_by('-similarity', 'serial_number')
+      )
+
+    return queryset[:limit]
+
+  @staticmethod
+  def get_stats():
+    '''counts total, online and dangerous drones in a single aggregate query'''
+    return Drone.objects.aggregate(
+      total=Count('pk'),
+      online=Count('pk', filter=DroneService.online_filter()),
+      dangerous=Count('pk', filter=Q(is_dangerous=True))
+    )
+
+  @staticmethod
+  def get_counter_stats():
+    '''
+    Reads total and dangerous from the trigger-maintained fleet counters,
+    online is counted over the last_seen index.
+    Falls back to get_stats when the counters are missing.
+    '''
+    counters = dict(FleetCounter.objects.filter(name__in=['total', 'dangerous']).values_list('name', 'value'))
+    if len(counters) < 2:
+      return DroneService.get_stats()
+
+    return {
+      "total": counters['total'],
+      "online": DroneService.get_online_drones().count(),
+      "dangerous": counters['dangerous']
+    }
+
+  @staticmethod
+  def reconcile_fleet_counters(fix=False):
+    '''
+    Compares the fleet counters with the drone table and returns {name: (counter, actual)} for
+    every counter that is off. With fix=True the counters are corrected while writes to the
+    drone table are blocked, so no concurrent trigger update is lost.
+    '''
+    with transaction.atomic():
+      if fix:
+        with connection.cursor() as cursor:
+          cursor.execute(f'LOCK TABLE {Drone._meta.db_table} IN SHARE MODE')
+
+      actual = Drone.objects.aggregate(
+        total=Count('pk'),
+        dangerous=Count('pk', filter=Q(is_dangerous=True))
+      )
+      counters = dict(FleetCounter.objects.values_list('name', 'value'))
+
+      mismatches = {
+        name: (counters.get(name), value)
+        for name, value in actual.items()
+        if counters.get(name) != value
+      }
+
+      if fix:
+        for name, (_, value) in mismatches.items():
+          FleetCounter.objects.update_or_create(name=name, defaults={'value': value})
+
+    return mismatches
+
+  @staticmethod
+  def get_fleet_version():
+    '''
+    The sequence value taken by every write to the drone table (migration 0015), or None
+    while a write that took it may not be visible yet. Writers hold FLEET_WRITE_LOCK shared
+    from taking a value until their commit is visible (migration 0018), so once the lock can
+    be taken exclusively after reading the version, the rows behind it can be read.
+    The lock is only tried, a reader never makes a writer wait longer than this statement.
+    '''
+    with connection.cursor() as cursor:
+      cursor.execute('SELECT last_value FROM drones_fleet_version_seq')
+      version = cursor.fetchone()[0]
+      cursor.execute(
+        'SELECT CASE WHEN pg_try_advisory_lock(%s) THEN pg_advisory_unlock(%s) ELSE false END',
+        [FLEET_WRITE_LOCK, FLEET_WRITE_LOCK]
+      )
+      if not cursor.fetchone()[0]:
+        return None
+    return version
+
+  @staticmethod
+  def get_drone_version(serial_number):
+    '''(created_at, version) of a drone, None when it doesn't exist'''
+    return Drone.objects.filter(serial_number=serial_number).values_list('created_at', 'version').first()
+
+  @staticmethod
+  def get_flight_path_points(drone, since=None, until=None, limit=None):
+    queryset = DroneData.objects.filter(drone=drone)
+
+    if since:
+      queryset = queryset.filter(timestamp__gte=since)
+    if until:
+      queryset = queryset.filter(timestamp__lte=until)
+
+    queryset = queryset.order_by('timestamp').values_list('longitude', 'latitude')
+
+    if limit:
+      queryset = queryset[:limit]
+
+    return queryset
+
+  @staticmethod
+  async def stream_flight_path(points, chunk_size=2000):
+    '''
+    Yields the flight path as a GeoJSON LineString in chunks of chunk_size coordinates.
+    Points are read through a server-side cursor, so memory use does not grow with the path length.
+    An async generator, because the ASGI handler would load a sync iterator into a list first.
+    '''
+    yield '{"type":"LineString","coordinates":['
+
+    chunk = []
+    separator = ''
+    async for longitude, latitude in points.aiterator(chunk_size=chunk_size):
+      chunk.append(f'[{longitude!r},{latitude!r}]')
+      if len(chunk) == chunk_size:
+        yield separator + ','.join(chunk)
+        separator = ','
+        chunk = []
+
+    if chunk:
+      yield separator + ','.join(chunk)
+
+    yield ']}'
+
+  @staticmethod
+  def get_simplified_flight_path(drone, tolerance, since=None, until=None, limit=None):
+    '''
+    Returns the flight path as a GeoJSON string simplified in PostGIS with ST_Simplify,
+    tolerance is in degrees.
+    Results are cached per drone and level of detail. A window that ended in the past keeps its
+    path for FLIGHT_PATH_CACHE_SECONDS, a window still open is cached per time bucket of
+    FLIGHT_PATH_LIVE_CACHE_SECONDS, since a live drone adds a point with every message.
+    '''
+    now = timezone.now()
+    if until is not None and until < now:
+      bucket = 'closed'
+      timeout = settings.FLIGHT_PATH_CACHE_SECONDS
+    else:
+      timeout = settings.FLIGHT_PATH_LIVE_CACHE_SECONDS
+      # 0 turns caching of live paths off
+      if not timeout:
+        return DroneService._simplify_flight_path(drone, tolerance, since, until, limit)
+      bucket = int(now.timestamp() // timeout)
+
+    key_parts = f'{drone.serial_number}:{tolerance!r}:{bucket}:{since}:{until}:{limit}'
+    cache_key = 'flight-path-lod:' + hashlib.md5(key_parts.encode()).hexdigest()
+
+    flight_path = cache.get(cache_key)
+    if flight_path is None:
+      flight_path = DroneService._simplify_flight_path(drone, tolerance, since, until, limit)
+      cache.set(cache_key, flight_path, timeout)
+
+    return flight_path
+
+  @staticmethod
+  def _simplify_flight_path(drone, tolerance, since, until, limit):
+    conditions = ['drone_id = %s']
+    params = [drone.serial_number]
+
+    if since:
+      conditions.append('"timestamp" >= %s')
+      params.append(since)
+    if until:
+      conditions.append('"timestamp" <= %s')
+      params.append(until)
+
+    limit_clause = ''
+    if limit:
+      limit_clause = 'LIMIT %s'
+      params.append(limit)
+
+    sql = f'''
+      SELECT ST_AsGeoJSON(ST_Simplify(ST_MakeLine(path.location::geometry ORDER BY path."timestamp"), %s, true))
+      FROM (
+        SELECT location, "timestamp"
+        FROM {DroneData._meta.db_table}
+        WHERE {' AND '.join(conditions)}
+        ORDER BY "timestamp"
+        {limit_clause}
+      ) AS path
+    '''
+
+    with connection.cursor() as cursor:
+      cursor.execute(sql, [tolerance, *params])
+      flight_path = cursor.fetchone()[0]
+
+    return flight_path or EMPTY_FLIGHT_PATH
 
   
 
 
+def bbox_polygon(bbox):
+  '''
+  SRID 4326 polygon of a (min_lon, min_lat, max_lon, max_lat) bbox with a vertex at least every
+  BBOX_SEGMENT_DEGREES. Compared against geography columns, edges are great circles, which
+  bow toward the poles on a wide box and would take in points outside the rectangle.
+  '''
+  min_x, min_y, max_x, max_y = bbox
+
+  def edge(x0, y0, x1, y1):
+    steps = max(1, math.ceil(max(abs(x1 - x0), abs(y1 - y0)) / BBOX_SEGMENT_DEGREES))
+    return [(x0 + (x1 - x0) * i / steps, y0 + (y1 - y0) * i / steps) for i in range(steps)]
+
+  ring = (
+    edge(min_x, min_y, max_x, min_y) + edge(max_x, min_y, max_x, max_y) +
+    edge(max_x, max_y, min_x, max_y) + edge(min_x, max_y, min_x, min_y)
+  )
+  return Polygon(ring + [ring[0]], srid=4326)
+
+
 def validate_coordinate_params(params):
   if 'longitude' not in params or 'latitude' not in params:
     raise ValidationError({
@@ -91,4 +540,186 @@ def validate_coordinate_params(params):
   if latitude < -90 or latitude > 90:
       raise ValidationError({"error": "latitude must be between -90 and 90"})
   
-  return longitude, latitude
\ No newline at end of file
+  return longitude, latitude
+
+
+def validate_osd_message(data):
+  '''raises ValueError when an OSD payload lacks a usable position, height or speed'''
+  if not isinstance(data, dict):
+    raise ValueError(f"OSD payload must be an object, got {type(data).__name__}")
+
+  for key in OSD_NUMERIC_FIELDS:
+    value = data.get(key)
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+      raise ValueError(f"{key} must be a finite number, got {value!r}")
+
+  if not -180 <= data['longitude'] <= 180:
+    raise ValueError(f"longitude must be between -180 and 180, got {data['longitude']!r}")
+  if not -90 <= data['latitude'] <= 90:
+    raise ValueError(f"latitude must be between -90 and 90, got {data['latitude']!r}")
+
+
+def parse_datetime_param(params, name):
+  value = params.get(name)
+  if not value:
+    return None
+
+  parsed = parse_datetime(value)
+  if parsed is None:
+    raise ValidationError({"error": f"{name} must be a valid ISO 8601 datetime"})
+
+  if timezone.is_naive(parsed):
+    parsed = timezone.make_aware(parsed)
+
+  return parsed
+
+
+def parse_positive_int_param(params, name):
+  value = params.get(name)
+  if not value:
+    return None
+
+  try:
+    parsed = int(value)
+  except ValueError:
+    raise ValidationError({"error": f"{name} must be a valid integer"})
+
+  if parsed < 1:
+    raise ValidationError({"error": f"{name} must be a positive integer"})
+
+  return parsed
+
+
+def validate_spatial_query_params(params):
+  '''returns the keyword arguments of DroneService.query_drones_spatial'''
+  modes = [name for name in ['radius', 'bbox', 'k'] if params.get(name)]
+  if len(modes) != 1:
+    raise ValidationError({"error": "exactly one of radius, bbox or k is required"})
+
+  point = None
+  if 'longitude' in params or 'latitude' in params or modes[0] != 'bbox':
+    point = Point(*validate_coordinate_params(params), srid=4326)
+
+  radius = None
+  if params.get('radius'):
+    try:
+      radius = float(params.get('radius'))
+    except ValueError:
+      raise ValidationError({"error": "radius must be a valid number of meters"})
+    if not radius > 0:
+      raise ValidationError({"error": "radius must be a positive number of meters"})
+
+  k = parse_positive_int_param(params, 'k')
+  if k and k > MAX_NEAREST:
+    raise ValidationError({"error": f"k must not be greater than {MAX_NEAREST}"})
+
+  return {
+    'point': point,
+    'radius': radius,
+    'k': k,
+    'bbox': parse_bbox_param(params),
+    'online': params.get('online', '').lower() in ['1', 'true'],
+    'limit': parse_positive_int_param(params, 'limit')
+  }
+
+
+def validate_search_params(params):
+  search = params.get('search', '').strip()
+  if not search:
+    raise ValidationError({"error": "search must not be empty"})
+
+  mode = params.get('search_mode') or 'substring'
+  if mode not in SEARCH_MODES:
+    raise ValidationError({"error": f"search_mode must be one of {', '.join(SEARCH_MODES)}"})
+
+  limit = parse_positive_int_param(params, 'limit') or DEFAULT_SEARCH_LIMIT
+  if limit > MAX_SEARCH_LIMIT:
+    raise ValidationError({"error": f"limit must not be greater than {MAX_SEARCH_LIMIT}"})
+
+  return search, mode, limit
+
+
+def validate_flight_path_params(params):
+  since = parse_datetime_param(params, 'since')
+  until = parse_datetime_param(params, 'until')
+  limit = parse_positive_int_param(params, 'limit')
+
+  if since and until and since > until:
+    raise ValidationError({"error": "since must be earlier than until"})
+
+  return since, until, limit
+
+
+def parse_bbox_param(params, name='bbox'):
+  '''parses a min_lon,min_lat,max_lon,max_lat bounding box'''
+  value = params.get(name)
+  if not value:
+    return None
+
+  try:
+    min_lon, min_lat, max_lon, max_lat = [float(part) for part in value.split(',')]
+  except ValueError:
+    raise ValidationError({"error": f"{name} must be four numbers: min_lon,min_lat,max_lon,max_lat"})
+
+  if min_lon < -180 or max_lon > 180 or min_lat < -90 or max_lat > 90:
+    raise ValidationError({"error": f"{name} must be within -180,-90,180,90"})
+
+  if min_lon > max_lon or min_lat > max_lat:
+    raise ValidationError({"error": f"{name} minimums must not be greater than its maximums"})
+
+  return min_lon, min_lat, max_lon, max_lat
+
+
+def validate_simplification_params(params):
+  '''
+  Returns the simplification tolerance in degrees, either given directly as tolerance
+  or derived from a web map zoom level as the width of one 256px tile pixel.
+  '''
+  if params.get('tolerance'):
+    try:
+      tolerance = float(params.get('tolerance'))
+    except ValueError:
+      raise ValidationError({"error": "tolerance must be a valid number"})
+
+    if not tolerance > 0:
+      raise ValidationError({"error": "tolerance must be a positive number"})
+
+    return tolerance
+
+  zoom = parse_zoom_param(params)
+  if zoom is not None:
+    return 360 / (256 * 2 ** zoom)
+
+  return None
+
+
+def parse_zoom_param(params):
+  if not params.get('zoom'):
+    return None
+
+  try:
+    zoom = int(params.get('zoom'))
+  except ValueError:
+    raise ValidationError({"error": "zoom must be a valid integer"})
+
+  if zoom < 0 or zoom > 24:
+    raise ValidationError({"error": "zoom must be between 0 and 24"})
+
+  return zoom
+
+
+def validate_tile_coordinates(z, x, y):
+  if z > 24:
+    raise ValidationError({"error": "z must be between 0 and 24"})
+
+  if x >= 2 ** z or y >= 2 ** z:
+    raise ValidationError({"error": f"x and y must be between 0 and {2 ** z - 1} at zoom {z}"})
+
+
+def validate_cluster_params(params):
+  bbox = parse_bbox_param(params)
+  zoom = parse_zoom_param(params)
+  if bbox is None or zoom is None:
+    raise ValidationError({"error": "both bbox and zoom parameters are required"})
+
+  return bbox, zoom, params.get('online', '').lower() in ['1', 'true']
\ No newline at end of file
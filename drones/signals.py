@@ -0,0 +1,28 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Drone, NoFlyZone
+from .spatial import no_fly_zone_index
+from .state_store import drone_state_store
+from .compaction import raw_data_compactor
+
+
+@receiver(post_save, sender=NoFlyZone)
+@receiver(post_delete, sender=NoFlyZone)
+def invalidate_no_fly_zone_index(sender, **kwargs):
+  # invalidate right away so this process sees its own change, and again on commit
+  # in case another thread rebuilt the index from the old rows in the meantime
+  no_fly_zone_index.invalidate()
+  transaction.on_commit(no_fly_zone_index.invalidate)
+
+
+@receiver(post_save, sender=Drone)
+def write_drone_state(sender, instance, **kwargs):
+  transaction.on_commit(lambda: drone_state_store.write_through([instance]))
+
+
+@receiver(post_delete, sender=Drone)
+def delete_drone_state(sender, instance, **kwargs):
+  transaction.on_commit(lambda: drone_state_store.delete([instance.serial_number]))
+  # the drone's profiles were deleted with it
+  raw_data_compactor.forget([instance.serial_number])
@@ -0,0 +1,71 @@
+import threading
+import time
+from django.conf import settings
+from django.db.models import Count, Max
+from .models import NoFlyZone
+
+
+class NoFlyZoneIndex:
+  '''
+  Process-local index of no fly zones, used to classify telemetry without a database round-trip.
+  Every zone is kept as a prepared GEOS geometry behind a bounding box check, and containment
+  follows the same planar ST_Contains semantics as the geometry__contains lookup.
+  The index is invalidated by the NoFlyZone save/delete signals of this process, and every
+  refresh_interval seconds a version stamp is read from the database so changes made by
+  other processes are picked up as well.
+  '''
+  def __init__(self, refresh_interval=None):
+    self.refresh_interval = refresh_interval
+    self._lock = threading.Lock()
+    self._zones = None
+    self._version = None
+    self._checked_at = 0
+
+  def invalidate(self):
+    with self._lock:
+      self._zones = None
+
+  def get_zones(self):
+    '''returns a list of (min_x, min_y, max_x, max_y, name, prepared_geometry) tuples'''
+    refresh_interval = self.refresh_interval
+    if refresh_interval is None:
+      refresh_interval = settings.NO_FLY_ZONE_REFRESH_SECONDS
+
+    with self._lock:
+      now = time.monotonic()
+      if self._zones is not None and now - self._checked_at < refresh_interval:
+        return self._zones
+
+      version = self._current_version()
+      if self._zones is None or version != self._version:
+        self._zones = self._load_zones()
+        self._version = version
+      self._checked_at = now
+
+      return self._zones
+
+  def get_version(self):
+    self.get_zones()
+    return self._version
+
+  def containing_zones(self, location):
+    '''returns the names of all zones containing the point, ordered by zone id'''
+    x, y = location.x, location.y
+    return [
+      name for min_x, min_y, max_x, max_y, name, prepared in self.get_zones()
+      if min_x <= x <= max_x and min_y <= y <= max_y and prepared.contains(location)
+    ]
+
+  def _current_version(self):
+    version = NoFlyZone.objects.aggregate(count=Count('id'), last_id=Max('id'), updated_at=Max('updated_at'))
+    return version['count'], version['last_id'], version['updated_at']
+
+  def _load_zones(self):
+    zones = []
+    for zone in NoFlyZone.objects.order_by('id'):
+      min_x, min_y, max_x, max_y = zone.geometry.extent
+      zones.append((min_x, min_y, max_x, max_y, zone.name, zone.geometry.prepared))
+    return zones
+
+
+no_fly_zone_index = NoFlyZoneIndex()
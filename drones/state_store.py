@@ -0,0 +1,235 @@
+import json
+import threading
+import time
+from django.conf import settings
+from django.http import HttpResponse
+from .models import Drone
+from .serializers import drone_representation, format_datetime
+
+
+class LocalMemoryBackend:
+  '''process-local backend, only shared within one process (development and tests)'''
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._states = {}
+    self._seen = {}
+    self._created = {}
+    self._meta = {}
+
+  def write(self, states, seen, created):
+    with self._lock:
+      self._states.update(states)
+      self._seen.update(seen)
+      self._created.update(created)
+
+  def get_created(self, serials):
+    with self._lock:
+      return {serial: self._created[serial] for serial in serials if serial in self._created}
+
+  def read_all(self):
+    with self._lock:
+      return list(self._states.values())
+
+  def read_seen_since(self, timestamp):
+    with self._lock:
+      return [self._states[serial] for serial, seen in self._seen.items() if seen >= timestamp]
+
+  def evict_seen_before(self, timestamp):
+    with self._lock:
+      serials = [serial for serial, seen in self._seen.items() if seen < timestamp]
+    self.delete(serials)
+
+  def delete(self, serials):
+    with self._lock:
+      for serial in serials:
+        self._states.pop(serial, None)
+        self._seen.pop(serial, None)
+        self._created.pop(serial, None)
+
+  def get_meta(self, name):
+    with self._lock:
+      return self._meta.get(name)
+
+  def set_meta(self, name, value):
+    with self._lock:
+      self._meta[name] = value
+
+
+class RedisBackend:
+  '''
+  Keeps the states in a Redis (or compatible) server shared by every worker:
+  a hash of rendered states, a sorted set of last seen timestamps used for the
+  online range and TTL eviction, and a hash of creation times.
+  '''
+  def __init__(self, url, prefix='drones'):
+    import redis
+
+    self.client = redis.Redis.from_url(url, decode_responses=True)
+    self.state_key = f'{prefix}:state'
+    self.seen_key = f'{prefix}:seen'
+    self.created_key = f'{prefix}:created'
+    self.meta_key = f'{prefix}:meta'
+
+  def write(self, states, seen, created):
+    pipeline = self.client.pipeline(transaction=False)
+    pipeline.hset(self.state_key, mapping=states)
+    pipeline.zadd(self.seen_key, seen)
+    if created:
+      pipeline.hset(self.created_key, mapping=created)
+    pipeline.execute()
+
+  def get_created(self, serials):
+    values = self.client.hmget(self.created_key, serials)
+    return {serial: value for serial, value in zip(serials, values) if value is not None}
+
+  def read_all(self):
+    return self.client.hvals(self.state_key)
+
+  def read_seen_since(self, timestamp):
+    serials = self.client.zrangebyscore(self.seen_key, timestamp, '+inf')
+    if not serials:
+      return []
+    return [state for state in self.client.hmget(self.state_key, serials) if state is not None]
+
+  def evict_seen_before(self, timestamp):
+    self.delete(self.client.zrangebyscore(self.seen_key, '-inf', f'({timestamp}'))
+
+  def delete(self, serials):
+    if not serials:
+      return
+    pipeline = self.client.pipeline(transaction=False)
+    pipeline.hdel(self.state_key, *serials)
+    pipeline.zrem(self.seen_key, *serials)
+    pipeline.hdel(self.created_key, *serials)
+    pipeline.execute()
+
+  def get_meta(self, name):
+    value = self.client.hget(self.meta_key, name)
+    return float(value) if value is not None else None
+
+  def set_meta(self, name, value):
+    self.client.hset(self.meta_key, name, value)
+
+
+class DroneStateStore:
+  '''
+  Last known state of every drone keyed by serial number, written through by the ingest path.
+  States are stored already rendered in the DroneSerializer format so list endpoints can
+  return them without touching the database or DRF serializers.
+  Drones not seen for DRONE_STATE_TTL seconds are evicted, so the online list can always
+  be served from the store while the full and dangerous lists can only be served when
+  eviction is disabled and the store was primed from the database.
+  Reads return None, meaning "use the database", when the store is disabled or has not
+  been written to within DRONE_STATE_MAX_STALENESS seconds.
+  '''
+  EVICT_INTERVAL = 10
+
+  def __init__(self):
+    self._backends = {}
+    self._evicted_at = 0
+
+  @property
+  def backend(self):
+    url = settings.DRONE_STATE_STORE_URL
+    if not url:
+      return None
+    if url not in self._backends:
+      self._backends[url] = LocalMemoryBackend() if url == 'locmem://' else RedisBackend(url)
+    return self._backends[url]
+
+  def write_through(self, drones, created_at_known=True):
+    '''
+    Stores the state of the given Drone instances. Bulk upserted instances don't carry the
+    real created_at of drones that already existed, for those pass created_at_known=False
+    and it is taken from the store or, for drones new to the store, from the database.
+    '''
+    backend = self.backend
+    if not backend:
+      return
+
+    drones = list(drones)
+    if not drones:
+      return
+
+    created = {}
+    if not created_at_known:
+      serials = [drone.serial_number for drone in drones]
+      created = backend.get_created(serials)
+      missing = [serial for serial in serials if serial not in created]
+      if missing:
+        for serial, created_at in Drone.objects.filter(pk__in=missing).values_list('serial_number', 'created_at'):
+          created[serial] = format_datetime(created_at)
+
+    states = {}
+    seen = {}
+    for drone in drones:
+      state = drone_representation(drone)
+      if drone.serial_number in created:
+        state['created_at'] = created[drone.serial_number]
+      states[drone.serial_number] = json.dumps(state, separators=(',', ':'), ensure_ascii=False)
+      seen[drone.serial_number] = drone.last_seen.timestamp()
+      created[drone.serial_number] = state['created_at']
+
+    backend.write(states, seen, created)
+    now = time.time()
+    backend.set_meta('synced_at', now)
+
+    ttl = settings.DRONE_STATE_TTL
+    if ttl and now - self._evicted_at > self.EVICT_INTERVAL:
+      backend.evict_seen_before(now - ttl)
+      self._evicted_at = now
+
+  def delete(self, serial_numbers):
+    backend = self.backend
+    if backend:
+      backend.delete(list(serial_numbers))
+
+  def prime(self):
+    '''loads every drone from the database, marking the store as covering the whole fleet'''
+    backend = self.backend
+    if not backend:
+      return
+
+    chunk = []
+    for drone in Drone.objects.iterator(chunk_size=1000):
+      chunk.append(drone)
+      if len(chunk) == 1000:
+        self.write_through(chunk)
+        chunk = []
+    self.write_through(chunk)
+    backend.set_meta('primed_at', time.time())
+
+  def is_fresh(self):
+    backend = self.backend
+    if not backend:
+      return False
+    synced_at = backend.get_meta('synced_at')
+    return synced_at is not None and time.time() - synced_at <= settings.DRONE_STATE_MAX_STALENESS
+
+  def covers_fleet(self):
+    return not settings.DRONE_STATE_TTL and self.backend.get_meta('primed_at') is not None
+
+  def list_online(self, since):
+    '''returns rendered states of drones seen since the given datetime'''
+    if not self.is_fresh():
+      return None
+    return self.backend.read_seen_since(since.timestamp())
+
+  def list_all(self):
+    if not self.is_fresh() or not self.covers_fleet():
+      return None
+    return self.backend.read_all()
+
+  def list_dangerous(self):
+    states = self.list_all()
+    if states is None:
+      return None
+    # the rendered states are compact JSON, so the flag can be matched without parsing
+    return [state for state in states if '"is_dangerous":true' in state]
+
+
+def rendered_list_response(states):
+  return HttpResponse('[' + ','.join(states) + ']', content_type='application/json')
+
+
+drone_state_store = DroneStateStore()
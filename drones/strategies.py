@@ -1,31 +1,70 @@
 from abc import ABC, abstractmethod
-from .models import NoFlyZone
+import numpy as np
+from django.contrib.gis.geos import Point
+from .spatial import no_fly_zone_index
 
 class DangerClassificationStrategy(ABC):
   @abstractmethod
   def is_dangerous(self, height, speed, location):
     pass
 
+  def is_dangerous_batch(self, heights, speeds, lons, lats):
+    '''
+    Classifies a batch of float arrays (missing values as NaN).
+    Returns a boolean mask and the reasons, either one string for all flagged rows or a list with a reason per row.
+    Strategies that can't be vectorized fall back to calling is_dangerous for every row.
+    '''
+    mask = np.zeros(len(heights), dtype=bool)
+    reasons = [None] * len(heights)
+
+    for i in range(len(heights)):
+      height = None if np.isnan(heights[i]) else float(heights[i])
+      speed = None if np.isnan(speeds[i]) else float(speeds[i])
+      mask[i], reasons[i] = self.is_dangerous(height, speed, Point(float(lons[i]), float(lats[i])))
+
+    return mask, reasons
+
 class HeightDangerStrategy(DangerClassificationStrategy):
   def is_dangerous(self, height, speed, location):
     if height is not None and height > 500:
       return True, 'Flying higher than 500 meter'
     return False, None
-  
+
+  def is_dangerous_batch(self, heights, speeds, lons, lats):
+    # NaN compares as False, like a missing height
+    return heights > 500, 'Flying higher than 500 meter'
+
 class SpeedDangerStrategy(DangerClassificationStrategy):
   def is_dangerous(self, height, speed, location):
     if speed is not None and speed > 10:
       return True, 'Moving faster than 10 m/s'
     return False, None
-    
+
+  def is_dangerous_batch(self, heights, speeds, lons, lats):
+    return speeds > 10, 'Moving faster than 10 m/s'
+
 class NoFlyZoneDangerStrategy(DangerClassificationStrategy):
   def is_dangerous(self, height, speed, location):
-    overlapping_zones = NoFlyZone.objects.filter(geometry__contains=location)
-    if overlapping_zones:
-      zone_names = ', '.join([zone.name for zone in overlapping_zones])
-      return True, f'Entering no fly zone: {zone_names}'
+    zone_names = no_fly_zone_index.containing_zones(location)
+    if zone_names:
+      return True, f'Entering no fly zone: {", ".join(zone_names)}'
     return False, None
 
+  def is_dangerous_batch(self, heights, speeds, lons, lats):
+    zone_names = [[] for _ in range(len(lons))]
+    mask = np.zeros(len(lons), dtype=bool)
+
+    for min_x, min_y, max_x, max_y, name, prepared in no_fly_zone_index.get_zones():
+      # only points inside the zone's bounding box reach the exact GEOS test
+      candidates = np.nonzero((lons >= min_x) & (lons <= max_x) & (lats >= min_y) & (lats <= max_y))[0]
+      for i in candidates:
+        if prepared.contains(Point(float(lons[i]), float(lats[i]))):
+          mask[i] = True
+          zone_names[i].append(name)
+
+    reasons = [f'Entering no fly zone: {", ".join(names)}' if names else None for names in zone_names]
+    return mask, reasons
+
 class DangerClassifier:
   def __init__(self):
     self.strategies = [
@@ -33,7 +72,7 @@ class DangerClassifier:
       SpeedDangerStrategy(),
       NoFlyZoneDangerStrategy()
     ]
-  
+
   def classify_danger(self, height, speed, location):
     reasons = []
     is_dangerous = False
@@ -43,8 +82,33 @@ class DangerClassifier:
       if dangerous:
         is_dangerous = True
         reasons.append(reason)
-    
+
     if reasons:
       return is_dangerous, ' and '.join(reasons)
     else:
-      return False, None
\ No newline at end of file
+      return False, None
+
+  def classify_batch(self, heights, speeds, lons, lats):
+    '''
+    Classifies many points at once, missing heights or speeds may be given as None.
+    Returns a boolean array of flags and a list of reasons, matching classify_danger row by row.
+    '''
+    heights = np.asarray(heights, dtype=float)
+    speeds = np.asarray(speeds, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    lats = np.asarray(lats, dtype=float)
+
+    results = [strategy.is_dangerous_batch(heights, speeds, lons, lats) for strategy in self.strategies]
+    flags = np.zeros(len(heights), dtype=bool)
+    for mask, _ in results:
+      flags |= mask
+
+    reasons = [None] * len(heights)
+    for i in np.nonzero(flags)[0]:
+      row_reasons = []
+      for mask, strategy_reasons in results:
+        if mask[i]:
+          row_reasons.append(strategy_reasons if isinstance(strategy_reasons, str) else strategy_reasons[i])
+      reasons[i] = ' and '.join(row_reasons)
+
+    return flags, reasons
@@ -1,17 +1,56 @@
+import asyncio
+import json
+import tempfile
+from io import StringIO
+from unittest import mock
+from asgiref.sync import async_to_sync
 from rest_framework.test import APITestCase
 from django.urls import reverse
-from .models import Drone, DroneData
-from django.contrib.gis.geos import Point
+from django.test import override_settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from .models import Drone, DroneData, DronePresenceEvent, NoFlyZone
+from django.contrib.gis.geos import Point, Polygon
 from django.utils import timezone
 from rest_framework import status
 from datetime import timedelta
 from django.contrib.auth import get_user_model
+from .services import DroneService
+from .rollups import rollup_telemetry
+from .state_store import drone_state_store, rendered_list_response
+from .serializers import DroneSerializer, drone_representation, render_drone_rows
+from rest_framework.renderers import JSONRenderer
+from .presence import PresenceTracker
+from .ingest import BatchWriter
+from .feed import DroneFeedHub
+from .spatial import no_fly_zone_index
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import AccessToken
+from backend_task.authentication import CachedJWTAuthentication, jwt_user_cache
 
 User = get_user_model()
 
 
+def streamed_content(response):
+  '''reads a streaming response, async iterators included, which the sync test client leaves unconsumed'''
+  if not response.is_async:
+    return b''.join(response.streaming_content)
+
+  async def read():
+    return b''.join([chunk async for chunk in response.streaming_content])
+  return async_to_sync(read)()
+
+
 class DroneAPITestCase(APITestCase):
   def setUp(self):
+    # the zone index is process-wide and would keep zones of rolled back tests
+    no_fly_zone_index.invalidate()
+    self.addCleanup(no_fly_zone_index.invalidate)
+    # live flight paths are cached per time bucket, which outlasts a test
+    cache.clear()
     self.user = User.objects.create_user(username='testuser', password='testpassword')
     # 2. Force authenticate the client with this user
     self.client.force_authenticate(user=self.user)
@@ -91,6 +130,53 @@ class DroneAPITestCase(APITestCase):
 
     response_data = response.json()
     self.assertEqual(len(response_data), 4)
+
+  def test_fast_list_rendering(self):
+    '''test that the fast list path renders the same bytes as DroneSerializer'''
+
+    self.drone_1.dangerous_reason = 'Zone "A" é\u2028'
+    self.drone_1.save()
+    queryset = Drone.objects.order_by('serial_number')
+
+    expected = JSONRenderer().render(DroneSerializer(queryset, many=True).data)
+    self.assertEqual(rendered_list_response(render_drone_rows(queryset)).content, expected)
+
+    with override_settings(DRONE_FAST_LIST_RENDERING=False):
+      slow = self.client.get(reverse('drones-list')).json()
+    fast = self.client.get(reverse('drones-list')).json()
+    self.assertEqual(sorted(fast, key=lambda drone: drone['serial_number']), sorted(slow, key=lambda drone: drone['serial_number']))
+
+
+  def test_search_drones(self):
+    '''test prefix search with a limit and typo-tolerant fuzzy search'''
+
+    url = reverse('drones-list')
+    response = self.client.get(url, {'search': 'drone_0', 'search_mode': 'prefix', 'limit': 2})
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertEqual([drone['serial_number'] for drone in response.json()], ['Drone_01', 'Drone_02'])
+
+    response = self.client.get(url, {'search': 'dorne_03', 'search_mode': 'fuzzy'})
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertEqual(response.json()[0]['serial_number'], 'Drone_03')
+
+    response = self.client.get(url, {'search': 'drone', 'search_mode': 'regex'})
+    self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+  def test_list_drones_cursor_pagination(self):
+    '''test that following the next links of a paginated list returns every drone once in serial order'''
+
+    url = f"{reverse('drones-list')}?page_size=3"
+    serials = []
+    while url:
+      response = self.client.get(url)
+      self.assertEqual(response.status_code, status.HTTP_200_OK)
+      page = response.json()
+      self.assertLessEqual(len(page['results']), 3)
+      serials.extend(drone['serial_number'] for drone in page['results'])
+      url = page['next']
+
+    self.assertEqual(serials, ['Drone_01', 'Drone_02', 'Drone_03', 'Drone_04'])
     
 
   def test_drone_by_serial(self):
@@ -197,6 +283,79 @@ class DroneAPITestCase(APITestCase):
     self.assertEqual(len(response_data), 0)
 
 
+  def test_nearby_drones(self):
+    '''test radius, k nearest and bbox queries with distances, and the online filter'''
+
+    url = reverse('drones-nearby')
+    target = {'longitude': self.drone_1.last_location.x, 'latitude': self.drone_1.last_location.y}
+
+    response = self.client.get(url, {**target, 'radius': 10000})
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    response_data = response.json()
+    self.assertEqual([drone['serial_number'] for drone in response_data], ['Drone_01', 'Drone_04'])
+    self.assertAlmostEqual(response_data[0]['distance'], 0)
+    self.assertGreater(response_data[1]['distance'], 4000)
+
+    response = self.client.get(url, {**target, 'k': 3})
+    self.assertEqual([drone['serial_number'] for drone in response.json()], ['Drone_01', 'Drone_04', 'Drone_03'])
+
+    response = self.client.get(url, {**target, 'k': 3, 'online': 'true'})
+    self.assertEqual([drone['serial_number'] for drone in response.json()], ['Drone_01', 'Drone_03'])
+
+    response = self.client.get(url, {'bbox': '31.9,35.8,32.0,35.9'})
+    response_data = response.json()
+    self.assertEqual([drone['serial_number'] for drone in response_data], ['Drone_01', 'Drone_04'])
+    self.assertIsNone(response_data[0]['distance'])
+
+    # a wide box matches its lat/lon rectangle, not the area under great circle edges
+    response = self.client.get(url, {'bbox': '-30,10,90,35'})
+    self.assertEqual(response.json(), [])
+
+    response = self.client.get(url, {**target, 'radius': 1000, 'k': 2})
+    self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+  def test_drone_clusters(self):
+    '''test that a sparse viewport returns drones and a dense one returns grid clusters'''
+
+    url = reverse('drone-clusters')
+    params = {'bbox': '31,35,33,36', 'zoom': 8}
+
+    response = self.client.get(url, params)
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertFalse(response.json()['clustered'])
+    self.assertEqual([drone['serial_number'] for drone in response.json()['drones']], ['Drone_01', 'Drone_03', 'Drone_04'])
+
+    with override_settings(DRONE_CLUSTER_THRESHOLD=2):
+      response = self.client.get(url, params)
+
+    clusters = response.json()['clusters']
+    self.assertEqual([cluster['count'] for cluster in clusters], [2, 1])
+    self.assertEqual(clusters[0]['dangerous'], 0)
+    self.assertEqual(clusters[1]['serial_number'], 'Drone_03')
+
+    response = self.client.get(url, {'bbox': '31,35,33,36'})
+    self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    # the top edge of a wide viewport follows its latitude, not a great circle bowing north over the drones
+    response = self.client.get(url, {'bbox': '-30,10,90,35', 'zoom': 2})
+    self.assertEqual(response.json()['drones'], [])
+
+
+  def test_drone_tile(self):
+    '''test that a tile covering drones is a non-empty vector tile and that out of range tiles are rejected'''
+
+    # zoom 0 covers the whole world
+    response = self.client.get(reverse('drone-tile', kwargs={'z': 0, 'x': 0, 'y': 0}))
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertEqual(response['Content-Type'], 'application/vnd.mapbox-vector-tile')
+    self.assertIn(b'drones', response.content)
+    self.assertIn(b'Drone_01', response.content)
+
+    response = self.client.get(reverse('drone-tile', kwargs={'z': 1, 'x': 2, 'y': 0}))
+    self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
   def test_drone_flight_path(self):
     '''test returning the flight path for drone as geojson'''
 
@@ -205,7 +364,7 @@ class DroneAPITestCase(APITestCase):
 
     self.assertEqual(response.status_code, status.HTTP_200_OK)
 
-    response_data = response.json()
+    response_data = json.loads(streamed_content(response))
 
     self.assertIn('type', response_data)
     self.assertEqual('LineString', response_data['type'])
@@ -216,10 +375,459 @@ class DroneAPITestCase(APITestCase):
     self.assertEqual(response_data['coordinates'][1], [self.data_point_2.location.x, self.data_point_2.location.y])
     self.assertEqual(response_data['coordinates'][2], [self.data_point_3.location.x, self.data_point_3.location.y])
 
+  def test_drone_flight_path_window(self):
+    '''test limiting the flight path by time window and number of points'''
+
+    url = reverse('drone-flight-path', kwargs={'serial_number': self.drone_1.serial_number})
+    since = DroneData.objects.get(pk=self.data_point_2.pk).timestamp
+    response = self.client.get(url, {'since': since.isoformat(), 'limit': 1})
+
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    response_data = json.loads(streamed_content(response))
+    self.assertEqual(response_data['coordinates'], [[self.data_point_2.longitude, self.data_point_2.latitude]])
+
+    response = self.client.get(url, {'limit': 'abc'})
+    self.assertEqual(response.status_code, 400)
+    self.assertIn('error', response.json())
+
+  def test_drone_flight_path_simplified(self):
+    '''test that a low zoom level simplifies the flight path down to its end points'''
+
+    url = reverse('drone-flight-path', kwargs={'serial_number': self.drone_1.serial_number})
+    response = self.client.get(url, {'zoom': 0})
+
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    response_data = response.json()
+    self.assertEqual('LineString', response_data['type'])
+    self.assertEqual(response_data['coordinates'], [
+      [self.data_point_1.longitude, self.data_point_1.latitude],
+      [self.data_point_3.longitude, self.data_point_3.latitude]
+    ])
+
+  def test_drone_rollups(self):
+    '''test that rollups count every point once and are served for a time range'''
+
+    until = timezone.now() + timedelta(minutes=1)
+    rollup_telemetry(grace=0)
+    rollup_telemetry(grace=0)
+
+    # a backfilled row older than the rolled up ones is still picked up
+    DroneData.objects.create(
+      drone=self.drone_1,
+      location=Point(35.8309, 31.9783, srid=4326),
+      timestamp=timezone.now() - timedelta(minutes=20),
+      latitude=31.9783,
+      longitude=35.8309,
+      horizontal_speed=1,
+      height=10,
+      raw_data={}
+    )
+    rollup_telemetry(grace=0)
+
+    url = reverse('drone-rollups', kwargs={'serial_number': self.drone_1.serial_number})
+    response = self.client.get(url, {'since': (until - timedelta(minutes=30)).isoformat(), 'until': until.isoformat()})
+
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    response_data = response.json()
+    self.assertEqual(sum(rollup['point_count'] for rollup in response_data), 4)
+    self.assertEqual(response_data[1]['first_latitude'], self.data_point_1.latitude)
+    self.assertEqual(response_data[-1]['last_latitude'], self.data_point_3.latitude)
+    self.assertEqual(response_data[1]['avg_height'], 10)
+
+  def test_drone_feed_invalid_bbox(self):
+    '''test that the live feed rejects a malformed bounding box'''
+
+    url = reverse('drone-feed')
+    response = self.client.get(url, {'bbox': '1,2,3'})
+
+    self.assertEqual(response.status_code, 400)
+    self.assertIn('error', response.json())
+
+  def test_drone_feed_fan_out(self):
+    '''test that every subscriber of the feed gets the deltas matching its bbox and serial filters'''
+
+    inside = {'serial_number': 'Drone_01', 'longitude': 35.8, 'latitude': 31.9}
+    outside = {'serial_number': 'Drone_02', 'longitude': 40.7, 'latitude': -74.0}
+
+    async def receive():
+      hub = DroneFeedHub()
+      streams = {
+        'all': hub.stream(),
+        'bbox': hub.stream(bbox=(35, 31, 36, 32)),
+        'serial': hub.stream(serials={'Drone_02'})
+      }
+      for stream in streams.values():
+        self.assertEqual(await anext(stream), 'retry: 3000\n\n')
+
+      hub.publish([inside, outside])
+      events = {name: await asyncio.wait_for(anext(stream), timeout=1) for name, stream in streams.items()}
+      for stream in streams.values():
+        await stream.aclose()
+      return events
+
+    events = async_to_sync(receive)()
+
+    def serials(event):
+      self.assertTrue(event.startswith('event: drones\ndata: '))
+      return [delta['serial_number'] for delta in json.loads(event.split('data: ', 1)[1])]
+
+    self.assertEqual(serials(events['all']), ['Drone_01', 'Drone_02'])
+    self.assertEqual(serials(events['bbox']), ['Drone_01'])
+    self.assertEqual(serials(events['serial']), ['Drone_02'])
+
+  def test_drone_stats(self):
+    '''test counting total, online and dangerous drones'''
+
+    url = reverse('drone-stats')
+    response = self.client.get(url)
+
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertEqual(response.json(), {'total': 4, 'online': 2, 'dangerous': 2})
+
+  def test_drone_stats_counters(self):
+    '''test that the trigger-maintained counters follow inserts, updates and deletes'''
+
+    self.drone_1.is_dangerous = True
+    self.drone_1.save()
+    self.drone_4.delete()
+
+    with override_settings(DRONE_STATS_MODE='counters'):
+      response = self.client.get(reverse('drone-stats'))
+
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertEqual(response.json(), {'total': 3, 'online': 2, 'dangerous': 3})
+    self.assertEqual(DroneService.reconcile_fleet_counters(), {})
+
+  def test_conditional_get(self):
+    '''test that unchanged lists and drones answer If-None-Match with 304 until they are written to'''
+
+    url = reverse('dangerous-drones-list')
+    response = self.client.get(url)
+    etag = response['ETag']
+
+    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+    self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+    self.assertEqual(response.content, b'')
+
+    detail_url = reverse('drone-detail', kwargs={'serial_number': 'Drone_01'})
+    detail_etag = self.client.get(detail_url)['ETag']
+    self.assertEqual(self.client.get(detail_url, HTTP_IF_NONE_MATCH=detail_etag).status_code, status.HTTP_304_NOT_MODIFIED)
+
+    self.drone_1.last_height = 60
+    self.drone_1.save()
+    # the fleet version trigger is deferred to commit, which the test transaction never reaches
+    with connection.cursor() as cursor:
+      cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertNotEqual(response['ETag'], etag)
+    self.assertEqual(self.client.get(detail_url, HTTP_IF_NONE_MATCH=detail_etag).status_code, status.HTTP_200_OK)
+
+  @override_settings(DRONE_STATE_STORE_URL='locmem://', DRONE_STATE_TTL=0)
+  def test_online_drones_from_state_store(self):
+    '''test that the state store serves the same online drones, in the same format, as the database'''
+
+    expected = {drone['serial_number']: drone for drone in self.client.get(reverse('online-drones-list')).json()}
+
+    drone_state_store.write_through(Drone.objects.all())
+    response = self.client.get(reverse('online-drones-list'))
+
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertEqual({drone['serial_number']: drone for drone in response.json()}, expected)
+
+    # the store was not primed, so the full list still comes from the database
+    self.assertIsNone(drone_state_store.list_all())
+
+    # drone_1 was created with integer height and speed, still rendered as floats like DroneSerializer does
+    self.assertEqual(
+      JSONRenderer().render(drone_representation(self.drone_1)),
+      JSONRenderer().render(DroneSerializer(self.drone_1).data)
+    )
+
   def test_within_5km_missing_params(self):
     """test that within-5km endpoint returns error when parameters are missing"""
     url = reverse('drones-within-5km-from-point')
     response = self.client.get(url)
     
     self.assertEqual(response.status_code, 400)
-    self.assertIn('error', response.json())
\ No newline at end of file
+    self.assertIn('error', response.json())
+
+class DroneIngestTestCase(APITestCase):
+  def setUp(self):
+    # the zone index is process-wide and would keep zones of rolled back tests
+    no_fly_zone_index.invalidate()
+    self.addCleanup(no_fly_zone_index.invalidate)
+
+  def osd_message(self, longitude, latitude, height=20, speed=5):
+    return {
+      'longitude': longitude,
+      'latitude': latitude,
+      'height': height,
+      'horizontal_speed': speed
+    }
+
+  def test_batch_writer_drops_malformed_messages(self):
+    '''test that messages without a usable position, height or speed never reach a batch'''
+
+    writer = BatchWriter()
+    writer.submit('Drone_A', self.osd_message(35.1, 31.1))
+    writer.submit('Drone_B', {'longitude': 35.1, 'height': 20, 'horizontal_speed': 5})
+    writer.submit('Drone_C', self.osd_message(35.1, 'north'))
+    writer.submit('Drone_D', self.osd_message(200, 31.1))
+
+    self.assertEqual(writer.queue.qsize(), 1)
+    self.assertEqual(writer.queue.get()[0], 'Drone_A')
+
+  def test_process_drone_messages_batch(self):
+    '''test that a batch keeps every message as DroneData and only the latest message per drone on Drone'''
+
+    now = timezone.now()
+    messages = [
+      ('Drone_A', self.osd_message(35.1, 31.1), now - timedelta(seconds=2)),
+      ('Drone_B', self.osd_message(35.2, 31.2, speed=12), now - timedelta(seconds=1)),
+      ('Drone_A', self.osd_message(35.3, 31.3, height=600), now),
+    ]
+
+    drones_count = DroneService.process_drone_messages(messages)
+
+    self.assertEqual(drones_count, 2)
+    self.assertEqual(DroneData.objects.filter(drone_id='Drone_A').count(), 2)
+    self.assertEqual(DroneData.objects.filter(drone_id='Drone_B').count(), 1)
+
+    drone_a = Drone.objects.get(serial_number='Drone_A')
+    self.assertEqual(drone_a.last_location.x, 35.3)
+    self.assertEqual(drone_a.last_height, 600)
+    self.assertEqual(drone_a.last_seen, now)
+    self.assertTrue(drone_a.is_dangerous)
+
+    drone_b = Drone.objects.get(serial_number='Drone_B')
+    self.assertTrue(drone_b.is_dangerous)
+    self.assertEqual(drone_b.dangerous_reason, 'Moving faster than 10 m/s')
+
+  def test_no_fly_zone_classification(self):
+    '''test that points inside a no fly zone are dangerous and that zone changes are picked up'''
+
+    zone = NoFlyZone.objects.create(
+      name='Airport',
+      geometry=Polygon.from_bbox((35.0, 31.0, 36.0, 32.0))
+    )
+
+    self.assertEqual(
+      DroneService.classify_danger(20, 5, Point(35.5, 31.5)),
+      (True, 'Entering no fly zone: Airport')
+    )
+    self.assertEqual(DroneService.classify_danger(20, 5, Point(36.5, 31.5)), (False, None))
+
+    zone.delete()
+    self.assertEqual(DroneService.classify_danger(20, 5, Point(35.5, 31.5)), (False, None))
+
+  def test_classify_batch_matches_classify_danger(self):
+    '''test that batch classification gives the same flags and reasons as classifying one point at a time'''
+
+    NoFlyZone.objects.create(name='Airport', geometry=Polygon.from_bbox((35.0, 31.0, 36.0, 32.0)))
+    rows = [
+      (20, 5, 34.5, 31.5),
+      (600, 5, 34.5, 31.5),
+      (20, 15, 35.5, 31.5),
+      (None, None, 35.5, 31.5),
+      (700, 20, 35.5, 31.5),
+    ]
+
+    flags, reasons = DroneService.classify_danger_batch(*zip(*rows))
+
+    for (height, speed, lon, lat), flag, reason in zip(rows, flags, reasons):
+      self.assertEqual((bool(flag), reason), DroneService.classify_danger(height, speed, Point(lon, lat)))
+
+  def test_import_telemetry_rejects_invalid_lines(self):
+    '''test that an imported line without a numeric height stops the import at its line number'''
+
+    lines = [
+      {'serial_number': 'Drone_A', 'timestamp': '2024-01-01T00:00:00Z', 'data': self.osd_message(35.1, 31.1)},
+      {'serial_number': 'Drone_A', 'timestamp': '2024-01-01T00:00:01Z', 'data': self.osd_message(35.1, 31.1, height='high')},
+    ]
+    with tempfile.NamedTemporaryFile('w', suffix='.ndjson') as file:
+      file.write(''.join(json.dumps(line) + '\n' for line in lines))
+      file.flush()
+
+      with self.assertRaisesMessage(CommandError, f'{file.name}:2: invalid telemetry line: height must be a finite number'):
+        call_command('import_telemetry', file.name, stdout=StringIO())
+
+    self.assertFalse(DroneData.objects.filter(drone_id='Drone_A').exists())
+
+  @override_settings(DRONE_DATA_COPY=True)
+  def test_process_drone_messages_copy(self):
+    '''test that the COPY writer stores the same rows as the bulk insert, including payloads that need escaping'''
+
+    now = timezone.now()
+    message = self.osd_message(35.1, 31.1)
+    message['note'] = 'tab\there\\back\nline'
+    DroneService.process_drone_messages([('Drone_A', message, now)])
+
+    row = DroneData.objects.get(drone_id='Drone_A')
+    self.assertEqual(row.timestamp, now)
+    self.assertEqual((row.location.x, row.location.y), (35.1, 31.1))
+    self.assertEqual(row.raw_data, message)
+    self.assertFalse(row.is_dangerous)
+
+  @override_settings(DRONE_DATA_COMPACT_RAW=True)
+  def test_compact_raw_data_round_trip(self):
+    '''test that compacted payloads are rebuilt exactly, including integer coordinates and removed keys'''
+
+    now = timezone.now()
+    first = dict(self.osd_message(35.1, 31.1), height_limit=500, storage={'total': 64, 'used': 1}, gear=1)
+    second = dict(self.osd_message(35.2, 31.2), height_limit=500, storage={'total': 64, 'used': 2})
+    third = dict(self.osd_message(36, 31.3), mode='rth')
+    messages = [('Drone_A', first, now - timedelta(seconds=2)), ('Drone_A', second, now - timedelta(seconds=1))]
+
+    DroneService.process_drone_messages(messages)
+    DroneService.process_drone_message(serial_number='Drone_A', data=third)
+
+    rows = list(DroneData.objects.filter(drone_id='Drone_A').order_by('id'))
+    self.assertEqual([row.get_raw_data() for row in rows], [first, second, third])
+    self.assertNotIn('longitude', rows[0].raw_data)
+    self.assertEqual(rows[1].raw_data, {'storage': {'used': 2}, '$absent': ['gear']})
+    # the last payload differs in most keys, so it starts a new profile version
+    self.assertEqual(rows[2].profile.version, 2)
+
+  @override_settings(DRONE_PRESENCE_TRACKING=True)
+  def test_presence_tracker_transitions(self):
+    '''test that the tracker flags drones online when seen and offline once their deadline passes without a new message'''
+
+    now = timezone.now()
+    DroneService.process_drone_messages([('Drone_A', self.osd_message(35.1, 31.1), now)])
+    tracker = PresenceTracker()
+    started = now.timestamp()
+
+    tracker.seen('Drone_A', started)
+    tracker.flush(now=started)
+    self.assertEqual(list(DroneService.get_online_drones().values_list('serial_number', flat=True)), ['Drone_A'])
+
+    # seen again, so the first deadline only moves it to a new one
+    tracker.seen('Drone_A', started + 30)
+    tracker.flush(now=started + 61)
+    self.assertTrue(Drone.objects.get(pk='Drone_A').is_online)
+
+    tracker.flush(now=started + 91)
+    self.assertFalse(Drone.objects.get(pk='Drone_A').is_online)
+    self.assertEqual(
+      list(DronePresenceEvent.objects.filter(drone_id='Drone_A').order_by('timestamp').values_list('event', flat=True)),
+      ['online', 'offline']
+    )
+
+  @override_settings(DRONE_PRESENCE_TRACKING=True)
+  def test_stale_online_flag_is_ignored(self):
+    '''test that a drone left flagged online by a stopped tracker drops out once it hasn't reported for twice the online window'''
+
+    now = timezone.now()
+    Drone.objects.create(
+      serial_number='Drone_A', last_location=Point(35.1, 31.1, srid=4326), last_height=20, last_speed=5,
+      last_seen=now, is_online=True
+    )
+    Drone.objects.create(
+      serial_number='Drone_B', last_location=Point(35.2, 31.2, srid=4326), last_height=20, last_speed=5,
+      last_seen=now - timedelta(minutes=5), is_online=True
+    )
+
+    self.assertEqual(list(DroneService.get_online_drones().values_list('serial_number', flat=True)), ['Drone_A'])
+
+
+class DroneDataPartitionsTestCase(APITestCase):
+  def setUp(self):
+    self.drone = Drone.objects.create(
+      serial_number='Drone_P', last_location=Point(35.1, 31.1, srid=4326),
+      last_height=20, last_speed=5, last_seen=timezone.now()
+    )
+
+  def create_row(self, timestamp):
+    row = DroneData.objects.create(
+      drone=self.drone, location=Point(35.1, 31.1, srid=4326),
+      latitude=31.1, longitude=35.1, height=20, horizontal_speed=5, raw_data={}
+    )
+    DroneData.objects.filter(pk=row.pk).update(timestamp=timestamp)
+    return row.pk
+
+  def partition_of(self, pk):
+    with connection.cursor() as cursor:
+      cursor.execute('SELECT tableoid::regclass::text FROM drones_dronedata WHERE id = %s', [pk])
+      row = cursor.fetchone()
+    return row[0] if row else None
+
+  def partitions(self, **options):
+    out = StringIO()
+    call_command('dronedata_partitions', stdout=out, **options)
+    return out.getvalue()
+
+  def test_create_partition_moves_default_rows(self):
+    '''test that a new day's partition takes over that day's rows from the default partition, and a dry run changes nothing'''
+
+    day = timezone.now() + timedelta(days=12)
+    pk = self.create_row(day)
+    name = f'drones_dronedata_p{day:%Y%m%d}'
+    self.assertEqual(self.partition_of(pk), 'drones_dronedata_default')
+
+    output = self.partitions(days_ahead=12, retention_days=0, dry_run=True)
+    self.assertIn(f'Creating partition {name}', output)
+    self.assertIn(f'Would move 1 rows from drones_dronedata_default into {name}', output)
+    self.assertEqual(self.partition_of(pk), 'drones_dronedata_default')
+
+    output = self.partitions(days_ahead=12, retention_days=0)
+    self.assertIn(f'Moved 1 rows from drones_dronedata_default into {name}', output)
+    self.assertEqual(self.partition_of(pk), name)
+
+    # every day is covered now, so another run has nothing to do
+    self.assertEqual(self.partitions(days_ahead=12, retention_days=0), '')
+
+  def test_retention_drops_partitions_and_expired_rows(self):
+    '''test that expired partitions are dropped and expired rows deleted from the legacy and default partitions'''
+
+    now = timezone.now()
+    legacy_pk = self.create_row(now - timedelta(days=60))
+    recent_pk = self.create_row(now)
+    self.assertEqual(self.partition_of(legacy_pk), 'drones_dronedata_legacy')
+
+    output = self.partitions(days_ahead=0, retention_days=30, dry_run=True)
+    self.assertIn('Would delete 1 expired rows in drones_dronedata_legacy', output)
+    self.assertIsNotNone(self.partition_of(legacy_pk))
+
+    output = self.partitions(days_ahead=0, retention_days=30)
+    self.assertIn('Deleted 1 expired rows in drones_dronedata_legacy', output)
+    self.assertIsNone(self.partition_of(legacy_pk))
+    self.assertIsNotNone(self.partition_of(recent_pk))
+
+    # a month later, the daily partitions created by the migration have expired as well
+    tomorrow = now + timedelta(days=1)
+    with mock.patch('drones.management.commands.dronedata_partitions.timezone.now', return_value=now + timedelta(days=40)):
+      output = self.partitions(days_ahead=0, retention_days=30)
+    self.assertIn(f'Dropping partition drones_dronedata_p{tomorrow:%Y%m%d}', output)
+    with connection.cursor() as cursor:
+      cursor.execute('SELECT to_regclass(%s)', [f'drones_dronedata_p{tomorrow:%Y%m%d}'])
+      self.assertIsNone(cursor.fetchone()[0])
+
+
+class CachedJWTAuthenticationTestCase(APITestCase):
+  def setUp(self):
+    jwt_user_cache.clear()
+    self.user = User.objects.create_user(username='pilot', password='testpassword')
+    token = AccessToken.for_user(self.user)
+    self.request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {token}')
+
+  def test_cached_user_until_deactivated(self):
+    '''test that the user of a token is looked up once and dropped from the cache when deactivated'''
+
+    authentication = CachedJWTAuthentication()
+    user, _ = authentication.authenticate(self.request)
+    self.assertEqual(user.pk, self.user.pk)
+
+    with self.assertNumQueries(0):
+      user, _ = authentication.authenticate(self.request)
+    self.assertEqual(user.pk, self.user.pk)
+
+    self.user.is_active = False
+    self.user.save()
+
+    with self.assertRaises(AuthenticationFailed):
+      authentication.authenticate(self.request)
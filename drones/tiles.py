@@ -0,0 +1,79 @@
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from .models import Drone, NoFlyZone
+from .spatial import no_fly_zone_index
+
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+
+# the tile bounds are densified before the geography cast, geography edges are great circles
+# and would cut into the tile along its top and bottom edges
+BOUNDS_SQL = 'SELECT ST_TileEnvelope(%s, %s, %s) AS geom, ST_Segmentize(ST_Transform(ST_TileEnvelope(%s, %s, %s), 4326), 1)::geography AS geog'
+
+DRONE_LAYER_SQL = f'''
+  WITH bounds AS ({BOUNDS_SQL})
+  SELECT ST_AsMVT(tile, 'drones', {TILE_EXTENT}, 'geom')
+  FROM (
+    SELECT
+      ST_AsMVTGeom(ST_Transform(drone.last_location::geometry, 3857), bounds.geom, {TILE_EXTENT}, {TILE_BUFFER}) AS geom,
+      drone.serial_number,
+      drone.is_dangerous,
+      drone.dangerous_reason,
+      drone.last_height,
+      drone.last_speed,
+      extract(epoch FROM drone.last_seen)::bigint AS last_seen
+    FROM {Drone._meta.db_table} AS drone, bounds
+    WHERE ST_Intersects(drone.last_location, bounds.geog)
+  ) AS tile
+'''
+
+ZONE_LAYER_SQL = f'''
+  WITH bounds AS ({BOUNDS_SQL})
+  SELECT ST_AsMVT(tile, 'no_fly_zones', {TILE_EXTENT}, 'geom')
+  FROM (
+    SELECT
+      ST_AsMVTGeom(ST_Transform(zone.geometry::geometry, 3857), bounds.geom, {TILE_EXTENT}, {TILE_BUFFER}) AS geom,
+      zone.id,
+      zone.name
+    FROM {NoFlyZone._meta.db_table} AS zone, bounds
+    WHERE ST_Intersects(zone.geometry, bounds.geog)
+  ) AS tile
+'''
+
+
+def _render_layer(sql, z, x, y):
+  with connection.cursor() as cursor:
+    cursor.execute(sql, [z, x, y, z, x, y])
+    layer = cursor.fetchone()[0]
+  return bytes(layer) if layer else b''
+
+
+def drone_layer(z, x, y):
+  '''drone positions change every second, so the layer is only cached for DRONE_TILE_CACHE_SECONDS'''
+  cache_key = f'mvt:drones:{z}/{x}/{y}'
+  layer = cache.get(cache_key)
+  if layer is None:
+    layer = _render_layer(DRONE_LAYER_SQL, z, x, y)
+    cache.set(cache_key, layer, settings.DRONE_TILE_CACHE_SECONDS)
+  return layer
+
+
+def zone_layer(z, x, y):
+  '''cached under the no fly zone version, so edits to the zones never serve a stale layer'''
+  version = hashlib.md5(repr(no_fly_zone_index.get_version()).encode()).hexdigest()
+  cache_key = f'mvt:zones:{version}:{z}/{x}/{y}'
+  layer = cache.get(cache_key)
+  if layer is None:
+    layer = _render_layer(ZONE_LAYER_SQL, z, x, y)
+    cache.set(cache_key, layer, settings.NO_FLY_ZONE_TILE_CACHE_SECONDS)
+  return layer
+
+
+def render_tile(z, x, y):
+  '''
+  Builds a Mapbox Vector Tile with a drones and a no_fly_zones layer. Each layer is an
+  encoded tile of its own, and tiles concatenate into one tile holding both layers.
+  '''
+  return drone_layer(z, x, y) + zone_layer(z, x, y)
@@ -1,12 +1,17 @@
 from django.urls import path
-from .views import ListDronesView, ListOnlineDronesView, DronesWithin5KmView, DangerousDronesView, DroneFlightPathView, DroneDetailView, DroneStatsView
+from .views import ListDronesView, ListOnlineDronesView, DronesWithin5KmView, DangerousDronesView, DroneFlightPathView, DroneDetailView, DroneStatsView, DroneRollupsView, DroneFeedView, DroneSpatialQueryView, DroneClustersView, DroneTileView
 
 urlpatterns = [
   path('', ListDronesView.as_view(), name='drones-list'),
   path('online/', ListOnlineDronesView.as_view(), name='online-drones-list'),
   path('within-5km/', DronesWithin5KmView.as_view(), name='drones-within-5km-from-point'),
+  path('nearby/', DroneSpatialQueryView.as_view(), name='drones-nearby'),
+  path('clusters/', DroneClustersView.as_view(), name='drone-clusters'),
+  path('tiles/<int:z>/<int:x>/<int:y>.mvt', DroneTileView.as_view(), name='drone-tile'),
   path('dangerous/', DangerousDronesView.as_view(), name='dangerous-drones-list'),
   path('<str:serial_number>/flight-path/', DroneFlightPathView.as_view(), name='drone-flight-path'),
+  path('<str:serial_number>/rollups/', DroneRollupsView.as_view(), name='drone-rollups'),
+  path('feed/', DroneFeedView.as_view(), name='drone-feed'),
   path('stats/', DroneStatsView.as_view(), name='drone-stats'),
   path('<str:serial_number>/', DroneDetailView.as_view(), name='drone-detail'),
 ]
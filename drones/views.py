@@ -1,13 +1,36 @@
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.conf import settings
+from datetime import timedelta
 from rest_framework.generics import ListAPIView
-from .models import Drone, DroneData
-from .serializers import DroneSerializer, DangerousDroneSerializer
+from .models import Drone, DroneData, DroneRollup
+from .serializers import DroneSerializer, DangerousDroneSerializer, DroneRollupSerializer, DroneDistanceSerializer, render_drone_rows
 from django.contrib.gis.geos import Point
 from rest_framework.views import APIView
 from drf_spectacular.utils import extend_schema, OpenApiParameter, OpenApiTypes
-from .services import DroneService, validate_coordinate_params
+from .services import DroneService, ONLINE_WINDOW, validate_coordinate_params, validate_flight_path_params, validate_simplification_params, validate_search_params, validate_spatial_query_params, validate_cluster_params, validate_tile_coordinates, parse_datetime_param, parse_bbox_param
 from rest_framework.generics import RetrieveUpdateDestroyAPIView
+from rest_framework.renderers import JSONRenderer
+from .renderers import EventStreamRenderer
+from .feed import drone_feed_hub
+from .state_store import drone_state_store, rendered_list_response
+from .tiles import render_tile
+from .pagination import DroneCursorPagination, OnlineDroneCursorPagination
+from .etags import fleet_etag, online_fleet_etag, drone_etag
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import etag
+
+
+class FastDroneListMixin:
+  '''renders unpaginated drone lists with render_drone_rows instead of DroneSerializer'''
+  def list(self, request, *args, **kwargs):
+    if settings.DRONE_FAST_LIST_RENDERING and not self.pagination_class.is_requested(request):
+      return rendered_list_response(render_drone_rows(self.filter_queryset(self.get_queryset())))
+
+    return super().list(request, *args, **kwargs)
+
 
 @extend_schema(
     parameters=[
@@ -23,10 +46,34 @@ from rest_framework.generics import RetrieveUpdateDestroyAPIView
         location=OpenApiParameter.QUERY,
         required=False, 
       ),
+      OpenApiParameter(
+        name='search',
+        type=OpenApiTypes.STR,
+        location=OpenApiParameter.QUERY,
+        required=False,
+        description='Case-insensitive serial number search, returns at most limit drones'
+      ),
+      OpenApiParameter(
+        name='search_mode',
+        type=OpenApiTypes.STR,
+        location=OpenApiParameter.QUERY,
+        required=False,
+        enum=['prefix', 'substring', 'fuzzy'],
+        description='substring by default, fuzzy ranks typo-tolerant matches by trigram similarity'
+      ),
+      OpenApiParameter(
+        name='limit',
+        type=OpenApiTypes.INT,
+        location=OpenApiParameter.QUERY,
+        required=False,
+        description='Maximum number of search results, 20 by default and at most 100'
+      ),
     ]
 )
-class ListDronesView(ListAPIView):
+@method_decorator(etag(fleet_etag), name='get')
+class ListDronesView(FastDroneListMixin, ListAPIView):
   serializer_class = DroneSerializer
+  pagination_class = DroneCursorPagination
   
   def get_queryset(self):
     queryset = Drone.objects.all()
@@ -41,13 +88,36 @@ class ListDronesView(ListAPIView):
     
     return queryset
 
+  def list(self, request, *args, **kwargs):
+    if 'search' in request.query_params:
+      search, mode, limit = validate_search_params(request.query_params)
+      drones = DroneService.search_drones(search, mode=mode, limit=limit)
+      return Response(self.get_serializer(drones, many=True).data)
+
+    if not any(name in request.query_params for name in ['serial', 'partial_serial']) and not DroneCursorPagination.is_requested(request):
+      states = drone_state_store.list_all()
+      if states is not None:
+        return rendered_list_response(states)
+
+    return super().list(request, *args, **kwargs)
 
-class ListOnlineDronesView(ListAPIView):
+
+@method_decorator(etag(online_fleet_etag), name='get')
+class ListOnlineDronesView(FastDroneListMixin, ListAPIView):
   serializer_class = DroneSerializer
+  pagination_class = OnlineDroneCursorPagination
 
   def get_queryset(self):
     return DroneService.get_online_drones()
 
+  def list(self, request, *args, **kwargs):
+    if not OnlineDroneCursorPagination.is_requested(request):
+      states = drone_state_store.list_online(timezone.now() - ONLINE_WINDOW)
+      if states is not None:
+        return rendered_list_response(states)
+
+    return super().list(request, *args, **kwargs)
+
 
 @extend_schema(
     parameters=[
@@ -65,8 +135,10 @@ class ListOnlineDronesView(ListAPIView):
       ),
     ]
 )
-class DronesWithin5KmView(ListAPIView):
+@method_decorator(etag(fleet_etag), name='get')
+class DronesWithin5KmView(FastDroneListMixin, ListAPIView):
   serializer_class = DroneSerializer
+  pagination_class = DroneCursorPagination
 
   def get_queryset(self):
     target_longitude, target_latitude = validate_coordinate_params(self.request.query_params)
@@ -79,39 +151,257 @@ class DronesWithin5KmView(ListAPIView):
     return queryset
 
 
+@extend_schema(
+    parameters=[
+      OpenApiParameter(
+        name='longitude',
+        type=OpenApiTypes.FLOAT,
+        location=OpenApiParameter.QUERY,
+        required=False,
+        description='Query point, required with radius and k'
+      ),
+      OpenApiParameter(
+        name='latitude',
+        type=OpenApiTypes.FLOAT,
+        location=OpenApiParameter.QUERY,
+        required=False,
+        description='Query point, required with radius and k'
+      ),
+      OpenApiParameter(
+        name='radius',
+        type=OpenApiTypes.FLOAT,
+        location=OpenApiParameter.QUERY,
+        required=False,
+        description='Drones within this many meters of the point'
+      ),
+      OpenApiParameter(
+        name='bbox',
+        type=OpenApiTypes.STR,
+        location=OpenApiParameter.QUERY,
+        required=False,
+        description='Drones inside min_lon,min_lat,max_lon,max_lat'
+      ),
+      OpenApiParameter(
+        name='k',
+        type=OpenApiTypes.INT,
+        location=OpenApiParameter.QUERY,
+        required=False,
+        description='The k drones nearest to the point, at most 1000'
+      ),
+      OpenApiParameter(
+        name='online',
+        type=OpenApiTypes.BOOL,
+        location=OpenApiParameter.QUERY,
+        required=False,
+        description='Only drones seen in the last minute'
+      ),
+      OpenApiParameter(
+        name='limit',
+        type=OpenApiTypes.INT,
+        location=OpenApiParameter.QUERY,
+        required=False
+      ),
+    ]
+)
+@method_decorator(etag(online_fleet_etag), name='get')
+class DroneSpatialQueryView(ListAPIView):
+  '''Drones by radius, bbox or k nearest, ordered by distance and with the distance in meters when a point is given'''
+  serializer_class = DroneDistanceSerializer
+
+  def get_queryset(self):
+    return DroneService.query_drones_spatial(**validate_spatial_query_params(self.request.query_params))
+
+
+@extend_schema(
+    parameters=[
+      OpenApiParameter(
+        name='since',
+        type=OpenApiTypes.DATETIME,
+        location=OpenApiParameter.QUERY,
+        required=False
+      ),
+      OpenApiParameter(
+        name='until',
+        type=OpenApiTypes.DATETIME,
+        location=OpenApiParameter.QUERY,
+        required=False
+      ),
+      OpenApiParameter(
+        name='limit',
+        type=OpenApiTypes.INT,
+        location=OpenApiParameter.QUERY,
+        required=False
+      ),
+      OpenApiParameter(
+        name='tolerance',
+        type=OpenApiTypes.FLOAT,
+        location=OpenApiParameter.QUERY,
+        required=False,
+        description='Simplify the path with this tolerance in degrees'
+      ),
+      OpenApiParameter(
+        name='zoom',
+        type=OpenApiTypes.INT,
+        location=OpenApiParameter.QUERY,
+        required=False,
+        description='Simplify the path for this web map zoom level'
+      ),
+    ]
+)
 class DroneFlightPathView(APIView):
   def get(self, request, serial_number, *args, **kwargs):
     serial = self.kwargs['serial_number']
     drone = get_object_or_404(Drone, serial_number=serial)
+    since, until, limit = validate_flight_path_params(request.query_params)
+    tolerance = validate_simplification_params(request.query_params)
 
-    flight_path = DroneService.get_flight_path(drone)
+    if tolerance:
+      flight_path = DroneService.get_simplified_flight_path(drone, tolerance, since=since, until=until, limit=limit)
+      return HttpResponse(flight_path, content_type='application/json')
 
-    if not flight_path:
-      return Response({"detail": "This drone has no flight path data yet."}, status=204)
-  
-    return Response(flight_path)
+    points = DroneService.get_flight_path_points(drone, since=since, until=until, limit=limit)
+
+    return StreamingHttpResponse(DroneService.stream_flight_path(points), content_type='application/json')
+
+
+@extend_schema(
+    parameters=[
+      OpenApiParameter(
+        name='since',
+        type=OpenApiTypes.DATETIME,
+        location=OpenApiParameter.QUERY,
+        required=False,
+        description='Defaults to one hour before until'
+      ),
+      OpenApiParameter(
+        name='until',
+        type=OpenApiTypes.DATETIME,
+        location=OpenApiParameter.QUERY,
+        required=False,
+        description='Defaults to now'
+      ),
+    ]
+)
+class DroneRollupsView(ListAPIView):
+  serializer_class = DroneRollupSerializer
 
+  def get_queryset(self):
+    drone = get_object_or_404(Drone, serial_number=self.kwargs['serial_number'])
+    until = parse_datetime_param(self.request.query_params, 'until') or timezone.now()
+    since = parse_datetime_param(self.request.query_params, 'since') or until - timedelta(hours=1)
+
+    return DroneRollup.objects.filter(drone=drone, minute__gte=since, minute__lte=until).order_by('minute')
 
-class DangerousDronesView(ListAPIView):
+
+@method_decorator(etag(fleet_etag), name='get')
+class DangerousDronesView(FastDroneListMixin, ListAPIView):
   serializer_class = DroneSerializer
+  pagination_class = DroneCursorPagination
   queryset = Drone.objects.filter(is_dangerous=True)
 
+  def list(self, request, *args, **kwargs):
+    if not DroneCursorPagination.is_requested(request):
+      states = drone_state_store.list_dangerous()
+      if states is not None:
+        return rendered_list_response(states)
+
+    return super().list(request, *args, **kwargs)
 
 
+
+@extend_schema(
+    parameters=[
+      OpenApiParameter(
+        name='bbox',
+        type=OpenApiTypes.STR,
+        location=OpenApiParameter.QUERY,
+        required=False,
+        description='Only send drones inside min_lon,min_lat,max_lon,max_lat'
+      ),
+      OpenApiParameter(
+        name='serial',
+        type=OpenApiTypes.STR,
+        location=OpenApiParameter.QUERY,
+        required=False,
+        description='Only send these comma separated serial numbers'
+      ),
+    ]
+)
+class DroneFeedView(APIView):
+  '''Server-sent events stream of drone state changes, needs the ASGI server to serve many clients'''
+  renderer_classes = [JSONRenderer, EventStreamRenderer]
+
+  def get(self, request):
+    bbox = parse_bbox_param(request.query_params)
+    serial = request.query_params.get('serial')
+    serials = set(serial.split(',')) if serial else None
+
+    response = StreamingHttpResponse(drone_feed_hub.stream(bbox=bbox, serials=serials), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@extend_schema(
+    parameters=[
+      OpenApiParameter(
+        name='bbox',
+        type=OpenApiTypes.STR,
+        location=OpenApiParameter.QUERY,
+        required=True,
+        description='Viewport as min_lon,min_lat,max_lon,max_lat'
+      ),
+      OpenApiParameter(
+        name='zoom',
+        type=OpenApiTypes.INT,
+        location=OpenApiParameter.QUERY,
+        required=True,
+        description='Web map zoom level, sets the clustering grid size'
+      ),
+      OpenApiParameter(
+        name='online',
+        type=OpenApiTypes.BOOL,
+        location=OpenApiParameter.QUERY,
+        required=False,
+        description='Only drones seen in the last minute'
+      ),
+    ]
+)
+@method_decorator(etag(online_fleet_etag), name='get')
+class DroneClustersView(APIView):
+  '''Drones in a viewport, aggregated into grid clusters when there are too many to draw one by one'''
+  def get(self, request):
+    bbox, zoom, online = validate_cluster_params(request.query_params)
+    return Response(DroneService.get_drone_clusters(bbox, zoom, online=online))
+
+
+class DroneTileView(APIView):
+  '''Mapbox Vector Tile with a drones layer and a no_fly_zones layer'''
+  def get(self, request, z, x, y):
+    validate_tile_coordinates(z, x, y)
+
+    response = HttpResponse(render_tile(z, x, y), content_type='application/vnd.mapbox-vector-tile')
+    response['Cache-Control'] = f'private, max-age={settings.DRONE_TILE_CACHE_SECONDS}'
+    return response
+
+
+@method_decorator(etag(drone_etag), name='get')
 class DroneDetailView(RetrieveUpdateDestroyAPIView):
   queryset = Drone.objects.all()
   serializer_class = DroneSerializer
   lookup_field = 'serial_number'
 
 
+@method_decorator(etag(online_fleet_etag), name='get')
 class DroneStatsView(APIView):
   def get(self, request):
-    total = Drone.objects.count()
-    online = DroneService.get_online_drones().count()
-    dangerous = Drone.objects.filter(is_dangerous=True).count()
-    
+    if settings.DRONE_STATS_MODE == 'counters':
+      stats = DroneService.get_counter_stats()
+    else:
+      stats = DroneService.get_stats()
+
     return Response({
-             "total": total,
-             "online": online,
-             "dangerous": dangerous
+             "total": stats['total'],
+             "online": stats['online'],
+             "dangerous": stats['dangerous']
            })
@@ -6,6 +6,8 @@ import random
 import argparse
 import math
 import ssl
+import multiprocessing
+import queue
 from paho import mqtt
 import paho.mqtt.client as paho
 from decouple import config
@@ -13,6 +15,9 @@ from decouple import config
 # Earth's radius in meters
 EARTH_RADIUS_METERS = 6378137 
 
+# Seconds a load test worker waits for its queued publishes to go out before disconnecting
+LOAD_DRAIN_TIMEOUT = 30
+
 class SimulatedDrone:
   """
   A class to simulate a single drone with more natural movement.
@@ -102,10 +107,11 @@ def random_string(len=22):
   chars = string.ascii_uppercase + string.digits
   return ''.join(random.choices(chars, k=len))
       
-def main(count=3, delay=2, broker=config('MQTT_BROKER_HOST')):
+def main(count=3, delay=2, broker=None):
   """
   Main function to create drones and publish their data.
   """
+  broker = broker or config('MQTT_BROKER_HOST')
   print(f"Starting simulation with {count} drones...")
   print(f"Publishing to MQTT broker at {broker}:1883 every {delay} seconds.")
   
@@ -139,11 +145,176 @@ def main(count=3, delay=2, broker=config('MQTT_BROKER_HOST')):
 
     time.sleep(delay)
 
+
+class TokenBucket:
+  """
+  Rate limiter allowing `rate` operations per second with bursts of up to `capacity`.
+  """
+  def __init__(self, rate, capacity):
+    self.rate = rate
+    self.capacity = capacity
+    self.tokens = capacity
+    self.updated = time.monotonic()
+
+  def acquire(self):
+    """
+    Blocks until a token is available and takes it.
+    """
+    while True:
+      now = time.monotonic()
+      self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+      self.updated = now
+
+      if self.tokens >= 1:
+        self.tokens -= 1
+        return
+
+      time.sleep((1 - self.tokens) / self.rate)
+
+
+def run_load_worker(worker_id, count, rate, duration, qos, compact, broker, seed, results):
+  """
+  Publishes telemetry for `count` drones over one persistent connection at `rate` messages per second.
+  Always puts (worker_id, published, acknowledged, errors, elapsed, failure) on the results queue,
+  failure being None or the error the worker stopped on.
+  """
+  random.seed(seed + worker_id)
+  drones = [SimulatedDrone(random_string()) for _ in range(count)]
+  # the simulated time step matches how often each drone gets to publish
+  step = count / rate
+
+  acknowledged = 0
+  def on_publish(client, userdata, mid, reason_code, properties):
+    nonlocal acknowledged
+    acknowledged += 1
+
+  published = 0
+  errors = 0
+  failure = None
+  client = None
+  started = time.monotonic()
+  elapsed = 0
+
+  try:
+    client = paho.Client(paho.CallbackAPIVersion.VERSION2)
+    client.tls_set(tls_version=ssl.PROTOCOL_TLS)
+    client.username_pw_set(config('MQTT_BROKER_USERNAME'), config('MQTT_BROKER_PASSWORD'))
+    client.max_inflight_messages_set(1000)
+    client.on_publish = on_publish
+    client.connect(broker, int(config('MQTT_BROKER_PORT')), 60)
+    client.loop_start()
+
+    bucket = TokenBucket(rate, capacity=max(1, rate / 10))
+    started = time.monotonic()
+
+    while time.monotonic() - started < duration:
+      for drone in drones:
+        bucket.acquire()
+        drone.update(step)
+        data = drone.generate_data()
+
+        if compact:
+          payload = json.dumps(data, separators=(',', ':'))
+        else:
+          payload = json.dumps(data, indent=2)
+
+        info = client.publish(f"thing/product/{drone.serial}/osd", payload, qos=qos)
+        if info.rc == paho.MQTT_ERR_SUCCESS:
+          published += 1
+        else:
+          errors += 1
+
+    elapsed = time.monotonic() - started
+
+    # let the network loop send what is queued and, with QoS > 0, collect the broker's acks
+    drain_started = time.monotonic()
+    while acknowledged < published and time.monotonic() - drain_started < LOAD_DRAIN_TIMEOUT:
+      time.sleep(0.1)
+  except Exception as e:
+    failure = repr(e)
+    elapsed = elapsed or time.monotonic() - started
+  finally:
+    if client is not None:
+      client.loop_stop()
+      client.disconnect()
+    results.put((worker_id, published, acknowledged, errors, elapsed, failure))
+
+
+def load_test(count, rate, workers, duration, qos, compact, broker, seed=0):
+  """
+  Shards the drones across worker processes, each keeping one connection open and
+  publishing its share of the target rate, then reports the achieved rate and errors.
+  """
+  print(f"Load test: {count} drones, {rate} msg/s target, {workers} workers, QoS {qos}, {duration}s against {broker}")
+
+  results = multiprocessing.Queue()
+  processes = []
+  for worker_id in range(workers):
+    worker_count = count // workers + (1 if worker_id < count % workers else 0)
+    if worker_count == 0:
+      continue
+    process = multiprocessing.Process(
+      target=run_load_worker,
+      args=(worker_id, worker_count, rate * worker_count / count, duration, qos, compact, broker, seed, results)
+    )
+    process.start()
+    processes.append(process)
+
+  totals = []
+  while len(totals) < len(processes):
+    # once every worker has exited, whatever they put is already readable
+    exited = not any(process.is_alive() for process in processes)
+    try:
+      totals.append(results.get(timeout=1))
+    except queue.Empty:
+      if exited:
+        break
+  for process in processes:
+    process.join()
+
+  reported = {result[0] for result in totals}
+  for worker_id, process in enumerate(processes):
+    if worker_id not in reported:
+      print(f"Worker {worker_id} exited with code {process.exitcode} without reporting")
+  for result in totals:
+    if result[5]:
+      print(f"Worker {result[0]} stopped early: {result[5]}")
+  if not totals:
+    return
+
+  published = sum(result[1] for result in totals)
+  acknowledged = sum(result[2] for result in totals)
+  errors = sum(result[3] for result in totals)
+  elapsed = max(result[4] for result in totals) or 1
+
+  print(f"Published {published} messages in {elapsed:.1f}s: {published / elapsed:.0f} msg/s achieved, {errors} publish errors")
+  if qos > 0:
+    print(f"{acknowledged} messages acknowledged by the broker")
+
+
 if __name__ == "__main__":
   parser = argparse.ArgumentParser(description="Simulate drone telemetry data and publish to MQTT.")
   parser.add_argument("--count", type=int, default=3, help="Number of drones to simulate.")
   parser.add_argument("--delay", type=int, default=2, help="Delay between message batches (in seconds).")
   parser.add_argument("--broker", type=str, default="mosquitto", help="Hostname of the MQTT broker.")
+  parser.add_argument("--rate", type=float, help="Load test mode: target total messages per second.")
+  parser.add_argument("--workers", type=int, default=1, help="Load test mode: number of publishing processes.")
+  parser.add_argument("--duration", type=float, default=60, help="Load test mode: seconds to run for.")
+  parser.add_argument("--qos", type=int, choices=[0, 1, 2], default=0, help="Load test mode: MQTT QoS level.")
+  parser.add_argument("--compact", action="store_true", help="Load test mode: publish non-indented JSON.")
+  parser.add_argument("--seed", type=int, default=0, help="Load test mode: random seed for the simulated drones.")
   args = parser.parse_args()
 
-  main(count=args.count, delay=args.delay, broker=args.broker)
+  if args.rate:
+    load_test(
+      count=args.count,
+      rate=args.rate,
+      workers=args.workers,
+      duration=args.duration,
+      qos=args.qos,
+      compact=args.compact,
+      broker=args.broker,
+      seed=args.seed
+    )
+  else:
+    main(count=args.count, delay=args.delay, broker=args.broker)
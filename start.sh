@@ -2,7 +2,9 @@
 
 python manage.py migrate
 python manage.py collectstatic --no-input
+python manage.py dronedata_partitions
 
-python manage.py mqtt_listener &
+python manage.py mqtt_listener --workers ${MQTT_LISTENER_WORKERS:-1} &
+python manage.py rollup_telemetry --interval 60 &
 
-gunicorn backend_task.wsgi:application --bind 0.0.0.0:$PORT
+gunicorn backend_task.asgi:application -k uvicorn.workers.UvicornWorker --bind 0.0.0.0:$PORT